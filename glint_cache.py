@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Read-through cache of the files of the network share on a local disk.
+
+Reprocessing a night with different settings reads the same datacubes and
+calibration files again and again from the network share.
+When a cache is set (with ``setCache`` or the environment variable ``GLINT_CACHE_DIR``),
+every file read through ``cachedPath`` is copied once on the local disk and the local copy is used afterwards.
+
+A copy is identified by the path, the size and the date of modification of the original file
+so a modified file is copied again.
+The size of the cache is capped: the least recently used copies are deleted first.
+A copy read through ``pinnedPath`` is not deleted while it is in use.
+The pins only hold in the process: a process sharing the folder of the cache may delete a copy
+another one is about to open, the copy is then made again at the next read.
+A copy deleted once opened stays readable until it is closed.
+
+The libraries :doc:`glint_classes` and :doc:`glint_fitting_functions` read their files through it.
+"""
+
+import numpy as np
+import os
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+class DiskCache(object):
+    """
+    Read-through cache of files on a local disk, with LRU eviction.
+
+    :Parameters:
+        **cache_dir**: str
+            Local folder where the copies are stored. It is created if it does not exist.
+
+        **max_size**: float (optional)
+            Maximum size of the cache, in bytes.
+    """
+    def __init__(self, cache_dir, max_size=100e9):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        # Copies already in the cache, from the least to the most recently used
+        entries = [entry for entry in os.scandir(cache_dir) if entry.is_file() and not entry.name.endswith('.tmp')]
+        entries = sorted(entries, key=lambda entry: entry.stat().st_mtime)
+        self._entries = OrderedDict([(entry.path, entry.stat().st_size) for entry in entries])
+        self._size = sum(self._entries.values())
+        self._pins = {} # Number of users of the copies in use
+
+    def _key(self, path, stat):
+        """
+        Name of the copy of the file at ``path``.
+        """
+        key = '%s|%s|%s'%(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        key = hashlib.sha1(key.encode()).hexdigest()
+        return key + os.path.splitext(path)[1]
+
+    def _evict(self, size):
+        """
+        Deletes the least recently used copies until ``size`` bytes can be added.
+        """
+        for local in list(self._entries):
+            if self._size + size <= self.max_size:
+                break
+            if local in self._pins: # In use
+                continue
+            local_size = self._entries.pop(local)
+            try:
+                os.remove(local)
+            except OSError: # Already removed or still opened
+                pass
+            self._size -= local_size
+
+    def _pin(self, local, pin):
+        """
+        Counts a new user of the copy ``local`` if ``pin`` is ``True``.
+        """
+        if pin:
+            self._pins[local] = self._pins.get(local, 0) + 1
+
+    def release(self, local):
+        """
+        Releases a copy given by ``getPath`` with ``pin=True``, which can then be evicted.
+
+        :Parameters:
+            **local**: str
+                Path of the local copy.
+        """
+        with self._lock:
+            if local in self._pins:
+                self._pins[local] -= 1
+                if self._pins[local] == 0:
+                    del self._pins[local]
+
+    def _isCached(self, local):
+        """
+        Tells if the copy ``local`` is in the cache, dropping its entry if
+        it was deleted out of the cache (by hand or by another process).
+        """
+        if not local in self._entries:
+            return False
+        try:
+            os.utime(local) # Keep track of the order of use between runs
+        except OSError:
+            self._size -= self._entries.pop(local)
+            return False
+        self._entries.move_to_end(local)
+        return True
+
+    def getPath(self, path, pin=False):
+        """
+        Gives the path of the local copy of a file, copying it first if needed.
+
+        :Parameters:
+            **path**: str
+                Path of the file on the share.
+
+            **pin**: bool (optional)
+                If ``True``, the copy is not evicted until it is released with ``release``.
+
+        :Returns:
+            Path of the local copy.
+            The original path is returned if the file is larger than the cache.
+        """
+        stat = os.stat(path)
+        if stat.st_size > self.max_size:
+            return path
+
+        local = os.path.join(self.cache_dir, self._key(path, stat))
+        with self._lock:
+            if self._isCached(local):
+                self._pin(local, pin)
+                return local
+
+        # The copy is written under a temporary name so a partial copy is never used
+        tmp = local + '.%s.tmp'%(threading.get_ident())
+        shutil.copyfile(path, tmp)
+        with self._lock:
+            if self._isCached(local): # Copied meanwhile by another thread
+                os.remove(tmp)
+            else:
+                self._evict(stat.st_size)
+                os.replace(tmp, local)
+                self._entries[local] = stat.st_size
+                self._size += stat.st_size
+            self._pin(local, pin)
+        return local
+
+
+_cache = None
+
+def setCache(cache_dir, max_size=100e9):
+    """
+    Sets the cache used by ``cachedPath``.
+
+    :Parameters:
+        **cache_dir**: str or None
+            Local folder of the cache. If ``None``, the cache is deactivated.
+
+        **max_size**: float (optional)
+            Maximum size of the cache, in bytes.
+    """
+    global _cache
+    if cache_dir is None:
+        _cache = None
+    else:
+        _cache = DiskCache(cache_dir, max_size)
+
+def cachedPath(path):
+    """
+    Gives the path to read a file from, going through the cache if one is set.
+
+    :Parameters:
+        **path**: str
+            Path of the file on the share.
+
+    :Returns:
+        Path of the local copy, or ``path`` if there is no cache.
+    """
+    if _cache is None:
+        return path
+    return _cache.getPath(path)
+
+@contextmanager
+def pinnedPath(path):
+    """
+    Gives the path to read a file from, like ``cachedPath``, in a ``with`` statement:
+    the local copy is not evicted before the end of the statement.
+
+    :Parameters:
+        **path**: str
+            Path of the file on the share.
+
+    :Returns:
+        Path of the local copy, or ``path`` if there is no cache.
+    """
+    cache = _cache
+    if cache is None:
+        yield path
+        return
+    local = cache.getPath(path, pin=True)
+    try:
+        yield local
+    finally:
+        cache.release(local)
+
+def loadNpy(path, **kwargs):
+    """
+    Loads a numpy-format file (e.g. calibration products) through the cache.
+
+    :Parameters:
+        **path**: str
+            Path of the file on the share.
+
+        **kwargs**: optional
+            Keywords of ``np.load``.
+
+    :Returns:
+        Loaded array.
+    """
+    with pinnedPath(path) as local:
+        return np.load(local, **kwargs)
+
+if 'GLINT_CACHE_DIR' in os.environ:
+    setCache(os.environ['GLINT_CACHE_DIR'], float(os.environ.get('GLINT_CACHE_SIZE', 100e9)))
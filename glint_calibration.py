@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Bundle of the calibration products of GLINT in a single HDF5 file.
+
+A reduction run needs the average dark (``superdark.npy``), the dark per channel (``superdarkchannel.npy``),
+the geometric calibration (``pattern_coeff.npy``), the spectral calibration (``*_wl_to_px.npy`` and ``*_px_to_wl.npy``)
+and the zeta coefficients (HDF5 file from ``glint_zeta_coeff``).
+Reading them as separate files means as many small reads on the network share per run and per worker.
+
+The bundle gathers them in one file:
+    * the datasets ``superdark``, ``superdarkchannel``, ``pattern_coeff``, ``wl_to_px`` and ``px_to_wl``;
+    * the group ``zeta`` with the datasets of the zeta coefficients file (``wl_scale``, ``b1null1``...);
+    * the attributes ``format`` and ``version`` of the format of the bundle.
+
+Every dataset is stored contiguous and uncompressed so the loader memory-maps it instead of reading it.
+The bundle is mapped once per process (``loadBundle``) and the mapped pages are shared by all the processes
+reading the same bundle, through the cache of the operating system.
+The bundle is read through :doc:`glint_cache` so it is copied once from the share when a cache is set.
+
+The bundle is created by running this module as a script.
+The settings are in the ``Settings`` section:
+    * **bundle_path**: str, path of the bundle to create
+    * **dark_path**: str, folder of ``superdark.npy`` and ``superdarkchannel.npy``
+    * **geometric_calibration_path**: str, folder of ``pattern_coeff.npy``
+    * **wl_to_px_path**: str, path of the spectral calibration from wavelength to pixel
+    * **px_to_wl_path**: str, path of the spectral calibration from pixel to wavelength
+    * **zeta_coeff_path**: str, path of the zeta coefficients file. If ``None``, the bundle has no zeta coefficients
+
+The file of the bundle can be given to ``gff.get_zeta_coeff`` in place of the zeta coefficients file.
+"""
+
+import numpy as np
+import os
+import h5py
+import glint_cache
+
+bundle_format = 'glint_calibration'
+bundle_version = 1
+products = ['superdark', 'superdarkchannel', 'pattern_coeff', 'wl_to_px', 'px_to_wl']
+
+def writeBundle(path, superdark=None, superdarkchannel=None, pattern_coeff=None, wl_to_px=None, px_to_wl=None, zeta_coeff=None):
+    """
+    Writes the calibration products in a bundle.
+    The products set to ``None`` are not written.
+
+    :Parameters:
+        **path**: str
+            Path of the bundle.
+        **superdark**: 2d-array (optional)
+            Average dark.
+        **superdarkchannel**: 3d-array (optional)
+            Average dark per channel.
+        **pattern_coeff**: 3d-array (optional)
+            Coefficients of the geometric calibration.
+        **wl_to_px**, **px_to_wl**: 2d-array (optional)
+            Coefficients of the spectral calibration.
+        **zeta_coeff**: dict (optional)
+            Zeta coefficients, with the same keys as the file written by ``glint_zeta_coeff``.
+    """
+    arrays = {'superdark':superdark, 'superdarkchannel':superdarkchannel, 'pattern_coeff':pattern_coeff,
+              'wl_to_px':wl_to_px, 'px_to_wl':px_to_wl}
+    tmp = path + '.tmp'
+    with h5py.File(tmp, 'w') as f:
+        f.attrs['format'] = bundle_format
+        f.attrs['version'] = bundle_version
+        for key in products:
+            if arrays[key] is not None:
+                f.create_dataset(key, data=np.ascontiguousarray(arrays[key])) # No chunk nor filter: contiguous on disk
+        if zeta_coeff is not None:
+            grp = f.create_group('zeta')
+            for key in zeta_coeff.keys():
+                grp.create_dataset(key, data=np.ascontiguousarray(zeta_coeff[key]))
+    os.replace(tmp, path) # A bundle being written is never loaded
+
+def readZetaFile(path):
+    """
+    Reads the zeta coefficients file written by ``glint_zeta_coeff``.
+
+    :Parameters:
+        **path**: str
+            Path of the file.
+
+    :Returns:
+        Dictionary of the zeta coefficients.
+    """
+    with glint_cache.pinnedPath(path) as local, h5py.File(local, 'r') as f:
+        return {key:np.array(f[key]) for key in f.keys()}
+
+def _mapDataset(path, dset):
+    """
+    Memory-maps a dataset of a HDF5 file, or reads it if it is not contiguous.
+    """
+    offset = dset.id.get_offset()
+    if offset is None or dset.chunks is not None or dset.size == 0:
+        return dset[()]
+    return np.memmap(path, dtype=dset.dtype, mode='r', offset=offset, shape=dset.shape, order='C')
+
+class CalibrationBundle(object):
+    """
+    Calibration products of a bundle, memory-mapped.
+    The arrays are read-only.
+
+    :Parameters:
+        **path**: str
+            Path of the bundle.
+
+    :Attributes:
+        **version**: int
+            Version of the format of the bundle.
+        **zeta**: dict
+            Zeta coefficients, empty if the bundle has none.
+
+    The products are given by their name, e.g. ``bundle['superdark']``.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._arrays = {}
+        self.zeta = {}
+        # The memory maps keep the copy opened, so it stays readable if it is evicted afterwards
+        with glint_cache.pinnedPath(path) as local, h5py.File(local, 'r') as f:
+            if f.attrs.get('format') != bundle_format:
+                raise ValueError('%s is not a calibration bundle'%(path))
+            self.version = int(f.attrs['version'])
+            if self.version > bundle_version:
+                raise ValueError('Version %s of the calibration bundle is not supported (up to %s)'%(self.version, bundle_version))
+            for key in products:
+                if key in f:
+                    self._arrays[key] = _mapDataset(local, f[key])
+            if 'zeta' in f:
+                for key in f['zeta'].keys():
+                    self.zeta[key] = _mapDataset(local, f['zeta'][key])
+
+    def __getitem__(self, key):
+        if not key in self._arrays:
+            raise KeyError('%s is not in the calibration bundle %s'%(key, self.path))
+        return self._arrays[key]
+
+    def __contains__(self, key):
+        return key in self._arrays
+
+    def keys(self):
+        """
+        Names of the products in the bundle.
+        """
+        return self._arrays.keys()
+
+
+_bundles = {}
+
+def loadBundle(path):
+    """
+    Loads a calibration bundle, once per process.
+    The bundle is loaded again if its file is modified.
+
+    :Parameters:
+        **path**: str
+            Path of the bundle.
+
+    :Returns:
+        ``CalibrationBundle`` object.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if not key in _bundles:
+        _bundles[key] = CalibrationBundle(path)
+    return _bundles[key]
+
+
+if __name__ == '__main__':
+    ''' Settings '''
+    bundle_path = '/mnt/96980F95980F72D3/glint/GLINTprocessed/data202009/20200906/calibration.hdf5'
+    dark_path = '/mnt/96980F95980F72D3/glint/GLINTprocessed/data202009/20200906/'
+    geometric_calibration_path = dark_path
+    wl_to_px_path = '/mnt/96980F95980F72D3/glint/GLINTprocessed/calibration_params/20200906_wl_to_px.npy'
+    px_to_wl_path = '/mnt/96980F95980F72D3/glint/GLINTprocessed/calibration_params/20200906_px_to_wl.npy'
+    zeta_coeff_path = None
+
+    writeBundle(bundle_path,
+                superdark=np.load(dark_path+'superdark.npy'),
+                superdarkchannel=np.load(dark_path+'superdarkchannel.npy'),
+                pattern_coeff=np.load(geometric_calibration_path+'pattern_coeff.npy'),
+                wl_to_px=np.load(wl_to_px_path),
+                px_to_wl=np.load(px_to_wl_path),
+                zeta_coeff=readZetaFile(zeta_coeff_path) if zeta_coeff_path is not None else None)
+    print('Calibration bundle saved in %s'%(bundle_path))
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Local catalog of the raw datacubes and the reduced products of GLINT.
+
+Listing a folder of the network share holding tens of thousands of datacubes is slow,
+and listing it again for every selection of files even more.
+The catalog is a SQLite database on the local disk which keeps, for every file:
+    * its path, folder and name;
+    * its type: ``raw`` (datacube), ``product`` (intermediate product of ``glint_measure_null_depth``),
+      ``store`` (per-night store of intermediate products), ``npy`` (calibration file) or ``other``;
+    * its target, taken as the name of its folder;
+    * its number of frames;
+    * the timestamps of its first and last frames, if known (stores only);
+    * its size and date of modification.
+
+A folder is scanned with ``update``: only new or modified files are opened,
+files which disappeared are removed from the catalog.
+A folder scanned less than ``default_max_age`` seconds ago is not scanned again
+unless files were added to or removed from it since (its date of modification is newer than the scan),
+and never if the maximum age is ``None``: the catalog is then only queried.
+A file modified in place within the maximum age keeps its previous description.
+The scripts then select their files with ``query`` instead of listing the folder.
+
+The database is at ``default_path`` unless a path is given
+or the environment variable ``GLINT_CATALOG`` is set.
+"""
+
+import numpy as np
+import os
+import h5py
+import sqlite3
+from time import time
+
+default_path = os.environ.get('GLINT_CATALOG', os.path.join(os.path.expanduser('~'), '.glint_catalog.sqlite'))
+default_max_age = 3600 # s
+
+def _escapeLike(text):
+    """
+    Escapes the wildcards of the LIKE operator of SQL in ``text``.
+    """
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _toList(arg):
+    """
+    Gives ``arg`` as a list: ``None`` becomes an empty list, a string a list of one element.
+    """
+    if arg is None:
+        return []
+    if isinstance(arg, str):
+        return [arg]
+    return list(arg)
+
+def describeFile(path):
+    """
+    Gets the type, number of frames and timestamps of a file of the pipeline.
+
+    :Parameters:
+        **path**: str
+            Path to the file.
+
+    :Returns:
+        **file_type**: str
+            ``raw``, ``product``, ``store``, ``npy`` or ``other``.
+        **nb_frames**: int or None
+            Number of frames in the file, ``None`` if meaningless.
+        **first_timestamp**, **last_timestamp**: float or None
+            Timestamps of the first and last frames, ``None`` if unknown.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy':
+        return 'npy', None, None, None
+    if not ext in ['.mat', '.hdf5', '.h5']:
+        return 'other', None, None, None
+
+    try:
+        with h5py.File(path, 'r') as f:
+            if 'imagedata' in f:
+                return 'raw', f['imagedata'].shape[0], None, None
+            elif 'frame_index' in f:
+                timestamps = f['frame_index'].fields('timestamp')[()]
+                if timestamps.size == 0 or np.all(np.isnan(timestamps)):
+                    return 'store', timestamps.size, None, None
+                return 'store', timestamps.size, float(np.nanmin(timestamps)), float(np.nanmax(timestamps))
+            elif 'p1' in f:
+                return 'product', f['p1'].shape[0], None, None
+    except OSError: # Not a HDF5 file (e.g. matlab file before v7.3)
+        pass
+    return 'other', None, None, None
+
+
+class Catalog(object):
+    """
+    SQLite catalog of the files of the pipeline.
+
+    :Parameters:
+        **db_path**: str (optional)
+            Path to the database, created if it does not exist.
+            If ``None``, ``default_path`` is used.
+    """
+    def __init__(self, db_path=None):
+        self.db_path = db_path if db_path is not None else default_path
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.execute('PRAGMA case_sensitive_like = ON') # Same selection as the substrings of python
+        with self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, folder TEXT, name TEXT,
+                                    type TEXT, target TEXT, nb_frames INTEGER, first_timestamp REAL, last_timestamp REAL,
+                                    size INTEGER, mtime REAL)''')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS files_folder ON files (folder)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS folders (folder TEXT PRIMARY KEY, scan_time REAL)')
+
+    def close(self):
+        """
+        Closes the connection to the database.
+        """
+        self.connection.close()
+
+    def update(self, folder, max_age=default_max_age):
+        """
+        Scans a folder and updates the catalog incrementally:
+        only new and modified files (size or date of modification) are opened
+        and the files which disappeared are removed.
+
+        :Parameters:
+            **folder**: str
+                Folder to scan.
+            **max_age**: float (optional)
+                The folder is not scanned if its last scan is younger than ``max_age`` seconds
+                and no file was added or removed since.
+                If 0, the folder is always scanned. If ``None``, it is scanned only if it is not in the catalog yet.
+
+        :Returns:
+            Number of added or updated files.
+        """
+        folder = os.path.join(os.path.abspath(folder), '')
+        last_scan = self.connection.execute('SELECT scan_time FROM folders WHERE folder=?', (folder,)).fetchone()
+        scan_time = time()
+        if last_scan is not None:
+            if max_age is None:
+                return 0
+            if scan_time - last_scan[0] < max_age and os.stat(folder).st_mtime < last_scan[0]:
+                return 0
+
+        known = {row[0]:(row[1], row[2]) for row in \
+                 self.connection.execute('SELECT path, size, mtime FROM files WHERE folder=?', (folder,))}
+        target = os.path.basename(os.path.dirname(folder))
+        rows = []
+        found = set()
+        for entry in os.scandir(folder):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            found.add(entry.path)
+            if known.get(entry.path) == (stat.st_size, stat.st_mtime):
+                continue
+            file_type, nb_frames, first_timestamp, last_timestamp = describeFile(entry.path)
+            rows.append((entry.path, folder, entry.name, file_type, target, nb_frames,
+                         first_timestamp, last_timestamp, stat.st_size, stat.st_mtime))
+
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?,?,?)', rows)
+            self.connection.executemany('DELETE FROM files WHERE path=?', [(path,) for path in known if not path in found])
+            self.connection.execute('INSERT OR REPLACE INTO folders VALUES (?,?)', (folder, scan_time))
+        return len(rows)
+
+    def query(self, folder=None, contains=None, excludes=None, pattern=None, file_type=None, target=None, min_frames=None):
+        """
+        Selects files of the catalog, sorted by path.
+
+        :Parameters:
+            **folder**: str (optional)
+                Folder of the files. It is not scanned: call ``update`` first.
+            **contains**: str or list (optional)
+                Substrings which must all be in the name of the files, e.g. ``'dark'``.
+            **excludes**: str or list (optional)
+                Substrings which must not be in the name of the files.
+            **pattern**: str (optional)
+                Pattern of the name of the files, with the syntax of the LIKE operator of SQL, e.g. ``'%dark%.mat'``.
+            **file_type**: str (optional)
+                Type of the files (``raw``, ``product``, ``store``, ``npy`` or ``other``).
+            **target**: str (optional)
+                Target of the files (name of their folder).
+            **min_frames**: int (optional)
+                Minimum number of frames in the files.
+
+        :Returns:
+            List of paths.
+        """
+        conditions = []
+        values = []
+        if folder is not None:
+            conditions.append('folder=?')
+            values.append(os.path.join(os.path.abspath(folder), ''))
+        for text in _toList(contains):
+            conditions.append("name LIKE ? ESCAPE '\\'")
+            values.append('%'+_escapeLike(text)+'%')
+        for text in _toList(excludes):
+            conditions.append("name NOT LIKE ? ESCAPE '\\'")
+            values.append('%'+_escapeLike(text)+'%')
+        if pattern is not None:
+            conditions.append('name LIKE ?')
+            values.append(pattern)
+        if file_type is not None:
+            conditions.append('type=?')
+            values.append(file_type)
+        if target is not None:
+            conditions.append('target=?')
+            values.append(target)
+        if min_frames is not None:
+            conditions.append('nb_frames>=?')
+            values.append(min_frames)
+
+        request = 'SELECT path FROM files'
+        if len(conditions) > 0:
+            request += ' WHERE ' + ' AND '.join(conditions)
+        request += ' ORDER BY path'
+        return [row[0] for row in self.connection.execute(request, values)]
+
+    def getFrames(self, paths):
+        """
+        Gives the number of frames of files of the catalog.
+
+        :Parameters:
+            **paths**: list
+                Paths of the files, as returned by ``query``.
+
+        :Returns:
+            List of the number of frames, ``None`` for unknown files.
+        """
+        nb_frames = []
+        for path in paths:
+            row = self.connection.execute('SELECT nb_frames FROM files WHERE path=?', (path,)).fetchone()
+            nb_frames.append(row[0] if row is not None else None)
+        return nb_frames
+
+
+def listFiles(folder, contains=None, excludes=None, db_path=None, max_age=default_max_age, **kwargs):
+    """
+    Updates the catalog with a folder and selects files from it,
+    in place of listing the folder with ``os.listdir``.
+
+    :Parameters:
+        **folder**: str
+            Folder of the files.
+        **contains**, **excludes**: str or list (optional)
+            See ``Catalog.query``.
+        **db_path**: str (optional)
+            Path to the database. If ``None``, ``default_path`` is used.
+        **max_age**: float (optional)
+            See ``Catalog.update``.
+        **kwargs**: optional
+            Other keywords of ``Catalog.query``.
+
+    :Returns:
+        List of paths, sorted.
+    """
+    catalog = Catalog(db_path)
+    try:
+        catalog.update(folder, max_age)
+        return catalog.query(folder, contains, excludes, **kwargs)
+    finally:
+        catalog.close()
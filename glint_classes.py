@@ -1,16 +1,38 @@
 # -*- coding: utf-8 -*-
 """
 Classes used by the GLINT Data Reduction Software
+
+Matplotlib and ``scipy.optimize`` are only imported by the debug mode of ``Null.getSpectralFlux``
+and cupy is not needed, so the library is imported quickly, on the nodes without display or GPU too.
+
+The numba kernels are cached on disk (in ``__pycache__`` or in the folder given by 
+the environment variable ``NUMBA_CACHE_DIR``) so they are compiled once, 
+not in every new process.
+They are compiled for their explicit signatures (``kernelSignatures``) by ``compileKernels``, 
+which is called by the scripts before processing the first datacube.
+Running this module as a script compiles them ahead of time, e.g. after an installation or an update.
+The settings are in the ``Settings`` section:
+    * **dtypes**: list, precisions of the reduction to compile the kernels for (see ``File``)
+    * **data_dtypes**: list, types of the frames read in these precisions: the types of the raw datacubes (e.g. integers) when they are reduced without a precision, and the precisions themselves
+    * **engines**: list, engines of ``Null.getSpectralFlux`` to compile the kernels of
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
 import h5py
 from functools import partial
-from scipy.optimize import curve_fit
-from numba import jit
+import numba
+from numba import jit, prange
 import os
-import cupy as cp
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict
+from itertools import islice
+import threading
+import hashlib
+import atexit
+from queue import Queue
+from timeit import default_timer as time
+import glint_cache
+import glint_transcode
 
 def gaussian(x, A, B, C, loc, sig):
     """
@@ -48,7 +70,9 @@ def _getSpectralFlux(nbimg, which_tracks, slices_axes, slices, spectral_axis, po
     Plot the linear fit and the gaussian profil for one spectral channel of the first frame for every tracks.
     Read the description of ``_getSpectralFluxNumba`` for details about the inputs.
     """
-    nb_tracks = 16
+    import matplotlib.pyplot as plt # Only needed for debugging, not imported with the library
+    from scipy.optimize import curve_fit
+    nb_tracks = len(which_tracks)
     amplitude_fit = np.zeros((nbimg, nb_tracks, len(spectral_axis)))
     amplitude = np.zeros((nbimg, nb_tracks, len(spectral_axis)))
     # integ_model = np.zeros((nbimg, nb_tracks, len(spectral_axis)))
@@ -63,7 +87,7 @@ def _getSpectralFlux(nbimg, which_tracks, slices_axes, slices, spectral_axis, po
     # With fitted amplitude
     for k in range(nbimg):
 #        print(k)
-        for i in which_tracks:
+        for i in range(nb_tracks):
             for j in range(len(spectral_axis)):
                 gaus = partial(gaussian, loc=positions[i,j], sig=widths[i,j])
                 try:
@@ -91,13 +115,13 @@ def _getSpectralFlux(nbimg, which_tracks, slices_axes, slices, spectral_axis, po
                 except ValueError as e:
                     print(simple_gaus0)
                     print(np.any(np.isnan(simple_gaus)), np.any(np.isinf(simple_gaus)))
-                    print(labels[i], 'Track', i, 'Frame', k, 'Column', j)
+                    print(labels[which_tracks[i]], 'Track', which_tracks[i], 'Frame', k, 'Column', j)
                     print('Centre axe', np.mean(slices_axes[i]),'Loc', positions[i,j], 'Width', widths[i,j])
                     raise e
                 except np.linalg.LinAlgError as e:
                     print(simple_gaus0)
                     print(np.any(np.isnan(simple_gaus)), np.any(np.isinf(simple_gaus)))
-                    print(labels[i], 'Track', i, 'Frame', k, 'Column', j)
+                    print(labels[which_tracks[i]], 'Track', which_tracks[i], 'Frame', k, 'Column', j)
                     print('Centre axe', np.mean(slices_axes[i]),'Loc', positions[i,j], 'Width', widths[i,j])
                     print( e)
                     popt2 = np.zeros((3,))
@@ -134,7 +158,7 @@ def _getSpectralFlux(nbimg, which_tracks, slices_axes, slices, spectral_axis, po
                     plt.ylabel('Amplitude')
                     plt.grid()
                     plt.legend(loc='best')
-                    plt.title('Frame '+str(k)+'/ Track '+str(i)+'/ Column '+str(j)+'/ '+labels[i])
+                    plt.title('Frame '+str(k)+'/ Track '+str(which_tracks[i])+'/ Column '+str(j)+'/ '+labels[which_tracks[i]])
 #                    plt.subplot(312)
 #                    plt.plot(slices[k,j,i], residuals_fit[k,i,j], 'o', label='fit')
 #                    plt.plot(slices[k,j,i], residuals_reg[k,i,j], 'd', label='linear reg')
@@ -159,15 +183,637 @@ def _getSpectralFlux(nbimg, which_tracks, slices_axes, slices, spectral_axis, po
     return amplitude_fit, amplitude, residuals_fit, residuals_reg, cov, error
 
 
+_projectors = OrderedDict() # Terms of the last calibrations used, the least recently used ones are dropped
+_projectors_lock = threading.Lock()
+max_projectors = 4 # Number of calibrations whose terms are kept
+cond_max = 1/np.finfo(np.float64).eps # Normal matrices with a larger condition number are solved by least squares
+precision_rtol = 1e-4 # Tolerance of a reduction in float32, see ``Null.checkPrecision``
+noise_columns = 10-5 # Columns on the edge of the outputs giving the weight of the noise in the fits, see ``_noiseWeight``
+
+def _getProjectorTerms(slices_axes, positions, widths):
+    """
+    Terms of the weighted least squares of ``_getSpectralFluxNumba`` which 
+    depend only on the calibration, for every output and spectral channel.
+    The weights are ``simple_gaus + std`` where ``std`` is given per datacube, 
+    so the normal matrix is ``M2 + 2*std*M1 + std**2*M0`` and its right-hand 
+    side is ``(B2 + 2*std*B1 + std**2*B0) . data``.
+    The terms are computed once per calibration and kept for the next datacubes,
+    for the last ``max_projectors`` calibrations.
+    
+    :Parameters:
+        **slices_axes**: ndarray
+            Spatial axis in pixel for every outputs.
+        **positions**, **widths**: ndarray
+            Positions and widths of each output respect to wavelength, 
+            with the structure (output, spectral channel).
+            
+    :Returns:
+        Dictionary of the terms:
+            * **A**: design matrices (output, spectral channel, 3, spatial)
+            * **gaus**: normalised profiles (output, spectral channel, spatial)
+            * **B0**, **B1**, **B2**: ``A`` weighted by 1, ``gaus`` and ``gaus**2``
+            * **M0**, **M1**, **M2**: normal matrices of ``B0``, ``B1``, ``B2`` (output, spectral channel, 3, 3)
+            * **valid**: boolean array of the spectral channels which are fitted, the flux of the other ones is 0
+    """
+    arrays = [np.ascontiguousarray(arr, dtype=np.float64) for arr in (slices_axes, positions, widths)]
+    key = hashlib.sha1(b''.join([str(arr.shape).encode() + arr.tobytes() for arr in arrays])).hexdigest()
+    with _projectors_lock:
+        if key in _projectors:
+            _projectors.move_to_end(key)
+            return _projectors[key]
+    
+    slices_axes, positions, widths = arrays
+    x = np.broadcast_to(slices_axes[:,None,:], positions.shape+slices_axes.shape[-1:])
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        gaus = np.exp(-(x-positions[:,:,None])**2/(2*widths[:,:,None]**2))
+        gaus = gaus / np.sum(gaus, axis=-1, keepdims=True)
+    gaus[np.isnan(gaus)] = 0.
+    valid = ~np.all(gaus == 0, axis=-1)
+    valid[:,:20] = False # The first spectral channels are not fitted
+    
+    A = np.stack((gaus, np.ones_like(gaus), x), axis=-2)
+    terms = {'A':A, 'gaus':gaus, 'valid':valid}
+    for k in range(3):
+        terms['B%s'%(k)] = A * gaus[:,:,None,:]**k
+        terms['M%s'%(k)] = np.matmul(terms['B%s'%(k)], np.swapaxes(A, -1, -2))
+    with _projectors_lock:
+        _projectors[key] = terms
+        while len(_projectors) > max_projectors:
+            _projectors.popitem(last=False)
+    return terms
+
+def _projectSpectralFlux(slices_axes, slices, positions, widths, amplitude, residuals_reg, error, summary=None, chunk_frames=64, std=None):
+    """
+    Vectorised equivalent of ``Null._getSpectralFluxNumba``.
+    The projectors from the data to the fitted parameters are built once 
+    per datacube from the terms given by ``_getProjectorTerms``, then applied to 
+    all the frames at once.
+    The projections are done in the precision of ``slices`` (float32 or float64).
+    
+    :Parameters:
+        **slices_axes**: ndarray
+            Spatial axis in pixel for every outputs.
+        **slices**: ndarray
+            Array containing the flux in the 16 outputs on every frames.
+        **positions**, **widths**: ndarray
+            Positions and widths of each output respect to wavelength.
+        **amplitude**, **residuals_reg**, **error**: ndarray
+            Arrays filled with the results, of shape (frame, output, spectral channel) 
+            and (frame, output, spectral channel, spatial) for ``residuals_reg``.
+            ``residuals_reg`` can be ``None`` to not keep the residuals.
+        **summary**: FitSummary (optional)
+            Summary of the quality of the fits, filled in place.
+        **chunk_frames**: int (optional)
+            Number of frames of which the residuals are computed at once 
+            when they are not kept.
+        **std**: float (optional)
+            Weight of the noise, given by ``_noiseWeight`` on ``slices`` if ``None``.
+            
+    :Returns:
+        **amplitude**, **residuals_reg**, **error**: ndarray
+            Same as ``Null._getSpectralFluxNumba``.
+    """
+    if summary is None:
+        summary = FitSummary(*amplitude.shape[1:])
+    nb_wl = slices.shape[1]
+    terms = _getProjectorTerms(slices_axes, positions[:,:nb_wl], widths[:,:nb_wl])
+    A, valid = terms['A'], terms['valid']
+    if std is None:
+        std = _noiseWeight(slices)
+    
+    normal = terms['M2'] + 2 * std * terms['M1'] + std**2 * terms['M0']
+    rhs = terms['B2'] + 2 * std * terms['B1'] + std**2 * terms['B0']
+    normal[~valid] = np.eye(3) # Not fitted: the projector is set to 0 below
+    # Ill-conditioned systems are detected before solving and only them are solved by least squares
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ill = valid & ~(np.linalg.cond(normal) < cond_max)
+    normal[ill] = np.eye(3)
+    projector = np.linalg.solve(normal, rhs)
+    if np.any(ill):
+        # Same solution as np.linalg.lstsq in _fitChannel
+        weights = terms['gaus'][ill] + std
+        projector[ill] = np.linalg.pinv(np.swapaxes(A[ill] * weights[:,None,:], -1, -2)) * weights[:,None,:]
+        summary.nb_failed[ill] += slices.shape[0]
+    projector[~valid] = 0.
+    
+    # The projections are done in the precision of the data (e.g. float32)
+    data = np.transpose(slices, (2, 1, 3, 0)) # (output, spectral channel, spatial, frame)
+    projector = projector.astype(data.dtype, copy=False)
+    popt = np.matmul(projector, data) # (output, spectral channel, parameter, frame)
+    amplitude[:] = np.transpose(popt[:,:,0], (2, 0, 1))
+    
+    # The residuals are computed by chunks of frames so the whole cube is allocated only if it is kept.
+    # The chi2 is their sum of squares, accumulated in float64.
+    At = np.swapaxes(A, -1, -2).astype(data.dtype, copy=False)
+    summary.residual_max[:] = 0.
+    chi2 = np.zeros(data.shape[:2]+data.shape[3:])
+    for start in range(0, data.shape[-1], chunk_frames):
+        residuals = data[...,start:start+chunk_frames] - np.matmul(At, popt[...,start:start+chunk_frames])
+        if residuals_reg is not None:
+            residuals_reg[start:start+chunk_frames] = np.transpose(residuals, (3, 0, 1, 2))
+        np.maximum(summary.residual_max, np.max(np.abs(residuals), axis=(2, 3)), out=summary.residual_max)
+        chi2[...,start:start+chunk_frames] = np.sum(np.square(residuals, dtype=np.float64), axis=2)
+    
+    chi2 /= slices_axes.shape[-1] - 3
+    spread = np.sum((slices_axes - np.mean(slices_axes, axis=-1, keepdims=True))**2, axis=-1)
+    error[:] = np.transpose((chi2 / spread[:,None,None])**0.5, (2, 0, 1))
+    summary.chi2_mean[:] = np.mean(chi2, axis=-1)
+    summary.nb_frames = slices.shape[0]
+    return amplitude, residuals_reg, error
+
+
+@jit(nopython=True, cache=True)
+def _noiseWeight(slices):
+    """
+    Weight of the noise in the least squares of ``Null._getSpectralFluxNumba``, 
+    computed once per datacube outside of the kernels so the serial and 
+    parallel kernels use the same value.
+    The sums are accumulated in float64 whatever the precision of ``slices``.
+    """
+    nbimg, nb_wl, nb_tracks = slices.shape[:3]
+    width = min(noise_columns, slices.shape[3])
+    mean = 0.
+    for k in range(nbimg):
+        for j in range(nb_wl):
+            for i in range(nb_tracks):
+                for s in range(width):
+                    mean += slices[k,j,i,s]
+    mean /= nbimg * nb_wl * nb_tracks * width
+    var = 0.
+    for k in range(nbimg):
+        for j in range(nb_wl):
+            for i in range(nb_tracks):
+                for s in range(width):
+                    var += (slices[k,j,i,s] - mean)**2
+    return 1/(var / (nbimg * nb_wl * nb_tracks * width))**0.5
+
+@jit(nopython=True, nogil=True, cache=True)
+def _solveNormal(AwAwT, b, popt):
+    """
+    Solves the normal equations in ``popt``.
+    Returns ``False`` if the matrix is singular: exceptions cannot be raised 
+    from a parallel loop.
+    """
+    try:
+        popt[:] = np.linalg.solve(AwAwT, b)
+        return True
+    except Exception:
+        return False
+
+@jit(nopython=True, nogil=True, cache=True)
+def _fitChannel(i, j, nbimg, slices_axes, slices, positions, widths, std, use_lstsq, amplitude, residuals_reg, error,
+                keep_residuals, chi2_sum, residual_max, nb_failed):
+    """
+    Fits the flux of one output in one spectral channel in all the frames.
+    It is compiled apart from the kernels so the serial and parallel ones 
+    run exactly the same operations.
+    If the normal matrix is ill-conditioned, which is known before the loop 
+    over the frames, or singular, the least squares are solved with ``np.linalg.lstsq``.
+    """
+    # 1st estimator : amplitude of the Gaussian profil of the track, use of linear least square
+    simple_gaus0 = np.exp(-(slices_axes[i]-positions[i,j])**2/(2*widths[i,j]**2))
+    simple_gaus = simple_gaus0 / np.sum(simple_gaus0)
+    simple_gaus[np.isnan(simple_gaus)] = 0.
+    
+    weights = np.diag(simple_gaus + std)
+    A = np.vstack((simple_gaus, np.ones_like(simple_gaus), slices_axes[i]))
+    fitted = j >= 20 and not np.all(simple_gaus == 0)
+    Aw = np.dot(A, weights)
+    AwAwT = np.dot(Aw, np.transpose(Aw))
+    spread = np.sum((slices_axes[i] - np.mean(slices_axes[i]))**2)
+    if fitted and not use_lstsq and not np.linalg.cond(AwAwT) < cond_max:
+        use_lstsq = True
+        nb_failed[i,j] += nbimg
+    for k in range(nbimg):
+        popt2 = np.zeros(A.shape[0])
+        if fitted:
+            dataw = np.dot(slices[k,j,i].astype(np.float64), weights) # The fit is done in float64 whatever the precision of the data
+            if use_lstsq:
+                popt2 = np.linalg.lstsq(Aw.T, dataw)[0]
+            else:
+                b = np.dot(Aw,dataw)
+                if not _solveNormal(AwAwT, b, popt2):
+                    popt2 = np.linalg.lstsq(Aw.T, dataw)[0]
+                    nb_failed[i,j] += 1
+        residuals = slices[k,j,i] - (popt2[0] * simple_gaus + popt2[1] + popt2[2] * slices_axes[i])
+        if keep_residuals:
+            residuals_reg[k,i,j] = residuals
+        amplitude[k,i,j] = popt2[0]
+        chi2 = np.sum(residuals**2) / (slices_axes[i].size-popt2.size)
+        error[k,i,j] = (chi2 / spread)**0.5
+        chi2_sum[i,j] += chi2
+        residual_max[i,j] = max(residual_max[i,j], np.max(np.abs(residuals)))
+
+@jit(nopython=True, nogil=True, cache=True)
+def _spectralFluxSerial(nbimg, which_tracks, slices_axes, slices, nb_wl, positions, widths, std, use_lstsq, amplitude, residuals_reg, error,
+                        keep_residuals, chi2_sum, residual_max, nb_failed):
+    """
+    Serial kernel of ``Null._getSpectralFluxNumba`` and ``Null._getSpectralFluxNumba2``, 
+    looping over the outputs and spectral channels.
+    
+    :Parameters:
+        **std**: float
+            Weight of the noise, from ``_noiseWeight``.
+        **use_lstsq**: bool
+            If ``True``, the least squares are solved with ``np.linalg.lstsq``, 
+            otherwise with the normal equations.
+        **keep_residuals**: bool
+            If ``True``, ``residuals_reg`` is filled.
+        **chi2_sum**, **residual_max**, **nb_failed**: ndarray
+            Arrays (output, spectral channel) where the sum of the chi2 over the frames, 
+            the maximum absolute residual and the number of fits solved by least squares 
+            instead of the normal equations are accumulated.
+            
+    See ``Null._getSpectralFluxNumba`` for the other parameters.
+    """
+    nb_tracks = which_tracks.size
+    for idx in range(nb_tracks * nb_wl):
+        _fitChannel(which_tracks[idx // nb_wl], idx % nb_wl, nbimg, slices_axes, slices, positions, widths, std, use_lstsq,
+                    amplitude, residuals_reg, error, keep_residuals, chi2_sum, residual_max, nb_failed)
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def _spectralFluxParallel(nbimg, which_tracks, slices_axes, slices, nb_wl, positions, widths, std, use_lstsq, amplitude, residuals_reg, error,
+                          keep_residuals, chi2_sum, residual_max, nb_failed):
+    """
+    Parallel equivalent of ``_spectralFluxSerial``.
+    The loop over the outputs and spectral channels is split between the threads, 
+    each of them fitting all the frames of its outputs and spectral channels.
+    It is a separate function from the serial kernel so they have their own entries in the cache.
+    """
+    nb_tracks = which_tracks.size
+    for idx in prange(nb_tracks * nb_wl):
+        _fitChannel(which_tracks[idx // nb_wl], idx % nb_wl, nbimg, slices_axes, slices, positions, widths, std, use_lstsq,
+                    amplitude, residuals_reg, error, keep_residuals, chi2_sum, residual_max, nb_failed)
+
+def _runSpectralFluxKernel(nbimg, which_tracks, slices_axes, slices, spectral_axis, positions, widths, use_lstsq,
+                           amplitude, residuals_reg, error, parallel, summary, std=None):
+    """
+    Runs the serial or parallel kernel of the extraction of the flux and 
+    completes the summary of the quality of the fits.
+    The weight of the noise ``std`` is given by ``_noiseWeight`` on ``slices`` if ``None``.
+    """
+    # Same types as in ``kernelSignatures``
+    which_tracks = np.ascontiguousarray(which_tracks, dtype=np.int64)
+    slices_axes = np.ascontiguousarray(slices_axes, dtype=np.float64)
+    positions = np.ascontiguousarray(positions, dtype=np.float64)
+    widths = np.ascontiguousarray(widths, dtype=np.float64)
+    if std is None:
+        std = _noiseWeight(slices)
+    keep_residuals = residuals_reg is not None
+    if not keep_residuals:
+        residuals_reg = np.zeros((1, 1, 1, 1), amplitude.dtype) # Not used
+    summary.chi2_mean[:] = 0.
+    summary.residual_max[:] = 0.
+    kernel = _spectralFluxParallel if parallel else _spectralFluxSerial
+    kernel(nbimg, which_tracks, slices_axes, slices, len(spectral_axis), positions, widths, std, use_lstsq, amplitude, residuals_reg, error,
+           keep_residuals, summary.chi2_mean, summary.residual_max, summary.nb_failed)
+    if nbimg > 0:
+        summary.chi2_mean /= nbimg # Sum of the chi2 in the kernel
+    summary.nb_frames = nbimg
+
+def setFluxThreads(nb_threads=None):
+    """
+    Sets the number of threads of the parallel extraction of the flux.
+    
+    :Parameters:
+        **nb_threads**: int (optional)
+            Number of threads. If ``None``, all the threads of numba are used 
+            (by default one per core, see the environment variable ``NUMBA_NUM_THREADS``).
+    """
+    if nb_threads is None:
+        nb_threads = numba.config.NUMBA_NUM_THREADS
+    numba.set_num_threads(min(max(nb_threads, 1), numba.config.NUMBA_NUM_THREADS))
+
+def kernelSignatures(dtype=np.float64, data_dtype=None):
+    """
+    Gives the explicit signatures of the numba kernels for a precision of the reduction, 
+    with the types and the layouts of the arrays given by the methods of ``Null``.
+    
+    :Parameters:
+        **dtype**: dtype (optional)
+            Precision of the reduction (type of the outputs and the fluxes).
+        **data_dtype**: dtype (optional)
+            Type of the frames, ``dtype`` if ``None``.
+            
+    :Returns:
+        Dictionary of the list of signatures of each kernel.
+    """
+    data_type = numba.from_dtype(np.dtype(data_dtype if data_dtype is not None else dtype))
+    out_type = numba.from_dtype(np.dtype(dtype))
+    f64, i64, boolean = numba.types.float64, numba.types.int64, numba.types.boolean
+    array = numba.types.Array
+    
+    slices = array(out_type, 4, 'C')
+    flux = array(out_type, 3, 'C')
+    matrix = array(f64, 2, 'C')
+    fit_args = (matrix, slices, matrix, matrix, f64, boolean, flux, slices, flux, boolean, matrix, matrix, array(i64, 2, 'C'))
+    # The frames are a view of the datacube (layout 'A') or the transcoded datacube itself (layout 'C')
+    preprocess = [numba.types.void(array(data_type, 3, layout), array(i64, 1, 'C'), array(i64, 1, 'C'), array(out_type, 3, 'C'), slices,
+                                   array(data_type, 4, 'C'), slices, matrix, array(f64, 1, 'C'), array(f64, 1, 'C'), boolean, boolean, boolean, boolean)
+                  for layout in ['A', 'C']]
+    kernel = numba.types.void(i64, array(i64, 1, 'C'), *fit_args[:2], i64, *fit_args[2:])
+    return {'_preprocessNumba':preprocess,
+            '_noiseWeight':[f64(slices)],
+            '_solveNormal':[boolean(matrix, array(f64, 1, 'C'), array(f64, 1, 'C'))],
+            '_fitChannel':[numba.types.void(i64, i64, i64, *fit_args)],
+            '_spectralFluxSerial':[kernel],
+            '_spectralFluxParallel':[kernel]}
+
+def compileKernels(dtypes=(np.float64,), data_dtypes=None, engines=('numba', 'parallel')):
+    """
+    Compiles the numba kernels for their explicit signatures, or loads them 
+    from the cache on disk if they are already compiled.
+    Calling it before the first datacube removes the compilation from the processing.
+    
+    :Parameters:
+        **dtypes**: list (optional)
+            Precisions of the reduction.
+        **data_dtypes**: list (optional)
+            Types of the datacubes, the same as ``dtypes`` if ``None``.
+            Only the types which are promoted to a precision are compiled for it.
+        **engines**: list (optional)
+            Engines of ``Null.getSpectralFlux`` to compile the kernels of, 
+            the kernels of ``Null.preprocess`` and of the weight of the noise are always compiled.
+    """
+    kernels = {'_preprocessNumba':Null._preprocessNumba, '_noiseWeight':_noiseWeight, '_solveNormal':_solveNormal,
+               '_fitChannel':_fitChannel, '_spectralFluxSerial':_spectralFluxSerial, '_spectralFluxParallel':_spectralFluxParallel}
+    names = ['_preprocessNumba', '_noiseWeight']
+    if 'numba' in engines or 'parallel' in engines:
+        names += ['_solveNormal', '_fitChannel']
+    if 'numba' in engines:
+        names += ['_spectralFluxSerial']
+    if 'parallel' in engines:
+        names += ['_spectralFluxParallel']
+        
+    for dtype in dtypes:
+        for data_dtype in (data_dtypes if data_dtypes is not None else dtypes):
+            if np.result_type(data_dtype, dtype) != dtype:
+                continue
+            signatures = kernelSignatures(dtype, data_dtype)
+            for name in names:
+                for signature in signatures[name]:
+                    kernels[name].compile(signature)
+
+
+def _readFrames(dset, frames, rows, transpose=False, get_buffer=None, dtype=None):
+    """
+    Reads a hyperslab of frames and rows from the dataset ``imagedata`` of a raw datacube.
+    
+    :Parameters:
+        
+        **dset**: h5py dataset
+            Dataset of the raw datacube.
+            
+        **frames**: slice
+            Frames to read.
+            
+        **rows**: 2-tuple
+            First and last+1 rows of the detector to read, ``None`` for all of them.
+            
+        **transpose**: bool
+            If ``True``, the dataset is stored as (frame, spatial, spectral).
+            It is forced to ``True`` for the datacubes transcoded by :doc:`glint_transcode`.
+            
+        **get_buffer**: callable (optional)
+            Called with a shape and a dtype, it gives the array in which the 
+            hyperslab is read with ``read_direct``, e.g. ``File._getBuffer``.
+            If ``None``, a new array is allocated.
+            
+        **dtype**: dtype (optional)
+            Type of the frames, converted by HDF5 while reading. 
+            If ``None``, the type of the dataset.
+            
+    :Returns:
+        
+        Frames with the structure (frame, spatial, spectral).
+    """
+    transpose = transpose or glint_transcode.isTransposed(dset)
+    if transpose:
+        # Read in the layout of the pipeline: no copy nor transposition
+        selection = np.s_[frames, rows[0]:rows[1], :]
+    else:
+        selection = np.s_[frames, :, rows[0]:rows[1]]
+        
+    if dtype is None:
+        dtype = dset.dtype
+    if get_buffer is None:
+        data = dset.astype(dtype)[selection]
+    else:
+        shape = [len(range(size)[sel]) for size, sel in zip(dset.shape, selection)]
+        data = get_buffer(shape, dtype)
+        dset.read_direct(data, selection)
+        
+    if not transpose:
+        # Stored as (frame, spectral, spatial): the swap is a view, not a copy
+        data = np.swapaxes(data, 1, 2)
+    return data
+
+
+def streamFrames(data_list, batch_size, binning=None, nbimg=(None, None), rows=None, transpose=False, dtype=None):
+    """
+    Generator walking through a list of datacubes and yielding batches of frames 
+    of fixed size, regardless of the boundaries between files.
+    Files are read by chunks of about ``batch_size`` raw frames which are binned as soon as they are read,
+    so the memory used is bounded by the size of a batch (binned) and of a chunk (raw).
+    
+    Consecutive frames are binned (averaged) together, across files if needed.
+    The last binned frame averages the remaining frames so no frame is lost.
+    
+    :Parameters:
+        
+        **data_list**: list
+            List of paths of the datacubes to read.
+            
+        **batch_size**: int
+            Number of (binned) frames per batch. The last batch can be smaller.
+            
+        **binning**: int (optional)
+            Number of consecutive frames to average together. 
+            If ``None`` or 1, frames are not binned.
+            
+        **nbimg**: tup (optional)
+            Frames to load in each datacube, from the first to the second-1 element of the tuple.
+            
+        **rows**: tup (optional)
+            Rows of the detector to load, see the class ``File``.
+            
+        **transpose**: bool (optional)
+            See the class ``File``.
+            
+        **dtype**: dtype (optional)
+            Type of the frames, the one of the datacubes if ``None``.
+            
+    :Yields:
+        
+        **frames**: ndarray
+            Batch of frames with the structure (frame, spatial, spectral).
+            It can be given to the class ``Null`` like the path of a datacube.
+            
+        **sources**: list
+            Path of the datacube containing the first raw frame of each frame of the batch.
+            
+        **first_frames**: ndarray
+            Index of the first raw frame of each frame of the batch in its datacube.
+    """
+    if binning is None:
+        binning = 1
+    if rows is None:
+        rows = (None, None)
+    chunk_size = max(1, batch_size // binning) * binning # Raw frames read at once, binned right away
+    binned = [] # Binned frames not yielded yet
+    origins = [] # Source and index of the first raw frame of each binned frame
+    nb_binned = 0
+    leftover = None # Fewer than ``binning`` raw frames waiting for the frames of the next file
+    leftover_origin = None
+    
+    for f in data_list:
+        with glint_cache.pinnedPath(f) as local, h5py.File(local, 'r') as dataFile:
+            dset = dataFile['imagedata']
+            frames = range(dset.shape[0])[nbimg[0]:nbimg[1]]
+            start, stop = frames.start, frames.stop
+            while start < stop:
+                nb_left = 0 if leftover is None else leftover.shape[0]
+                # The binned frames never exceed the size of a batch
+                nb_read = min(stop - start, min(chunk_size, (batch_size - nb_binned) * binning) - nb_left)
+                chunk = _readFrames(dset, slice(start, start+nb_read), rows, transpose, dtype=dtype)
+                first_origin = (f, start)
+                if leftover is not None:
+                    chunk = np.concatenate((leftover, chunk))
+                    first_origin = leftover_origin
+                    leftover = None
+                    
+                nb_full = chunk.shape[0] // binning * binning
+                if nb_full > 0:
+                    binned.append(chunk[:nb_full].reshape((-1, binning) + chunk.shape[1:]).mean(axis=1))
+                    origins += [first_origin] + [(f, start + k * binning - nb_left) for k in range(1, nb_full // binning)]
+                    nb_binned += nb_full // binning
+                if nb_full < chunk.shape[0]:
+                    leftover = chunk[nb_full:].copy() # Does not keep the chunk alive
+                    leftover_origin = first_origin if nb_full == 0 else (f, start + nb_full - nb_left)
+                start += nb_read
+                
+                if nb_binned == batch_size:
+                    batch = np.concatenate(binned) if len(binned) > 1 else binned[0]
+                    yield batch, [origin[0] for origin in origins], np.array([origin[1] for origin in origins])
+                    binned, origins = [], []
+                    nb_binned = 0
+    
+    if leftover is not None: # The last binned frame averages the remaining frames
+        binned.append(leftover.mean(axis=0)[None])
+        origins.append(leftover_origin)
+        nb_binned += 1
+    if nb_binned > 0:
+        batch = np.concatenate(binned) if len(binned) > 1 else binned[0]
+        yield batch, [origin[0] for origin in origins], np.array([origin[1] for origin in origins])
+
+
+def getTracksRows(channel_pos, sep):
+    """
+    Gives the bounds of the rows of the detector covered by the 16 outputs.
+    The bounds follow the same rounding as the method ``getChannels``.
+    
+    :Parameters:
+        
+        **channel_pos**: list, array-like
+            Expected position of the outputs
+        
+        **sep**: float
+            Separation (in pixels) between two consecutive outputs
+            
+    :Returns:
+        
+        2-tuple of the first and last+1 rows to load, to use with the parameter ``rows`` of the class ``File``.
+    """
+    start = int(np.around(np.min(channel_pos)-sep/2))
+    stop = int(np.around(np.max(channel_pos)+sep/2))
+    return (start, stop)
+
+
+output_tracks = {'p1':15, 'p2':13, 'p3':2, 'p4':0,
+                 'Iminus1':11, 'Iminus2':3, 'Iminus3':1, 'Iminus4':6, 'Iminus5':5, 'Iminus6':8,
+                 'Iplus1':9, 'Iplus2':12, 'Iplus3':14, 'Iplus4':4, 'Iplus5':7, 'Iplus6':10}
+baseline_outputs = {'null1':['Iminus1', 'Iplus1', 'p1', 'p2'], 'null2':['Iminus2', 'Iplus2', 'p2', 'p3'],
+                    'null3':['Iminus3', 'Iplus3', 'p1', 'p4'], 'null4':['Iminus4', 'Iplus4', 'p3', 'p4'],
+                    'null5':['Iminus5', 'Iplus5', 'p3', 'p1'], 'null6':['Iminus6', 'Iplus6', 'p4', 'p2']}
+output_roles = {'photometric':['p1', 'p2', 'p3', 'p4'],
+                'null':['Iminus1', 'Iminus2', 'Iminus3', 'Iminus4', 'Iminus5', 'Iminus6'],
+                'antinull':['Iplus1', 'Iplus2', 'Iplus3', 'Iplus4', 'Iplus5', 'Iplus6']}
+output_names = [name for role in output_roles.values() for name in role] # Order of the outputs in ``Null.intensities``
+
+def getTracks(outputs=None):
+    """
+    Gives the tracks to extract for a selection of baselines and outputs.
+    
+    :Parameters:
+        
+        **outputs**: str or list (optional)
+            Names of baselines (``nullX``, X=1..6) and outputs (``pX``, ``IminusX``, ``IplusX``).
+            A baseline stands for its null and antinull outputs and the photometric outputs of its two beams.
+            If ``None``, all the outputs are selected.
+            
+    :Returns:
+        
+        Sorted array of the tracks, to use with the parameter ``outputs`` of the method ``Null.preprocess``.
+    """
+    if outputs is None:
+        return np.arange(len(output_tracks))
+    if isinstance(outputs, str):
+        outputs = [outputs]
+    tracks = set()
+    for name in outputs:
+        if name in baseline_outputs:
+            tracks.update([output_tracks[output] for output in baseline_outputs[name]])
+        elif name in output_tracks:
+            tracks.add(output_tracks[name])
+        else:
+            raise KeyError('%s is neither a baseline nor an output'%(name))
+    return np.array(sorted(tracks), dtype=int)
+
+frame_index_dtype = np.dtype([('source', h5py.string_dtype()), ('frame', np.int64), ('timestamp', np.float64)])
+
+
+def _appendDataset(group, key, arr, chunk_frames=None, **kwargs):
+    """
+    Appends ``arr`` along the frame axis (first one) of the data set ``key`` 
+    of a HDF5 file, creating an extendable data set if it does not exist.
+    
+    :Parameters:
+        
+        **group**: h5py group or file
+            Where the data set is stored.
+            
+        **key**: str
+            Name of the data set.
+            
+        **arr**: ndarray
+            Frames to append.
+            
+        **chunk_frames**: int (optional)
+            Number of frames per chunk when the data set is created. 
+            If ``None``, the chunks are chosen by h5py.
+            
+        **kwargs**: optional
+            Keywords of ``create_dataset`` (e.g. ``compression``, ``shuffle``).
+    """
+    if key in group:
+        dset = group[key]
+        dset.resize(dset.shape[0] + arr.shape[0], axis=0)
+        dset[dset.shape[0]-arr.shape[0]:] = arr
+    else:
+        chunks = True if chunk_frames is None else (chunk_frames,) + arr.shape[1:]
+        group.create_dataset(key, data=arr, maxshape=(None,)+arr.shape[1:], chunks=chunks, **kwargs)
+
+
 class File(object):
     """
     Management of the HDF5 datacube generated by GLINT
     
     :Parameters:
-        **data: string (optional)**
+        **data: string or ndarray (optional)**
             Path to the datacube to load. 
             If ``None``, datacube full of 0 is created, with same dimension as real data (nbimg, 344, 96).
             In that case, parameter ``nbimg`` cannot be ``None``.
+            If an array, it is used as the datacube (see ``loadfile``).
             
         **nbimg: tup (optional)**
             Load all frames of the datacube at path ``data`` from the first to the second-1 element of the tuple.
@@ -175,25 +821,41 @@ class File(object):
             
         **transpose: bol (optional)**
             If ``True``, swappes the 2nd and 3rd axis of the datacube.
+            
+        **rows: tup (optional)**
+            Load only the rows of the detector (spatial axis) from the first to the second-1 element of the tuple.
+            Use the function ``getTracksRows`` to get the rows covered by the 16 outputs.
+            
+        **pool: BufferPool (optional)**
+            Pool providing the arrays filled by the loading and the extraction 
+            of the outputs. They are given back with the method ``release``.
+            
+        **dtype: dtype (optional)**
+            Precision of the reduction, e.g. ``np.float32`` to halve the memory 
+            and the bandwidth used by the frames, the outputs and the fluxes.
+            If ``None``, the frames keep the type of the datacube and the 
+            outputs and the fluxes are promoted to float64.
     """
     
-    def __init__(self, data=None, nbimg=(None, None), transpose=False):
+    def __init__(self, data=None, nbimg=(None, None), transpose=False, rows=None, pool=None, dtype=None):
         """
         Init the instance class by calling the ``loadfile' method.
         """
-        self.loadfile(data, nbimg, transpose)
+        self.loadfile(data, nbimg, transpose, rows, pool, dtype)
             
             
-    def loadfile(self, data=None, nbimg=None, transpose=False):
+    def loadfile(self, data=None, nbimg=(None, None), transpose=False, rows=None, pool=None, dtype=None):
         """ 
         Load the datacube when a File-object is created.
 
         :Parameters:
             
-            **data: string (optional)**
+            **data: string or ndarray (optional)**
                 Path to the datacube to load. 
                 If ``None``, datacube full of 0 is created, with same dimension as real data (nbimg, 344, 96).
                 In that case, parameter ``nbimg`` cannot be ``None``.
+                If an array (e.g. a batch from ``streamFrames``), it is used as the datacube 
+                and ``nbimg`` is ignored. It must already be restricted to ``rows``.
                 
             **nbimg: tup (optional)**
                 Load all frames of the datacube at path ``data`` from the first to the second-1 element of the tuple.
@@ -201,6 +863,20 @@ class File(object):
                 
             **transpose: bol (optional)**
                 If ``True``, swappes the 2nd and 3rd axis of the datacube.
+                The layout of the datacubes transcoded by :doc:`glint_transcode` is detected.
+                
+            **rows: tup (optional)**
+                Load only the rows of the detector (spatial axis) from the first 
+                to the second-1 element of the tuple.
+                If ``None``, all the rows are loaded.
+                
+            **pool: BufferPool (optional)**
+                Pool of arrays in which the datacube is read.
+                If ``None``, new arrays are allocated.
+                
+            **dtype: dtype (optional)**
+                Precision of the reduction, the datacube is converted to it while it is read.
+                If ``None``, the type of the datacube is kept.
                 
         :Attributes:
             
@@ -210,25 +886,58 @@ class File(object):
                 loaded or created datacube
             **nbimg**: float
                 number of frames in the data ndarray
+            **row_offset**: int
+                index of the first loaded row of the detector, 
+                used to locate the outputs in ``data``
+            **dtype**: dtype
+                precision of the reduction
             
         """
-
-        if data != None:
-            with h5py.File(data, 'r') as dataFile:
-                self.data   = np.array(dataFile['imagedata'])
-                self.data = self.data[nbimg[0]:nbimg[1]]
+        if rows is None:
+            rows = (None, None)
+        self.row_offset = rows[0] if rows[0] is not None else 0
+        self.pool = pool
+        self._buffers = []
+        self.dtype = dtype
+        
+        if isinstance(data, np.ndarray):
+            self.data = data if dtype is None else data.astype(dtype, copy=False)
+            self.nbimg = self.data.shape[0]
+            
+        elif data is not None:
+            with glint_cache.pinnedPath(data) as local, h5py.File(local, 'r') as dataFile:
+                # Only the requested hyperslab is read from the file
+                self.data = _readFrames(dataFile['imagedata'], slice(nbimg[0], nbimg[1]), rows, transpose, self._getBuffer, dtype)
                 self.nbimg  = self.data.shape[0]
-                if transpose: 
-#                    print('Transpose')
-#                    print(self.data.shape)
-                    self.data = np.transpose(self.data, axes=(0,2,1))
-#                    print(self.data.shape)
-                self.data = np.transpose(self.data, axes=(0,2,1))
                     
         else:
             print("Mock data created")
             self.nbimg = nbimg[1]-nbimg[0]
-            self.data = np.zeros((self.nbimg,344,96))
+            self.data = np.zeros((self.nbimg,344,96), dtype=dtype if dtype is not None else np.float64)[:,rows[0]:rows[1]]
+
+    def _getBuffer(self, shape, dtype=np.float64):
+        """
+        Gives an uninitialised array from the pool of the instance, 
+        or a new one if there is no pool.
+        """
+        if self.pool is None:
+            return np.empty(shape, dtype)
+        arr = self.pool.get(shape, dtype)
+        self._buffers.append(arr)
+        return arr
+        
+    def release(self):
+        """
+        Gives back to the pool the arrays used by the instance so that the 
+        next datacube is loaded and processed in them.
+        The attributes filled in these arrays (e.g. ``data``, ``slices``, 
+        ``raw``, ``amplitude``) must not be used anymore: release the instance 
+        once its products are saved or copied.
+        """
+        if self.pool is not None:
+            for arr in self._buffers:
+                self.pool.release(arr)
+        self._buffers = []
 
     def cosmeticsFrames(self, dark, nonoise=False):
         """ 
@@ -244,7 +953,7 @@ class File(object):
 
         :Parameters:
             **dark**: 2d-array
-                Average dark
+                Average dark, with the rows of the whole frame or of the loaded rows only (see ``rows`` in ``File``)
                 
             **nbimg**: tup (optional)
                 Load all frames of the datacube at path ``data`` from the first 
@@ -274,6 +983,13 @@ class File(object):
             self.bg_var = np.zeros(self.data.shape[0])
         else:
             if not np.all(dark==0): #If 'dark' is not a 0-array
+                nb_rows = self.data.shape[1]
+                if dark.shape[0] != nb_rows: # Dark of the whole frame, cropped to the loaded rows
+                    if dark.shape[0] < self.row_offset + nb_rows:
+                        raise ValueError('The dark has %s rows, it does not cover the loaded rows %s to %s'%(dark.shape[0], self.row_offset, self.row_offset+nb_rows))
+                    dark = dark[self.row_offset:self.row_offset+nb_rows]
+                if self.dtype is not None:
+                    dark = dark.astype(self.dtype, copy=False)
                 self.data = self.data - dark
                 self.data = self.data - self.data[:,:,:20].mean(axis=(1,2))[:,None,None]
                 
@@ -322,11 +1038,284 @@ class File(object):
         return arr
 
 
+class Prefetcher(object):
+    """
+    Background reader of datacubes.
+    While the current datacube is processed, the next ones of the list are 
+    loaded by a pool of threads. The number of datacubes loaded in advance is 
+    bounded so the memory used does not grow with the length of the list.
+    
+    Iterating over the object yields the path of the datacube and the object 
+    created by the ``loader``, in the order of the list.
+    Errors raised while loading are raised again when the datacube is yielded.
+    
+    :Parameters:
+        **data_list**: list
+            List of paths of the datacubes to load.
+            
+        **loader**: class or callable (optional)
+            Called with the path of the datacube and the keywords ``kwargs``.
+            Default is the class ``Null``.
+            
+        **nb_threads**: int (optional)
+            Number of threads loading the datacubes.
+            
+        **queue_size**: int (optional)
+            Maximum number of datacubes loaded in advance.
+            
+        **kwargs**: optional
+            Keywords given to the ``loader`` (e.g. ``nbimg``, ``rows``).
+    """
+    def __init__(self, data_list, loader=None, nb_threads=1, queue_size=2, **kwargs):
+        self.data_list = data_list
+        self.loader = loader if loader is not None else Null
+        self.nb_threads = max(nb_threads, 1)
+        self.queue_size = max(queue_size, 1)
+        self.kwargs = kwargs
+        
+    def __len__(self):
+        return len(self.data_list)
+        
+    def __iter__(self):
+        executor = ThreadPoolExecutor(max_workers=self.nb_threads)
+        items = iter(self.data_list)
+        queue = deque([(f, executor.submit(self.loader, f, **self.kwargs)) for f in islice(items, self.queue_size)])
+        try:
+            while queue:
+                f, future = queue.popleft()
+                loaded = future.result()
+                # Keep the queue full while the current datacube is processed
+                for f_next in islice(items, 1):
+                    queue.append((f_next, executor.submit(self.loader, f_next, **self.kwargs)))
+                yield f, loaded
+        finally:
+            for elt in queue:
+                elt[1].cancel()
+            executor.shutdown(wait=True)
+
+
+class AsyncWriter(object):
+    """
+    Background writer of the products.
+    The writes (e.g. the method ``save`` of a ``Null`` object) are queued and 
+    done one after the other by a thread while the next datacube is processed.
+    The queue is bounded so the processing waits for the writer if the writes 
+    are slower than the processing.
+    
+    An error raised by a write is raised again by the next call to ``submit`` 
+    or by ``close``, the writes queued after it are skipped.
+    The queue is flushed when the object is closed, at the end of a ``with`` 
+    block or at the exit of the interpreter.
+    
+    :Parameters:
+        **queue_size**: int (optional)
+            Maximum number of writes waiting in the queue. If 0, the writes 
+            are done immediately by ``submit``.
+    """
+    def __init__(self, queue_size=2):
+        self.queue_size = max(queue_size, 0)
+        self.error = None
+        self.closed = False
+        if self.queue_size > 0:
+            self._queue = Queue(maxsize=self.queue_size)
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+            atexit.register(self.close) # Queued products are written even if the script stops on an error
+            
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            if self.error is None:
+                func, args, kwargs = job
+                try:
+                    func(*args, **kwargs)
+                except BaseException as e:
+                    self.error = e
+                    
+    def _raiseError(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        
+    def submit(self, func, *args, **kwargs):
+        """
+        Queues a write.
+        
+        :Parameters:
+            **func**: callable
+                Function doing the write, called with ``args`` and ``kwargs``.
+        """
+        if self.closed:
+            raise RuntimeError('The writer is closed')
+        self._raiseError()
+        if self.queue_size == 0:
+            func(*args, **kwargs)
+        else:
+            self._queue.put((func, args, kwargs))
+        
+    def close(self):
+        """
+        Waits for the queued writes to be done and stops the thread.
+        """
+        if not self.closed:
+            self.closed = True
+            if self.queue_size > 0:
+                self._queue.put(None)
+                self._thread.join()
+                atexit.unregister(self.close)
+        self._raiseError()
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else: # Do not hide the error of the processing
+            try:
+                self.close()
+            except BaseException:
+                pass
+
+
+class BufferPool(object):
+    """
+    Pool of arrays reused from one datacube to the next.
+    Processing a night allocates the same working arrays (frames, outputs, 
+    fluxes...) for every file. Taking them from the pool and giving them back 
+    once the file is processed keeps a fixed working set instead.
+    Arrays are identified by their shape and their dtype, their content is not reset.
+    The pool can be shared with the threads of a ``Prefetcher``.
+    """
+    def __init__(self):
+        self._free = {}
+        self._lock = threading.Lock()
+        
+    def get(self, shape, dtype=np.float64):
+        """
+        Gives an array from the pool, or a new one if none is available.
+        
+        :Parameters:
+            **shape**: tuple
+                Shape of the array.
+            **dtype**: dtype (optional)
+                Type of the array.
+        
+        :Returns:
+            Uninitialised array.
+        """
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                return free.pop()
+        return np.empty(shape, dtype)
+        
+    def release(self, arr):
+        """
+        Gives back an array to the pool.
+        
+        :Parameters:
+            **arr**: ndarray
+                Array given by the method ``get``.
+        """
+        key = (arr.shape, arr.dtype.str)
+        with self._lock:
+            self._free.setdefault(key, []).append(arr)
+
+
+class FitSummary(object):
+    """
+    Summary of the quality of the fits of the flux (see ``Null.getSpectralFlux``), 
+    per output and spectral channel. It replaces the cube of residuals 
+    for the routine monitoring of the extraction and can be accumulated over the datacubes.
+    
+    :Parameters:
+        **nb_tracks**: int (optional)
+            Number of outputs.
+        **nb_wl**: int (optional)
+            Number of spectral channels.
+            
+    :Attributes:
+        **nb_frames**: int
+            Number of frames summarised.
+        **chi2_mean**: ndarray
+            Mean reduced chi2 of the fits over the frames.
+        **residual_max**: ndarray
+            Maximum absolute residual of the fits.
+        **nb_failed**: ndarray
+            Number of fits whose normal matrix is ill-conditioned or singular, 
+            solved by least squares instead.
+    """
+    def __init__(self, nb_tracks=16, nb_wl=96):
+        self.nb_frames = 0
+        self.chi2_mean = np.zeros((nb_tracks, nb_wl))
+        self.residual_max = np.zeros((nb_tracks, nb_wl))
+        self.nb_failed = np.zeros((nb_tracks, nb_wl), dtype=np.int64)
+        
+    def update(self, other):
+        """
+        Adds the summary of other frames.
+        
+        :Parameters:
+            **other**: FitSummary
+                Summary to add.
+        """
+        nb_frames = self.nb_frames + other.nb_frames
+        if nb_frames > 0:
+            self.chi2_mean = (self.chi2_mean * self.nb_frames + other.chi2_mean * other.nb_frames) / nb_frames
+        self.residual_max = np.maximum(self.residual_max, other.residual_max)
+        self.nb_failed = self.nb_failed + other.nb_failed
+        self.nb_frames = nb_frames
+        
+    def save(self, path):
+        """
+        Saves the summary in a HDF5 file.
+        
+        :Parameters:
+            **path**: str
+                Path of the file.
+        """
+        with h5py.File(path, 'w') as f:
+            f.attrs['nb_frames'] = self.nb_frames
+            f.create_dataset('chi2_mean', data=self.chi2_mean)
+            f.create_dataset('residual_max', data=self.residual_max)
+            f.create_dataset('nb_failed', data=self.nb_failed)
+            
+    def scatter(self, tracks, nb_tracks=16):
+        """
+        Gives the summary of the fits of a selection of tracks with one row per track, 
+        so it can be accumulated with the summaries of all the tracks.
+        The tracks which are not fitted have a NaN chi2 and residual.
+        
+        :Parameters:
+            **tracks**: array-like
+                Track of each row of the summary.
+            **nb_tracks**: int (optional)
+                Total number of tracks.
+                
+        :Returns:
+            FitSummary
+        """
+        summary = FitSummary(nb_tracks, self.chi2_mean.shape[1])
+        summary.nb_frames = self.nb_frames
+        summary.chi2_mean[:] = np.nan
+        summary.residual_max[:] = np.nan
+        summary.chi2_mean[tracks] = self.chi2_mean
+        summary.residual_max[tracks] = self.residual_max
+        summary.nb_failed[tracks] = self.nb_failed
+        return summary
+
+
 class Null(File):
     """
     Class handling the measurement of the null and photometries 
     from bias-corrected frame.
     """
+    which_tracks = np.arange(16) # Extracted tracks, see ``preprocess``
+    noise_slices = None # Edges of all the outputs when only some of them are extracted, see ``preprocess``
         
     def getChannels(self, channel_pos, sep, spatial_axis, **kwargs):
         """
@@ -353,21 +1342,204 @@ class Null(File):
             **slices_axes**: ndarray
                 Spatial coordinates of each channel
         """
-        self.slices = np.array([self.data[:,np.int(np.around(pos-sep/2)):np.int(np.around(pos+sep/2)),:] for pos in channel_pos])
-        self.slices = np.transpose(self.slices, (1,3,0,2))
-        self.slices_axes = np.array([spatial_axis[np.int(np.around(pos-sep/2)):np.int(np.around(pos+sep/2))] for pos in channel_pos])
+        offset = self.row_offset
+        bounds = [(int(np.around(pos-sep/2))-offset, int(np.around(pos+sep/2))-offset) for pos in channel_pos]
+        if 'dark' in kwargs:
+            dtype = np.result_type(self.data.dtype, kwargs['dark'].dtype)
+        else:
+            dtype = self.data.dtype
+        self.slices = self._getBuffer((self.data.shape[0], self.data.shape[2], len(bounds), bounds[0][1]-bounds[0][0]), dtype)
+        for k, (start, stop) in enumerate(bounds):
+            self.slices[:,:,k,:] = np.swapaxes(self.data[:,start:stop,:], 1, 2)
+        self.slices_axes = np.array([spatial_axis[int(np.around(pos-sep/2)):int(np.around(pos+sep/2))] for pos in channel_pos])
+        self.which_tracks = np.arange(len(bounds))
+        self.noise_slices = None
         # self.slices = self.slices[:,:,:,10-4:10+5]
         # self.slices_axes  = self.slices_axes[:,10-4:10+5]
-        self.slices0 = self.slices.copy()
+        self.slices0 = self._getBuffer(self.slices.shape, self.data.dtype)
+        self.slices0[:] = self.slices
 
         if 'dark' in kwargs:
             dk = kwargs['dark'][None,:]
-            self.slices = self.slices - dk#[:,:,:,10-4:10+5]
+            self.slices -= dk#[:,:,:,10-4:10+5]
             self.med_slices = np.median(self.slices[:,:10], axis=(1,3))
-            self.slices = self.slices - self.med_slices[:,None,:,None]
+            self.slices -= self.med_slices[:,None,:,None]
+            
+    def preprocess(self, channel_pos, sep, spatial_axis, dark=None, nonoise=False, keep_slices0=False, outputs=None):
+        """
+        Fused equivalent of ``cosmeticsFrames`` with a dark full of 0 followed by ``getChannels``.
+        Each frame is read once to estimate the background noise, extract the 
+        16 outputs, remove the dark per channel and the median background of 
+        each output, without any intermediate datacube.
+        
+        Only the tracks of a selection of baselines and outputs can be extracted (see ``getTracks``).
+        The following methods then fit, match and save only these tracks: 
+        the intensities of the other outputs are NaN and they are not saved.
+        
+        :Parameters:
+            **channel_pos**: list, array-like
+                Expected position of the arrays
+            **sep**: float
+                Separation (in pixels) between two consecutive channels
+            **spatial_axis**: 1d-array
+                Position-coordinate of each channel
+            **dark**: 3d-array (optional)
+                Average dark of each channel, with the structure (spectral axis, channel ID, spatial axis).
+                If ``None``, neither the dark nor the median background are removed.
+                It is converted to the precision of the reduction, if set (see ``File``).
+            **nonoise**: bool (optional)
+                Set to ``True`` if data does not have any detector noise (e.g. simulated one).
+            **keep_slices0**: bool (optional)
+                If ``True``, the outputs before the removal of the dark are kept in ``slices0``.
+            **outputs**: str or list (optional)
+                Baselines and outputs to extract, see ``getTracks``. If ``None``, the 16 outputs are extracted.
+                
+        :Attributes:
+            Create the attributes
+            
+            **bg_std**, **bg_var**: ndarray
+                Standard deviation and variance of the background of each frame
+            **which_tracks**: ndarray
+                Extracted tracks, in the order of the axis of the channel ID of the following arrays
+            **slices**: 4d-darray 
+                Subframes of each channel.
+                Structure as follow: (frame, spectral axis, channel ID, spatial axis)
+            **slices_axes**: ndarray
+                Spatial coordinates of each channel
+            **med_slices**: ndarray
+                Median background of each channel in each frame, if ``dark`` is given
+            **slices0**: ndarray
+                Subframes of each channel before the removal of the dark, if ``keep_slices0`` is ``True``
+            **noise_slices**: ndarray
+                First ``noise_columns`` columns of all the outputs, with the structure of ``slices``, 
+                if only some outputs are extracted (``None`` otherwise). 
+                They give the weight of the noise in the fits of ``getSpectralFlux``.
+        """
+        self.which_tracks = getTracks(outputs)
+        nb_all = len(channel_pos)
+        offset = self.row_offset
+        starts = np.array([int(np.around(pos-sep/2))-offset for pos in channel_pos])
+        width = int(np.around(channel_pos[0]+sep/2)) - int(np.around(channel_pos[0]-sep/2))
+        if starts.min() < 0 or starts.max() + width > self.data.shape[1]:
+            raise IndexError('The outputs are not all in the loaded rows of the frames')
+        self.slices_axes = np.array([spatial_axis[int(np.around(pos-sep/2)):int(np.around(pos+sep/2))] for pos in np.asarray(channel_pos)[self.which_tracks]])
+        selected = np.full(nb_all, -1, dtype=np.int64) # Index of each track in ``slices``, -1 if it is not extracted
+        selected[self.which_tracks] = np.arange(self.which_tracks.size)
+        
+        nbimg, nb_wl = self.data.shape[0], self.data.shape[2]
+        remove_dark = dark is not None
+        if remove_dark:
+            dtype = np.result_type(self.data.dtype, dark.dtype) if self.dtype is None else self.dtype
+            dark = np.ascontiguousarray(dark, dtype=dtype) # Layout of the compiled kernel
+        else:
+            dark = np.zeros((1, 1, 1), self.data.dtype) # Not used
+            dtype = self.data.dtype
+        self.slices = self._getBuffer((nbimg, nb_wl, self.which_tracks.size, width), dtype)
+        if keep_slices0:
+            self.slices0 = self._getBuffer(self.slices.shape, self.data.dtype)
+            slices0 = self.slices0
+        else:
+            slices0 = np.zeros((1, 1, 1, 1), self.data.dtype) # Not used
+        # The weight of the noise in the fits is given by the background of all the outputs, 
+        # so a selection of outputs gives the same fluxes as the extraction of all of them
+        keep_noise = self.which_tracks.size < nb_all
+        if keep_noise:
+            self.noise_slices = np.empty((nbimg, nb_wl, nb_all, min(noise_columns, width)), dtype)
+        else:
+            self.noise_slices = None
+        noise = self.noise_slices if keep_noise else np.zeros((1, 1, 1, 1), dtype) # Not used
+        self.med_slices = np.zeros((nbimg, self.which_tracks.size))
+        self.bg_std = np.zeros(nbimg)
+        self.bg_var = np.zeros(nbimg)
+        self._preprocessNumba(self.data, starts, selected, dark, self.slices, slices0, noise, self.med_slices, self.bg_std, self.bg_var,
+                              remove_dark, keep_slices0, keep_noise, nonoise)
+        
+    @staticmethod
+    @jit(nopython=True, parallel=True, cache=True)
+    def _preprocessNumba(data, starts, selected, dark, slices, slices0, noise, med_slices, bg_std, bg_var, remove_dark, keep_slices0, keep_noise, nonoise):
+        """
+        Numba-ized function doing the work of ``preprocess``, in parallel over the frames.
+        
+        :Parameters:
+            **data**: ndarray
+                Frames with the structure (frame, spatial, spectral).
+            **starts**: ndarray
+                First row of each output in the frames, for all the outputs.
+            **selected**: ndarray
+                Index of each output in ``slices``, -1 if it is not extracted.
+            **dark**: ndarray
+                Average dark of each channel, for all the outputs.
+            **slices**, **slices0**, **med_slices**, **bg_std**, **bg_var**: ndarray
+                Arrays filled with the results, see ``preprocess``.
+            **noise**: ndarray
+                Array filled with the first columns of all the outputs, see ``noise_slices`` in ``preprocess``.
+            **remove_dark**: bool
+                If ``True``, the dark and the median background are removed.
+            **keep_slices0**: bool
+                If ``True``, ``slices0`` is filled.
+            **keep_noise**: bool
+                If ``True``, ``noise`` is filled.
+            **nonoise**: bool
+                If ``True``, the background noise is set to 0.
+        """
+        nbimg, nb_rows, nb_wl = data.shape
+        nb_tracks, width = starts.size, slices.shape[3]
+        nb_noise = noise.shape[3]
+        nb_bg = min(20, nb_wl) # Signal-free columns of the frames
+        nb_med = min(10, nb_wl) # Columns where the background of the outputs is measured
+        for k in prange(nbimg):
+            if not nonoise:
+                mean = 0.
+                for r in range(nb_rows):
+                    for c in range(nb_bg):
+                        mean += data[k,r,c]
+                mean /= nb_rows * nb_bg
+                var = 0.
+                for r in range(nb_rows):
+                    for c in range(nb_bg):
+                        var += (data[k,r,c] - mean)**2
+                var /= nb_rows * nb_bg
+                bg_var[k] = var
+                bg_std[k] = var**0.5
+                
+            background = np.empty(nb_med * width)
+            track = np.empty((nb_wl, width), slices.dtype) # Output being extracted
+            for i in range(nb_tracks):
+                o = selected[i]
+                if o < 0 and not keep_noise:
+                    continue
+                for j in range(nb_wl):
+                    for s in range(width):
+                        value = data[k,starts[i]+s,j]
+                        if keep_slices0 and o >= 0:
+                            slices0[k,j,o,s] = value
+                        if remove_dark:
+                            track[j,s] = value - dark[j,i,s]
+                        else:
+                            track[j,s] = value
+                            
+                if remove_dark:
+                    for j in range(nb_med):
+                        for s in range(width):
+                            background[j*width+s] = track[j,s]
+                    med = np.median(background)
+                    if o >= 0:
+                        med_slices[k,o] = med
+                    for j in range(nb_wl):
+                        for s in range(width):
+                            track[j,s] -= med
+                
+                if o >= 0:
+                    for j in range(nb_wl):
+                        for s in range(width):
+                            slices[k,j,o,s] = track[j,s]
+                if keep_noise:
+                    for j in range(nb_wl):
+                        for s in range(nb_noise):
+                            noise[k,j,i,s] = track[j,s]
             
         
-    def getSpectralFlux(self, spectral_axis, positions, widths, mode_flux, debug=False):
+    def getSpectralFlux(self, spectral_axis, positions, widths, mode_flux, debug=False, engine='numba', nb_threads=None, keep_residuals=False):
         """
         Wrapper getting the flux per spectral channel of each output.
         
@@ -391,6 +1563,24 @@ class Null(File):
                 the save of the final products.
                 If ``False``, use the numba function ``_getSpectralFluxNumba``.
                 For fast and routine use of the measurement of the flux.
+                The fluxes are in the precision of the reduction (see ``File``), float64 if it is not set.
+            **engine**: str (optional)
+                Method of the least squares when ``debug`` is ``False`` and ``mode_flux`` is not ``raw``:
+                * ``numba`` (default) solves the least squares frame by frame with ``_getSpectralFluxNumba``
+                * ``parallel`` does the same as ``numba`` on several cores, with identical results
+                * ``projector`` precomputes the projectors of every output and spectral channel once per calibration and applies them to all the frames at once. 
+                  The fluxes differ from the ones of ``numba`` by rounding errors, about 1e-14 relative to the largest flux of an output
+            **nb_threads**: int (optional)
+                Number of threads of the ``parallel`` engine. If ``None``, one per core.
+            **keep_residuals**: bool (optional)
+                If ``True``, the residuals of the fits are kept in ``residuals_reg``. 
+                This cube is 20 times larger than ``amplitude``.
+                They are always kept in debug mode.
+                
+        Only the tracks extracted by ``preprocess`` are fitted, ``positions`` and ``widths`` 
+        are given for the 16 tracks. The weight of the noise in the fits is estimated 
+        on the edges of all the outputs (``noise_slices``) so the flux of a selection 
+        of outputs is the one of the same outputs extracted with all the others.
                 
         :Attributes:
             Creates the following attributes
@@ -401,9 +1591,14 @@ class Null(File):
                 Estimation of the uncertainty of the estimation of the raw flux.
             **amplitude**: ndarray
                 Estimation of the spectral flux as the amplitude of the Gaussian 
-                profile fitted by numpy's linear leastsquare method.
+                profile fitted by numpy's linear leastsquare method, 
+                for the tracks in ``which_tracks``.
             **residuals_reg**: ndarray
-                Residuals from the fit which gives ``amplitude`` attribute.
+                Residuals from the fit which gives ``amplitude`` attribute, 
+                ``None`` if ``keep_residuals`` is ``False``.
+            **fit_summary**: FitSummary
+                Summary of the quality of the fits which give ``amplitude``, 
+                with one row per track, ``None`` in debug or ``raw`` mode.
             **amplitude_fit**: ndarray
                 From debug-mode only.
                 Estimation of the spectral flux as the amplitude of the Gaussian 
@@ -418,13 +1613,15 @@ class Null(File):
             **amplitude_error**: ndarray
                 Uncertainty of the estimation of ``amplitude``
         """
-        which_tracks = np.arange(16)
+        which_tracks = np.arange(self.which_tracks.size) # Tracks of the slices
         nbimg = self.data.shape[0]
         slices_axes, slices = self.slices_axes, self.slices
+        positions, widths = positions[self.which_tracks], widths[self.which_tracks]
         # positions = np.array([p(spectral_axis) for p in position_poly])
         # widths = np.array([p(spectral_axis) for p in width_poly])
         # positions = position
         # widths = width
+        self.fit_summary = None
 
         if debug:
             print('DEBUG')
@@ -436,27 +1633,50 @@ class Null(File):
         #     self.amplitude_fit, self.amplitude, self.integ_model, self.integ_windowed, self.residuals_fit, self.residuals_reg, self.cov, self.weights = \
         # _getSpectralFlux(nbimg, which_tracks, slices_axes, slices, spectral_axis, positions, widths)
             self.amplitude_fit, self.amplitude, self.residuals_fit, self.residuals_reg, self.cov, self.amplitude_error = \
-                _getSpectralFlux(nbimg, which_tracks, slices_axes, slices, spectral_axis, positions, widths)
+                _getSpectralFlux(nbimg, self.which_tracks, slices_axes, slices, spectral_axis, positions, widths)
         else:
             if mode_flux == 'raw':
-                self.raw = self.slices[:,:,:,10-4:10+5].mean(axis=-1)
+                dtype = self.slices.dtype if np.issubdtype(self.slices.dtype, np.floating) else np.float64
+                self.raw = self._getBuffer(self.slices.shape[:3], dtype)
+                np.mean(self.slices[:,:,:,10-4:10+5], axis=-1, out=self.raw)
                 self.raw = np.transpose(self.raw, axes=(0,2,1))
-                self.raw_err = self.slices[:,:,:,:10-5].std(axis=-1) / slices_axes.shape[-1]**0.5
+                self.raw_err = self._getBuffer(self.slices.shape[:3], dtype)
+                np.std(self.slices[:,:,:,:10-5], axis=-1, out=self.raw_err)
+                self.raw_err /= slices_axes.shape[-1]**0.5
                 self.raw_err = np.transpose(self.raw_err, axes=(0,2,1))
             else:
-                try:
-                    self.amplitude, self.residuals_reg, self.amplitude_error = self._getSpectralFluxNumba(nbimg, which_tracks, slices_axes, slices, spectral_axis, positions, widths)
-                except np.linalg.LinAlgError:
-                    print('LinAlgError')
-                    self.amplitude, self.residuals_reg, self.amplitude_error = self._getSpectralFluxNumba2(nbimg, which_tracks, slices_axes, slices, spectral_axis, positions, widths)
+                dtype = self.dtype if self.dtype is not None else np.float64
+                amplitude = self._getBuffer((nbimg, which_tracks.size, len(spectral_axis)), dtype)
+                if keep_residuals:
+                    residuals_reg = self._getBuffer((nbimg, which_tracks.size, len(spectral_axis), slices_axes.shape[1]), dtype)
+                else:
+                    residuals_reg = None
+                error = self._getBuffer((nbimg, which_tracks.size, len(spectral_axis)), dtype)
+                self.fit_summary = FitSummary(which_tracks.size, len(spectral_axis))
+                # Weight of the noise from all the outputs, whatever the selection
+                std = _noiseWeight(self.noise_slices if self.noise_slices is not None else slices)
+                if engine == 'projector':
+                    self.amplitude, self.residuals_reg, self.amplitude_error = _projectSpectralFlux(slices_axes, slices, positions, widths,\
+                                                                                                    amplitude, residuals_reg, error, self.fit_summary, std=std)
+                else:
+                    parallel = engine == 'parallel'
+                    if parallel:
+                        setFluxThreads(nb_threads)
+                    self.amplitude, self.residuals_reg, self.amplitude_error = self._getSpectralFluxNumba(nbimg, which_tracks, slices_axes, slices, spectral_axis, positions, widths,\
+                                                                                                         amplitude, residuals_reg, error, parallel, self.fit_summary, std)
+                if which_tracks.size < 16:
+                    self.fit_summary = self.fit_summary.scatter(self.which_tracks)
             # self.windowed_err = self.bg_std #* np.sum(self.weights)**0.5
         # return positions, widths
         
     @staticmethod
-    @jit(nopython=True)
-    def _getSpectralFluxNumba(nbimg, which_tracks, slices_axes, slices, spectral_axis, positions, widths):
+    def _getSpectralFluxNumba(nbimg, which_tracks, slices_axes, slices, spectral_axis, positions, widths, amplitude, residuals_reg, error, parallel=False, summary=None, std=None):
         """
-        Numba-ized function measuring the flux per spectral channel (1 pixel width)
+        Numba-ized function measuring the flux per spectral channel (1 pixel width).
+        The normal equations of the weighted least squares are solved, 
+        except for the outputs and spectral channels whose normal matrix is 
+        ill-conditioned or singular: they are solved with ``np.linalg.lstsq`` 
+        and counted in ``summary.nb_failed``.
         
         :Parameters:
             **nbimg**: int
@@ -475,61 +1695,40 @@ class Null(File):
                 Estimated positions of each output respect to wavelength.
             **widths**: array-like
                 Estimated widths of each output respect to wavelength.
+            **amplitude**, **residuals_reg**, **error**: ndarray
+                Arrays filled with the results, of shape (frame, output, spectral channel) 
+                and (frame, output, spectral channel, spatial) for ``residuals_reg``.
+                Every element is overwritten.
+                ``residuals_reg`` can be ``None`` to not keep the residuals.
+            **parallel**: bool (optional)
+                If ``True``, the outputs and spectral channels are processed in parallel 
+                by the threads of numba. The results are identical to the serial ones.
+            **summary**: FitSummary (optional)
+                Summary of the quality of the fits, filled in place.
+            **std**: float (optional)
+                Weight of the noise, given by ``_noiseWeight`` on ``slices`` if ``None``.
                 
         :Returns:
             **amplitude**: ndarray
                 Estimation of the spectral flux as the amplitude of the Gaussian 
-                profile fitted by numpy's linear leastsquare method.
+                profile fitted by numpy's linear leastsquare method, 
+                for the tracks in ``which_tracks``.
             **residuals_reg**: ndarray
                 Residuals from the fit which gives ``amplitude`` attribute.                
         """
-        nb_tracks = 16
-        amplitude = np.zeros((nbimg, nb_tracks, len(spectral_axis)))
-        residuals_reg = np.zeros((nbimg, nb_tracks, len(spectral_axis), slices_axes.shape[1]))
-        error = np.zeros((nbimg, nb_tracks, len(spectral_axis)))
-        
-        std = 1/slices[:,:,:,:10-5].std()
-        # With fitted amplitude
-        for k in range(nbimg):
-            for i in which_tracks:
-                for j in range(len(spectral_axis)):
-                    # print(k,i,j)
-                    # 1st estimator : amplitude of the Gaussian profil of the track, use of linear least square
-                    # simple_gaus = np.exp(-(slices_axes[i]-positions[i,j])**2/(2*widths[i,j]**2)) # Shape factor of the intensity profile, to be removed before computing Null depth
-                    # A = np.vstack((simple_gaus, np.ones_like(simple_gaus)))
-                    # A = np.transpose(A)
-                    simple_gaus0 = np.exp(-(slices_axes[i]-positions[i,j])**2/(2*widths[i,j]**2))
-                    simple_gaus = simple_gaus0 / np.sum(simple_gaus0)
-                    simple_gaus[np.isnan(simple_gaus)] = 0.
-                    
-                    weights = np.diag(simple_gaus + std)
-                    
-                    A = np.vstack((simple_gaus, np.ones_like(simple_gaus), slices_axes[i]))
-                    if j >= 20 and not np.all(simple_gaus == 0):
-                        # A = np.vstack((simple_gaus, np.ones_like(simple_gaus)))
-                        Aw = np.dot(A, weights)
-                        AwAwT = np.dot(Aw, np.transpose(Aw))
-                        dataw = np.dot(slices[k,j,i], weights)
-                        b = np.dot(Aw,dataw)
-
-                        # popt2 = np.linalg.lstsq(Aw.T, dataw)[0]
-                        # popt2 = np.linalg.solve(np.dot(A,np.transpose(A)), np.dot(A, slices[k,j,i]))
-                        popt2 = np.linalg.solve(AwAwT, b)
-                    else:
-                        # popt2 = np.zeros(A.shape[1])
-                        popt2 = np.zeros(A.shape[0])
-                    residuals_reg[k,i,j] = slices[k,j,i] - (popt2[0] * simple_gaus + popt2[1] + popt2[2] * slices_axes[i])
-                    amplitude[k,i,j] = popt2[0]
-                    chi2 = np.sum(residuals_reg[k,i,j]**2) / (slices_axes[i].size-popt2.size)
-                    error[k,i,j] = (chi2 / np.sum((slices_axes[i] - np.mean(slices_axes[i]))**2))**0.5
-                    
+        if summary is None:
+            summary = FitSummary(*amplitude.shape[1:])
+        summary.nb_failed[:] = 0
+        _runSpectralFluxKernel(nbimg, which_tracks, slices_axes, slices, spectral_axis, positions, widths, False,
+                               amplitude, residuals_reg, error, parallel, summary, std)
         return amplitude, residuals_reg, error
 
     @staticmethod
-    @jit(nopython=True)
-    def _getSpectralFluxNumba2(nbimg, which_tracks, slices_axes, slices, spectral_axis, positions, widths):
+    def _getSpectralFluxNumba2(nbimg, which_tracks, slices_axes, slices, spectral_axis, positions, widths, amplitude, residuals_reg, error, parallel=False, summary=None):
         """
-        Numba-ized function measuring the flux per spectral channel (1 pixel width)
+        Numba-ized function measuring the flux per spectral channel (1 pixel width).
+        The weighted least squares are solved with ``np.linalg.lstsq``, 
+        which is slower than ``_getSpectralFluxNumba`` but robust to singular matrices.
         
         :Parameters:
             **nbimg**: int
@@ -548,44 +1747,30 @@ class Null(File):
                 Estimated positions of each output respect to wavelength.
             **widths**: array-like
                 Estimated widths of each output respect to wavelength.
+            **amplitude**, **residuals_reg**, **error**: ndarray
+                Arrays filled with the results, of shape (frame, output, spectral channel) 
+                and (frame, output, spectral channel, spatial) for ``residuals_reg``.
+                Every element is overwritten.
+                ``residuals_reg`` can be ``None`` to not keep the residuals.
+            **parallel**: bool (optional)
+                If ``True``, the outputs and spectral channels are processed in parallel 
+                by the threads of numba. The results are identical to the serial ones.
+            **summary**: FitSummary (optional)
+                Summary of the quality of the fits, filled in place.
                 
         :Returns:
             **amplitude**: ndarray
                 Estimation of the spectral flux as the amplitude of the Gaussian 
-                profile fitted by numpy's linear leastsquare method.
+                profile fitted by numpy's linear leastsquare method, 
+                for the tracks in ``which_tracks``.
             **residuals_reg**: ndarray
                 Residuals from the fit which gives ``amplitude`` attribute.                
         """
-        nb_tracks = 16
-        amplitude = np.zeros((nbimg, nb_tracks, len(spectral_axis)))
-        residuals_reg = np.zeros((nbimg, nb_tracks, len(spectral_axis), slices_axes.shape[1]))
-        error = np.zeros((nbimg, nb_tracks, len(spectral_axis)))
-        
-        std = 1/slices[:,:,:,:10-5].std()
-        # With fitted amplitude
-        for k in range(nbimg):
-            for i in which_tracks:
-                for j in range(len(spectral_axis)):
-                    # print(k,i,j)
-                    # 1st estimator : amplitude of the Gaussian profil of the track, use of linear least square
-                    simple_gaus0 = np.exp(-(slices_axes[i]-positions[i,j])**2/(2*widths[i,j]**2))
-                    simple_gaus = simple_gaus0 / np.sum(simple_gaus0)
-                    simple_gaus[np.isnan(simple_gaus)] = 0.
-                    A = np.vstack((simple_gaus, np.ones_like(simple_gaus), slices_axes[i]))
-
-                    if j >= 20 and not np.all(simple_gaus == 0):
-                         weights = np.diag(simple_gaus + std)
-                         Aw = np.dot(A, weights)
-                         dataw = np.dot(slices[k,j,i], weights)
-                         popt2 = np.linalg.lstsq(Aw.T, dataw)[0]
-                    else:
-                        # popt2 = np.zeros(A.shape[1])
-                        popt2 = np.zeros(A.shape[0])
-                    residuals_reg[k,i,j] = slices[k,j,i] - (popt2[0] * simple_gaus + popt2[1] + popt2[2] * slices_axes[i])
-                    amplitude[k,i,j] = popt2[0]
-                    chi2 = np.sum(residuals_reg[k,i,j]**2) / (slices_axes[i].size-popt2.size)
-                    error[k,i,j] = (chi2 / np.sum((slices_axes[i] - np.mean(slices_axes[i]))**2))**0.5
-                    
+        if summary is None:
+            summary = FitSummary(*amplitude.shape[1:])
+        summary.nb_failed[:] = 0
+        _runSpectralFluxKernel(nbimg, which_tracks, slices_axes, slices, spectral_axis, positions, widths, True,
+                               amplitude, residuals_reg, error, parallel, summary)
         return amplitude, residuals_reg, error
     
     def getTotalFlux(self):
@@ -595,7 +1780,90 @@ class Null(File):
         This method monitores the flux in one spectral channel (column of pixel 56) for the four photometric outputs.
         """
         self.fluxes = np.sum(self.slices[:,56:57,:,:], axis=(1,3))
-        self.fluxes = np.array([self.fluxes[:,15], self.fluxes[:,13], self.fluxes[:,2], self.fluxes[:,0]])
+        self.fluxes = np.array([self.getTrack(self.fluxes, 15), self.getTrack(self.fluxes, 13), self.getTrack(self.fluxes, 2), self.getTrack(self.fluxes, 0)])
+
+    def getTrack(self, arr, track):
+        """
+        Gives a track from an array of the extracted tracks.
+        
+        :Parameters:
+            **arr**: ndarray
+                Array whose axis 1 follows ``which_tracks`` (e.g. ``amplitude``).
+            **track**: int
+                Track to get.
+                
+        :Returns:
+            ``arr[:,k]`` where ``k`` is the index of the track in ``which_tracks``, 
+            an array of NaN of the same shape if the track is not extracted.
+        """
+        k = np.searchsorted(self.which_tracks, track)
+        if k < self.which_tracks.size and self.which_tracks[k] == track:
+            return arr[:,k]
+        return np.full((arr.shape[0],)+arr.shape[2:], np.nan, arr.dtype)
+    
+    def getOutputs(self, arr, outputs=None):
+        """
+        Gathers outputs from an array of the extracted tracks on the common 
+        wavelength scale (``px_scale``), in a single indexing.
+        
+        :Parameters:
+            **arr**: ndarray
+                Array with the structure (frame, channel ID, spectral axis) 
+                whose axis 1 follows ``which_tracks`` (e.g. ``amplitude``).
+            **outputs**: list (optional)
+                Names of the outputs to gather. If ``None``, ``output_names``.
+                
+        :Returns:
+            Array with the structure (frame, output, wavelength).
+            The outputs which are not extracted are NaN.
+        """
+        outputs = output_names if outputs is None else outputs
+        tracks = np.array([output_tracks[name] for name in outputs])
+        k = np.minimum(np.searchsorted(self.which_tracks, tracks), self.which_tracks.size-1)
+        gathered = arr[:,k[:,None],self.px_scale[tracks]]
+        gathered[:,self.which_tracks[k] != tracks] = np.nan
+        return gathered
+    
+    def _cropChannels(self, wl_min, wl_max):
+        """
+        Keeps the spectral channels of ``px_scale`` and ``wl_scale`` between 
+        ``wl_min`` and ``wl_max`` (in nm) and gives their indexes, per track.
+        """
+        keep = (self.wl_scale >= wl_min) & (self.wl_scale <= wl_max)
+        channels = np.array([np.flatnonzero(elt) for elt in keep], dtype=int)
+        self.px_scale = np.take_along_axis(self.px_scale, channels, axis=1)
+        self.wl_scale = np.take_along_axis(self.wl_scale, channels, axis=1)
+        return channels
+        
+    def checkPrecision(self, reference, rtol=precision_rtol):
+        """
+        Checks the precision of the reduction against a reduction of the same 
+        frames in float64, e.g. for the first datacube of a run in float32.
+        The difference of the intensities of each output (attributes ``pX``, ``IminusX``, ``IplusX``) 
+        is taken relative to the largest absolute intensity of the output.
+        
+        :Parameters:
+            **reference**: Null
+                Same frames reduced in float64 with the same settings, 
+                up to the method ``getIntensities``.
+            **rtol**: float (optional)
+                Tolerance on the relative difference.
+                
+        :Returns:
+            Largest relative difference over the extracted outputs.
+            
+        :Raises:
+            ValueError if the difference is larger than ``rtol``.
+        """
+        extracted = np.isin([output_tracks[name] for name in output_names], self.which_tracks)
+        value = np.asarray(self.intensities[:,extracted], dtype=np.float64)
+        expected = reference.intensities[:,extracted]
+        scale = np.max(np.abs(expected), axis=(0,2))
+        diff = np.max(np.abs(value - expected), axis=(0,2))[scale > 0] / scale[scale > 0]
+        diff = np.max(diff, initial=0.)
+        if diff > rtol:
+            raise ValueError('The intensities differ from the float64 reduction by %.3g (tolerance %.3g): use a higher precision'%(diff, rtol))
+        return diff
 
     
     def matchSpectralChannels(self, wl_to_px_coeff, px_to_wl_coeff):
@@ -622,7 +1890,7 @@ class Null(File):
             
         """
         
-        which_tracks = np.arange(16) # Tracks to process, former argument which functionality no longer exists
+        which_tracks = np.arange(16) # The common scale does not depend on the extracted tracks
         wl_to_px_poly = [np.poly1d(wl_to_px_coeff[i]) for i in which_tracks]
         px_to_wl_poly = [np.poly1d(px_to_wl_coeff[i]) for i in which_tracks]
         shape = self.data.shape
@@ -637,7 +1905,7 @@ class Null(File):
         # self.px_scale = np.array([np.around(wl_to_px_poly[i](self.wl_scale[i])) for i in which_tracks], dtype=np.int)
         step_wl = np.mean(px_to_wl_coeff[:,0])
         self.wl_scale = np.array([np.arange(start, end, step_wl) for i in which_tracks])
-        self.px_scale = np.array([np.around(wl_to_px_poly[i](self.wl_scale[i])) for i in which_tracks], dtype=np.int)
+        self.px_scale = np.array([np.around(wl_to_px_poly[i](self.wl_scale[i])) for i in which_tracks], dtype=int)
         
     def error_null(self, null, Iminus, Iplus, Iminus_err, Iplus_err):
         """
@@ -728,8 +1996,18 @@ class Null(File):
                     * ``raw`` returns the mean of the flux along the spatial axis over the whole width of the output
             **wl_bounds**:tup, optional
                 Set the bounds of the bandwidth to keep, in nanometer. Default is to keep all the common spectral channels to all outputs.
+                
+        The intensities of the outputs which are not extracted (see ``preprocess``) are NaN.
                     
         :Attributes:
+            **intensities**: ndarray
+                Estimated flux in each output, with the structure (frame, output, wavelength).
+                The outputs are in the order of ``output_names``.
+                
+            **pX**, **IminusX**, **IplusX**: ndarray
+                Views of ``intensities`` for each output, kept for compatibility. 
+                Assigning one of them writes in ``intensities``.
+                
             **pX**: ndarray,
                 Estimated flux in the photometric output X=1..4, from the ``amplitude`` attribute.
                 
@@ -780,98 +2058,27 @@ class Null(File):
         """
       
         if mode == 'fit':
-            # With amplitude
-            self.p1 = self.amplitude[:,15][:,self.px_scale[15]]
-            self.p2 = self.amplitude[:,13][:,self.px_scale[13]]
-            self.p3 = self.amplitude[:,2][:,self.px_scale[2]]
-            self.p4 = self.amplitude[:,0][:,self.px_scale[0]]
-            self.Iminus1, self.Iplus1 = self.amplitude[:,11][:,self.px_scale[11]], self.amplitude[:,9][:,self.px_scale[9]]
-            self.Iminus2, self.Iplus2 = self.amplitude[:,3][:,self.px_scale[3]], self.amplitude[:,12][:,self.px_scale[12]]
-            self.Iminus3, self.Iplus3 = self.amplitude[:,1][:,self.px_scale[1]], self.amplitude[:,14][:,self.px_scale[14]]
-            self.Iminus4, self.Iplus4 = self.amplitude[:,6][:,self.px_scale[6]], self.amplitude[:,4][:,self.px_scale[4]]
-            self.Iminus5, self.Iplus5 = self.amplitude[:,5][:,self.px_scale[5]], self.amplitude[:,7][:,self.px_scale[7]]
-            self.Iminus6, self.Iplus6 = self.amplitude[:,8][:,self.px_scale[8]], self.amplitude[:,10][:,self.px_scale[10]] 
-
-            self.p1_err = self.p2_err = self.p3_err = self.p4_err = self.bg_std
-
-        # elif mode == 'model':
-        #     # With full gaussian model
-        #     self.p1 = self.integ_model[:,15,:][:,self.px_scale[15]]
-        #     self.p2 = self.integ_model[:,13,:][:,self.px_scale[13]]
-        #     self.p3 = self.integ_model[:,2,:][:,self.px_scale[2]]
-        #     self.p4 = self.integ_model[:,0,:][:,self.px_scale[0]]
-        #     self.Iminus1, self.Iplus1 = self.integ_model[:,11][:,self.px_scale[11]], self.integ_model[:,9][:,self.px_scale[9]]
-        #     self.Iminus2, self.Iplus2 = self.integ_model[:,3][:,self.px_scale[3]], self.integ_model[:,12][:,self.px_scale[12]]
-        #     self.Iminus3, self.Iplus3 = self.integ_model[:,1][:,self.px_scale[1]], self.integ_model[:,14][:,self.px_scale[14]]
-        #     self.Iminus4, self.Iplus4 = self.integ_model[:,6][:,self.px_scale[6]], self.integ_model[:,4][:,self.px_scale[4]]
-        #     self.Iminus5, self.Iplus5 = self.integ_model[:,5][:,self.px_scale[5]], self.integ_model[:,7][:,self.px_scale[7]]
-        #     self.Iminus6, self.Iplus6 = self.integ_model[:,8][:,self.px_scale[8]], self.integ_model[:,10][:,self.px_scale[10]]
-            
-        #     self.p1_err = self.p2_err = self.p3_err = self.p4_err = self.raw_err
-        
-        # elif mode == 'windowed':
-        #     # With windowed integration
-        #     self.p1 = self.integ_windowed[:,15,:][:,self.px_scale[15]]
-        #     self.p2 = self.integ_windowed[:,13,:][:,self.px_scale[13]]
-        #     self.p3 = self.integ_windowed[:,2,:][:,self.px_scale[2]]
-        #     self.p4 = self.integ_windowed[:,0,:][:,self.px_scale[0]]
-        #     self.Iminus1, self.Iplus1 = self.integ_windowed[:,11][:,self.px_scale[11]], self.integ_windowed[:,9][:,self.px_scale[9]]
-        #     self.Iminus2, self.Iplus2 = self.integ_windowed[:,3][:,self.px_scale[3]], self.integ_windowed[:,12][:,self.px_scale[12]]
-        #     self.Iminus3, self.Iplus3 = self.integ_windowed[:,1][:,self.px_scale[1]], self.integ_windowed[:,14][:,self.px_scale[14]]
-        #     self.Iminus4, self.Iplus4 = self.integ_windowed[:,6][:,self.px_scale[6]], self.integ_windowed[:,4][:,self.px_scale[4]]
-        #     self.Iminus5, self.Iplus5 = self.integ_windowed[:,5][:,self.px_scale[5]], self.integ_windowed[:,7][:,self.px_scale[7]]
-        #     self.Iminus6, self.Iplus6 = self.integ_windowed[:,8][:,self.px_scale[8]], self.integ_windowed[:,10][:,self.px_scale[10]]
-            
-        #     self.p1_err = self.p2_err = self.p3_err = self.p4_err = self.windowed_err
-        
+            fluxes = self.amplitude
         elif mode == 'raw':
-            # With raw integration
-            self.p1 = self.raw[:,15,:][:,self.px_scale[15]]
-            self.p2 = self.raw[:,13,:][:,self.px_scale[13]]
-            self.p3 = self.raw[:,2,:][:,self.px_scale[2]]
-            self.p4 = self.raw[:,0,:][:,self.px_scale[0]]
-            self.Iminus1, self.Iplus1 = self.raw[:,11][:,self.px_scale[11]], self.raw[:,9][:,self.px_scale[9]]
-            self.Iminus2, self.Iplus2 = self.raw[:,3][:,self.px_scale[3]], self.raw[:,12][:,self.px_scale[12]]
-            self.Iminus3, self.Iplus3 = self.raw[:,1][:,self.px_scale[1]], self.raw[:,14][:,self.px_scale[14]]
-            self.Iminus4, self.Iplus4 = self.raw[:,6][:,self.px_scale[6]], self.raw[:,4][:,self.px_scale[4]]
-            self.Iminus5, self.Iplus5 = self.raw[:,5][:,self.px_scale[5]], self.raw[:,7][:,self.px_scale[7]]
-            self.Iminus6, self.Iplus6 = self.raw[:,8][:,self.px_scale[8]], self.raw[:,10][:,self.px_scale[10]]
-            
-            self.p1_err = self.raw_err[:,15,:][:,self.px_scale[15]]
-            self.p2_err = self.raw_err[:,13,:][:,self.px_scale[13]]
-            self.p3_err = self.raw_err[:,2,:][:,self.px_scale[2]]
-            self.p4_err = self.raw_err[:,0,:][:,self.px_scale[0]]
+            fluxes = self.raw
         else:
             # raise KeyError('Please select the mode among: fit, model, windowed and raw.')
             raise KeyError('Please select the mode among: fit and raw.')
-            
-        self.p1 = self.p1[:,(self.wl_scale[15]>=wl_bounds[0])&(self.wl_scale[15]<=wl_bounds[1])]
-        self.p2 = self.p2[:,(self.wl_scale[13]>=wl_bounds[0])&(self.wl_scale[13]<=wl_bounds[1])]
-        self.p3 = self.p3[:,(self.wl_scale[2]>=wl_bounds[0])&(self.wl_scale[2]<=wl_bounds[1])]
-        self.p4 = self.p4[:,(self.wl_scale[0]>=wl_bounds[0])&(self.wl_scale[0]<=wl_bounds[1])]
         
-        self.Iminus1 = self.Iminus1[:,(self.wl_scale[11]>=wl_bounds[0])&(self.wl_scale[11]<=wl_bounds[1])]
-        self.Iminus2 = self.Iminus2[:,(self.wl_scale[3]>=wl_bounds[0])&(self.wl_scale[3]<=wl_bounds[1])]
-        self.Iminus3 = self.Iminus3[:,(self.wl_scale[1]>=wl_bounds[0])&(self.wl_scale[1]<=wl_bounds[1])]
-        self.Iminus4 = self.Iminus4[:,(self.wl_scale[6]>=wl_bounds[0])&(self.wl_scale[6]<=wl_bounds[1])]
-        self.Iminus5 = self.Iminus5[:,(self.wl_scale[5]>=wl_bounds[0])&(self.wl_scale[5]<=wl_bounds[1])]
-        self.Iminus6 = self.Iminus6[:,(self.wl_scale[8]>=wl_bounds[0])&(self.wl_scale[8]<=wl_bounds[1])]
-
-        self.Iplus1 = self.Iplus1[:,(self.wl_scale[9]>=wl_bounds[0])&(self.wl_scale[9]<=wl_bounds[1])]
-        self.Iplus2 = self.Iplus2[:,(self.wl_scale[12]>=wl_bounds[0])&(self.wl_scale[12]<=wl_bounds[1])]
-        self.Iplus3 = self.Iplus3[:,(self.wl_scale[14]>=wl_bounds[0])&(self.wl_scale[14]<=wl_bounds[1])]
-        self.Iplus4 = self.Iplus4[:,(self.wl_scale[4]>=wl_bounds[0])&(self.wl_scale[4]<=wl_bounds[1])]
-        self.Iplus5 = self.Iplus5[:,(self.wl_scale[7]>=wl_bounds[0])&(self.wl_scale[7]<=wl_bounds[1])]
-        self.Iplus6 = self.Iplus6[:,(self.wl_scale[10]>=wl_bounds[0])&(self.wl_scale[10]<=wl_bounds[1])]
-        
-        self.px_scale = np.array([self.px_scale[i][(self.wl_scale[i]>=wl_bounds[0])&(self.wl_scale[i]<=wl_bounds[1])] for i in range(self.px_scale.shape[0])])        
-        self.wl_scale = np.array([elt[(elt>=wl_bounds[0])&(elt<=wl_bounds[1])] for elt in self.wl_scale])
+        self._cropChannels(wl_bounds[0], wl_bounds[1])
+        self.intensities = self.getOutputs(fluxes)
+        if mode == 'fit':
+            errors = [self.bg_std] * len(output_roles['photometric'])
+        else:
+            errors = np.swapaxes(self.getOutputs(self.raw_err, output_roles['photometric']), 0, 1)
+        for name, err in zip(output_roles['photometric'], errors):
+            setattr(self, name+'_err', err)
 
         
     def spectralBinning(self, wl_min, wl_max, bandwidth, wl_to_px_coeff):
         """
         Method for keeping or binning a spectral band.
-        It changes the attributes ``pX``, ``IminusX``, ``IplusX`` (X=1..6), ``px_scale`` and ``wl_scale`` of the object.
+        It changes the attributes ``intensities`` (and its views ``pX``, ``IminusX``, ``IplusX``), ``px_scale`` and ``wl_scale`` of the object.
         
         :Parameters:
             **wl_min**: scalar
@@ -894,29 +2101,12 @@ class Null(File):
         if wl_max == None:
             wl_max = 10000
             
-        self.p1 = self.p1[:,(self.wl_scale[15]>=wl_min)&(self.wl_scale[15]<=wl_max)]
-        self.p2 = self.p2[:,(self.wl_scale[13]>=wl_min)&(self.wl_scale[13]<=wl_max)]
-        self.p3 = self.p3[:,(self.wl_scale[2]>=wl_min)&(self.wl_scale[2]<=wl_max)]
-        self.p4 = self.p4[:,(self.wl_scale[0]>=wl_min)&(self.wl_scale[0]<=wl_max)]
-        
-        self.Iminus1 = self.Iminus1[:,(self.wl_scale[11]>=wl_min)&(self.wl_scale[11]<=wl_max)]
-        self.Iplus1 = self.Iplus1[:,(self.wl_scale[9]>=wl_min)&(self.wl_scale[9]<=wl_max)]
-        self.Iminus2 = self.Iminus2[:,(self.wl_scale[3]>=wl_min)&(self.wl_scale[3]<=wl_max)]
-        self.Iplus2 = self.Iplus2[:,(self.wl_scale[12]>=wl_min)&(self.wl_scale[12]<=wl_max)]
-        self.Iminus3 = self.Iminus3[:,(self.wl_scale[1]>=wl_min)&(self.wl_scale[1]<=wl_max)]
-        self.Iplus3 = self.Iplus3[:,(self.wl_scale[14]>=wl_min)&(self.wl_scale[14]<=wl_max)]         
-        self.Iminus4 = self.Iminus4[:,(self.wl_scale[6]>=wl_min)&(self.wl_scale[6]<=wl_max)]
-        self.Iplus4 = self.Iplus4[:,(self.wl_scale[4]>=wl_min)&(self.wl_scale[4]<=wl_max)]         
-        self.Iminus5 = self.Iminus5[:,(self.wl_scale[5]>=wl_min)&(self.wl_scale[5]<=wl_max)]
-        self.Iplus5 = self.Iplus5[:,(self.wl_scale[7]>=wl_min)&(self.wl_scale[7]<=wl_max)]   
-        self.Iminus6 = self.Iminus6[:,(self.wl_scale[8]>=wl_min)&(self.wl_scale[8]<=wl_max)]
-        self.Iplus6 = self.Iplus6[:,(self.wl_scale[10]>=wl_min)&(self.wl_scale[10]<=wl_max)]
-        
         self.px_scale_nonbinned = self.px_scale.copy()
         self.wl_scale_nonbinned = self.wl_scale.copy()
         
-        self.px_scale = np.array([self.px_scale[i][(self.wl_scale[i]>=wl_min)&(self.wl_scale[i]<=wl_max)] for i in range(self.wl_scale.shape[0])])
-        self.wl_scale = np.array([elt[(elt>=wl_min)&(elt<=wl_max)] for elt in self.wl_scale])
+        tracks = [output_tracks[name] for name in output_names]
+        channels = self._cropChannels(wl_min, wl_max)
+        self.intensities = np.take_along_axis(self.intensities, channels[tracks][None], axis=2)
         
         if bandwidth is None or bandwidth > wl_max - wl_min:
             bandwith_px = [None]*wl_to_px_coeff.shape[0]
@@ -924,35 +2114,23 @@ class Null(File):
                 print('Bandwidth larger than selected spectrum, the whole spectrum will be binned.')
         else:
             bandwith_px = np.around(abs(bandwidth * wl_to_px_coeff[:,0]))
-            bandwith_px = bandwith_px.astype(np.int)
+            bandwith_px = bandwith_px.astype(int)
             bandwith_px[bandwith_px==0] = 1
             
         self.bandwith_px = bandwith_px
         
-        self.p1 = self.binning(self.p1, bandwith_px[15], axis=1, avg=True)
-        self.p2 = self.binning(self.p2, bandwith_px[13], axis=1, avg=True)
-        self.p3 = self.binning(self.p3, bandwith_px[2], axis=1, avg=True)
-        self.p4 = self.binning(self.p4, bandwith_px[0], axis=1, avg=True)
-        
-        self.Iminus1 = self.binning(self.Iminus1, bandwith_px[11], axis=1, avg=True)
-        self.Iminus2 = self.binning(self.Iminus2, bandwith_px[3], axis=1, avg=True)
-        self.Iminus3 = self.binning(self.Iminus3, bandwith_px[1], axis=1, avg=True)
-        self.Iminus4 = self.binning(self.Iminus4, bandwith_px[6], axis=1, avg=True)
-        self.Iminus5 = self.binning(self.Iminus5, bandwith_px[5], axis=1, avg=True)
-        self.Iminus6 = self.binning(self.Iminus6, bandwith_px[8], axis=1, avg=True)
-        
-        self.Iplus1 = self.binning(self.Iplus1, bandwith_px[9], axis=1, avg=True)
-        self.Iplus2 = self.binning(self.Iplus2, bandwith_px[12], axis=1, avg=True)
-        self.Iplus3 = self.binning(self.Iplus3, bandwith_px[14], axis=1, avg=True)
-        self.Iplus4 = self.binning(self.Iplus4, bandwith_px[4], axis=1, avg=True)
-        self.Iplus5 = self.binning(self.Iplus5, bandwith_px[7], axis=1, avg=True)
-        self.Iplus6 = self.binning(self.Iplus6, bandwith_px[10], axis=1, avg=True)
+        bins = [bandwith_px[track] for track in tracks]
+        if all(elt == bins[0] for elt in bins):
+            self.intensities = self.binning(self.intensities, bins[0], axis=2, avg=True)
+        else:
+            self.intensities = np.stack([self.binning(self.intensities[:,i], bins[i], axis=1, avg=True) for i in range(len(bins))], axis=1)
         
         self.wl_scale = np.array([self.binning(self.wl_scale[i], bandwith_px[i], axis=0, avg=True) for i in range(self.wl_scale.shape[0])])
         self.px_scale = np.array([self.binning(self.px_scale[i], bandwith_px[i], axis=0, avg=True) for i in range(self.wl_scale.shape[0])])
     
                 
-    def save(self, path, date):
+    def save(self, path, date, dtype=np.float64, compression=None, shuffle=False, chunk_frames=None,\
+             append=False, source=None, frames=None, fps=None):
         """
         Saves intermediate products for further analyses, into HDF5 file format.
         The different intensities and null are gathered into dictionaries.
@@ -964,8 +2142,44 @@ class Null(File):
             **date**: str
                 date of the acquisition of the data (YYYY-MM-DD).
                 
+            **dtype**: dtype (optional)
+                Type of the saved intensities and errors, e.g. ``np.float32`` to halve the volume of the products.
+                
+            **compression**: str (optional)
+                Lossless filter of HDF5 applied to the intensities and errors: 
+                ``None``, ``'lzf'`` (fast) or ``'gzip'`` (smaller files, slower).
+                
+            **shuffle**: bool (optional)
+                If ``True``, applies the shuffle filter before the compression, 
+                which improves the compression of floats.
+                
+            **chunk_frames**: int (optional)
+                Number of frames per HDF5 chunk. A chunk holds all the spectral channels 
+                of these frames so reading along the frame axis decompresses whole chunks only.
+                If ``None``, the data sets are contiguous, unless a filter is used: 
+                the chunks are then chosen by h5py.
+                
+            **append**: bool (optional)
+                If ``True``, the frames are appended to the store at ``path`` 
+                (e.g. one store per night), which is created if it does not exist.
+                Its data sets are extendable along the frame axis and the 
+                data set ``frame_index`` gives the origin of each frame.
+                
+            **source**: str or list (optional)
+                Path of the raw datacube the frames come from, or of the datacube of 
+                each frame (e.g. ``sources`` of ``streamFrames``), written in the frame index.
+                
+            **frames**: array-like (optional)
+                Numbers of the frames in their source, written in the frame index. 
+                If ``None``, frames are numbered from 0.
+                
+            **fps**: float (optional)
+                Frame rate of the acquisition. If given with ``source``, the 
+                timestamp of a frame is the date of modification of its source 
+                plus ``frames / fps``. Otherwise it is NaN.
+                
         :Returns:
-            HDF5 file containing the measured spectral intensities of each output, for each frames, 
+            HDF5 file containing the measured spectral intensities of each extracted output, for each frames, 
             and their uncertainties.
             
             Keywords identifies the nature of the stored data.
@@ -974,50 +2188,88 @@ class Null(File):
                 * date: date of the acquisition of the data;
                 * nbimg: number of frames;
                 * array shape: shape of the data into the data sets.
+                
+            A store also contains the data set ``frame_index`` with the fields 
+            ``source``, ``frame`` and ``timestamp``, one row per saved frame.
         """
         
         beams_couple = {'null1':'Beams 1/2', 'null2':'Beams 2/3', 'null3':'Beams 1/4',\
                         'null4':'Beams 3/4', 'null5':'Beams 3/1', 'null6':'Beams 4/2'}
         
 
-        dictio = {'p1':self.p1, 'p1err':self.p1_err,
-                  'p2':self.p2, 'p2err':self.p2_err,
-                  'p3':self.p3, 'p3err':self.p3_err,
-                  'p4':self.p4, 'p4err':self.p4_err,
-#                  'null1':self.null1, 'null1err':self.null1_err,
-#                  'null2':self.null2, 'null2err':self.null2_err,
-#                  'null3':self.null3, 'null3err':self.null3_err,
-#                  'null4':self.null4, 'null4err':self.null4_err,
-#                  'null5':self.null5, 'null5err':self.null5_err,
-#                  'null6':self.null6, 'null6err':self.null6_err,
-                  'Iminus1':self.Iminus1, 'Iplus1':self.Iplus1,
-                  'Iminus2':self.Iminus2, 'Iplus2':self.Iplus2,
-                  'Iminus3':self.Iminus3, 'Iplus3':self.Iplus3,
-                  'Iminus4':self.Iminus4, 'Iplus4':self.Iplus4,
-                  'Iminus5':self.Iminus5, 'Iplus5':self.Iplus5,
-                  'Iminus6':self.Iminus6, 'Iplus6':self.Iplus6}
+        # Only the extracted outputs are saved
+        dictio = {}
+        for i, name in enumerate(output_names):
+            if output_tracks[name] in self.which_tracks:
+                dictio[name] = self.intensities[:,i]
+                if name in output_roles['photometric']:
+                    dictio[name+'err'] = getattr(self, name+'_err')
             
         # Check if saved file exist
-        if os.path.exists(path):
+        if os.path.exists(path) and not append:
             opening_mode = 'w' # Overwright the whole existing file.
         else:
-            opening_mode = 'a' # Create a new file at "path"
+            opening_mode = 'a' # Create a new file at "path" or append to it
             
         with h5py.File(path, opening_mode) as f:
-            f.attrs['date'] = date
-            f.attrs['nbimg'] = self.nbimg
-            f.attrs['array shape'] = 'python ndim : (nb frame, wl channel)'
-            
-            f.create_dataset('wl_scale', data=self.wl_scale.mean(axis=0))
-            f['wl_scale'].attrs['comment'] = 'wl in nm'
+            if 'wl_scale' not in f:
+                f.attrs['date'] = date
+                f.attrs['nbimg'] = 0
+                f.attrs['array shape'] = 'python ndim : (nb frame, wl channel)'
+                
+                f.create_dataset('wl_scale', data=self.wl_scale.mean(axis=0))
+                f['wl_scale'].attrs['comment'] = 'wl in nm'
+            f.attrs['nbimg'] = f.attrs['nbimg'] + self.nbimg
             
             for key in dictio.keys():
-                f.create_dataset(key, data=dictio[key])
+                arr = np.asarray(dictio[key], dtype=dtype)
+                if append:
+                    _appendDataset(f, key, arr, chunk_frames, compression=compression, shuffle=shuffle)
+                else:
+                    if chunk_frames is None or arr.size == 0:
+                        chunks = None
+                    else:
+                        chunks = (max(min(chunk_frames, arr.shape[0]), 1),) + arr.shape[1:]
+                    f.create_dataset(key, data=arr, chunks=chunks, compression=compression, shuffle=shuffle)
                 try:
                     f[key].attrs['comment'] = beams_couple[key]
                 except KeyError:
                     pass
                 
+            if append:
+                nb_frames = self.intensities.shape[0]
+                frames = np.arange(nb_frames) if frames is None else np.asarray(frames)
+                index = np.zeros(nb_frames, dtype=frame_index_dtype)
+                index['frame'] = frames
+                index['timestamp'] = np.nan
+                if source is None:
+                    index['source'] = ''
+                else:
+                    sources = [source] * nb_frames if isinstance(source, str) else list(source)
+                    index['source'] = [os.path.basename(elt) for elt in sources]
+                    if fps is not None:
+                        mtimes = {elt:os.path.getmtime(elt) for elt in set(sources)}
+                        index['timestamp'] = np.array([mtimes[elt] for elt in sources]) + frames / fps
+                _appendDataset(f, 'frame_index', index, chunk_frames)
+                
+def _outputView(index):
+    """
+    Property of the output ``index`` of ``Null.intensities`` (e.g. ``Null.p1``), 
+    a view of ``intensities``. Assigning it writes in ``intensities``, 
+    so the assigned array must have the shape of the output.
+    """
+    def getter(self):
+        return self.intensities[:,index]
+    def setter(self, value):
+        if np.shape(value) != self.intensities[:,index].shape:
+            raise ValueError('The shape %s does not match the shape %s of the output %s in intensities'\
+                             %(np.shape(value), self.intensities[:,index].shape, output_names[index]))
+        self.intensities[:,index] = value
+    return property(getter, setter)
+
+for index, name in enumerate(output_names):
+    setattr(Null, name, _outputView(index))
+
 class ChipProperties(Null):
     """
     Class handling the determination of the properties of the chip.
@@ -1038,40 +2290,25 @@ class ChipProperties(Null):
                 entries set by the ``beam`` parameters.
         """
         beam = int(beam)
-        if beam == 1:
-            zeta_coeff['b1null1'] = self.Iminus1 / self.p1
-            zeta_coeff['b1null5'] = self.Iminus5 / self.p1
-            zeta_coeff['b1null3'] = self.Iminus3 / self.p1
-            zeta_coeff['b1null7'] = self.Iplus1 / self.p1
-            zeta_coeff['b1null11'] = self.Iplus5 / self.p1
-            zeta_coeff['b1null9'] = self.Iplus3 / self.p1
-            
-        elif beam == 2:
-            zeta_coeff['b2null1'] = self.Iminus1 / self.p2
-            zeta_coeff['b2null2'] = self.Iminus2 / self.p2
-            zeta_coeff['b2null6'] = self.Iminus6 / self.p2
-            zeta_coeff['b2null7'] = self.Iplus1 / self.p2
-            zeta_coeff['b2null8'] = self.Iplus2 / self.p2
-            zeta_coeff['b2null12'] = self.Iplus6 / self.p2
-            
-        elif beam == 3:
-            zeta_coeff['b3null5'] = self.Iminus5 / self.p3
-            zeta_coeff['b3null2'] = self.Iminus2 / self.p3
-            zeta_coeff['b3null4'] = self.Iminus4 / self.p3
-            zeta_coeff['b3null11'] = self.Iplus5 / self.p3
-            zeta_coeff['b3null8'] = self.Iplus2 / self.p3
-            zeta_coeff['b3null10'] = self.Iplus4 / self.p3
-            
-        elif beam == 4:
-            zeta_coeff['b4null3'] = self.Iminus3 / self.p4
-            zeta_coeff['b4null6'] = self.Iminus6 / self.p4
-            zeta_coeff['b4null4'] = self.Iminus4 / self.p4
-            zeta_coeff['b4null9'] = self.Iplus3 / self.p4
-            zeta_coeff['b4null12'] = self.Iplus6 / self.p4
-            zeta_coeff['b4null10'] = self.Iplus4 / self.p4
-            
-        else:
+        if not beam in [1, 2, 3, 4]:
             raise AssertionError('No beam selected (beam = 1..4)')  
+        
+        photometry = getattr(self, 'p%s'%(beam))
+        for k, baseline in enumerate(baseline_outputs):
+            null, antinull, beam1, beam2 = baseline_outputs[baseline]
+            if 'p%s'%(beam) in [beam1, beam2]:
+                zeta_coeff['b%snull%s'%(beam, k+1)] = getattr(self, null) / photometry
+                zeta_coeff['b%snull%s'%(beam, k+7)] = getattr(self, antinull) / photometry
             
         return zeta_coeff
-    
\ No newline at end of file
+    
+
+if __name__ == '__main__':
+    ''' Settings '''
+    dtypes = [np.float32, np.float64]
+    data_dtypes = [np.float32, np.float64]
+    engines = ['numba', 'parallel']
+    
+    start = time()
+    compileKernels(dtypes, data_dtypes, engines)
+    print('Kernels compiled in %.1f s'%(time() - start))
@@ -23,7 +23,14 @@ First step: simply change the value of the variables in the **Settings** section
     * **save**: boolean, ``True`` for saving products and monitoring data, ``False`` otherwise
     * **monitor**: boolean, ``True`` for creating histogram of the background noise and plotting them
     * **nbfiles**: 2-tuple of int, set the bounds between which the dark files are selected. ``None`` is equivalent to 0 if it is the lower bound or -1 included or it is the upper one.
+    * **nb_frames_per_batch**: int, number of frames loaded at once to compute the average dark. Batches are built across the files so the memory used does not depend on the size of the files.
     * **edge_min**, **edge_max**: minimal left-edge and maximal right-edge of the histograms.
+    * **nb_reader_threads**: int, number of threads loading the next datacubes in the background while the current one is processed
+    * **prefetch_size**: int, maximum number of datacubes loaded in advance
+    * **cache_dir**: str, local folder where the files of the network share are copied once and read afterwards. If ``None``, the files are read from the share (unless the environment variable ``GLINT_CACHE_DIR`` is set)
+    * **cache_size**: float, maximum size of the local cache in bytes, the least recently used files are deleted first
+    * **catalog_path**: str, path to the local catalog of files (see :doc:`glint_catalog`) in which the data files are selected. If ``None``, the default catalog is used
+    * **catalog_max_age**: float, the data folder is scanned again only if its last scan is older than this value in seconds or if files were added to or removed from it since. Set to 0 to always look for new files, ``None`` to never scan again a folder already in the catalog
 
     
 Second step: change the value of the variables in the **Inputs** and **Outputs** sections:
@@ -38,6 +45,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 import glint_classes
+import glint_cache
+import glint_catalog
 import h5py
 from timeit import default_timer as timer
 from scipy.optimize import curve_fit
@@ -125,13 +134,22 @@ if __name__ == '__main__':
     save = True
     monitor = False # Set True to map the average, variance of relative difference of set of dark current datacubes
     nb_files = (None, None)
+    nb_frames_per_batch = 1000
     edge_min, edge_max = -500, 500
+    nb_reader_threads = 1
+    prefetch_size = 2
+    cache_dir = None
+    cache_size = 100e9
+    catalog_path = None
+    catalog_max_age = 3600
+    if cache_dir is not None:
+        glint_cache.setCache(cache_dir, cache_size)
     
     ''' Inputs '''
     datafolder = 'data202009/20200929/atm/'
     data_path = '//tintagel.physics.usyd.edu.au/snert/'+'/GLINTData/'+datafolder
 #    data_path = '/mnt/96980F95980F72D3/glint_data/'+datafolder
-    dark_list = [data_path+f for f in os.listdir(data_path) if 'dark' in f][nb_files[0]:nb_files[1]]
+    dark_list = glint_catalog.listFiles(data_path, 'dark', db_path=catalog_path, max_age=catalog_max_age)[nb_files[0]:nb_files[1]]
 
     ''' Output '''
     output_path = '//tintagel.physics.usyd.edu.au/snert/GLINTprocessed/'+datafolder
@@ -156,9 +174,10 @@ if __name__ == '__main__':
     superNbImg = 0.
     
     
-    for f in dark_list[:]:
+    for frames, sources, first_frames in glint_classes.streamFrames(dark_list, nb_frames_per_batch):
+        f = sources[0]
         print("Process of : %s (%d / %d)" %(f, dark_list.index(f)+1, len(dark_list)))
-        dark = glint_classes.Null(f)
+        dark = glint_classes.Null(frames)
        
         superDark = superDark + dark.data.sum(axis=0)
         superNbImg = superNbImg + dark.nbimg
@@ -193,9 +212,8 @@ if __name__ == '__main__':
         hist_slices = []
         list_hist = []
         
-        for f in dark_list:
+        for f, dark in glint_classes.Prefetcher(dark_list, nb_threads=nb_reader_threads, queue_size=prefetch_size):
             print("Histogram of : %s (%d / %d)" %(f, dark_list.index(f)+1, len(dark_list)))
-            dark = glint_classes.Null(f)
             spatial_axis = np.arange(dark.data.shape[0])
             hist = np.histogram(np.ravel(dark.data - dark.data.mean(axis=(1,2))[:,None,None]), bins=bin_hist)
             list_hist.append(hist[0])
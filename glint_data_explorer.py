@@ -11,6 +11,8 @@ import h5py
 import matplotlib.pyplot as plt
 from matplotlib import animation
 import os
+import glint_catalog
+import glint_transcode
 from skimage.measure import moments
 from scipy.optimize import curve_fit
 from timeit import default_timer as time
@@ -67,10 +69,12 @@ output_path = root+'GLINTprocessed/'+datafolder # Path to reduced data
 dark_path = output_path+'superdark.npy'
 wl_min, wl_max = 1400,1650
 fps = 1400
+catalog_path = None # Path to the catalog of files (see glint_catalog), None for the default catalog
+catalog_max_age = 3600 # The folders are scanned again if their last scan is older (in s) or if files were added or removed since, 0 to always scan them, None to never scan them again
 
 ''' Running script '''
 data_path = path_to_data+datafolder # Full path to the data
-data_list = sorted([data_path+f for f in os.listdir(data_path) if 'dark1' in f])
+data_list = glint_catalog.listFiles(data_path, 'dark1', db_path=catalog_path, max_age=catalog_max_age)
 data_list = data_list[nb_files[0]:nb_files[1]:nb_files[2]]
 
 if not nonoise_switch:
@@ -83,10 +87,11 @@ if not nonoise_switch:
     
     if switch_dark:
         dark_path = path_to_data + darkfolder
-        dark_list = [dark_path+f for f in os.listdir(dark_path)][:100]
+        dark_list = glint_catalog.listFiles(dark_path, db_path=catalog_path, max_age=catalog_max_age)[:100]
         with h5py.File(dark_list[0], 'r') as dataFile:
             dark = np.array(dataFile['imagedata'])
-            dark = np.transpose(dark, axes=(0,2,1))
+            if not glint_transcode.isTransposed(dataFile['imagedata']):
+                dark = np.transpose(dark, axes=(0,2,1))
             dark = dark.mean(axis=0)    
 else:
     print('No-noise data')
@@ -102,7 +107,8 @@ for f in data_list:
             print(e)
             print(f)
             continue
-        data = np.transpose(data, axes=(0,2,1))
+        if not glint_transcode.isTransposed(dataFile['imagedata']):
+            data = np.transpose(data, axes=(0,2,1))
         data = data - dark
         
         try:
@@ -10,6 +10,7 @@ NOTE: the configuration is encapsulated into a function to make Sphinx happy.
 """
 import numpy as np
 import os
+import glint_catalog
 
 def prepareConfig():
     # # =============================================================================
@@ -537,8 +538,10 @@ def prepareConfig():
     root = "//tintagel.physics.usyd.edu.au/snert/"
     file_path = root+'GLINTprocessed/'+datafolder
     save_path = file_path+'output/'
-    data_list = [file_path+f for f in os.listdir(file_path) if '.hdf5' in f and 'n1n4' in f]
-    dark_list = [root+'GLINTprocessed/'+darkfolder+f for f in os.listdir(root+'GLINTprocessed/'+darkfolder) if '.hdf5' in f and 'dark' in f]
+    catalog_path = None # Path to the catalog of files (see glint_catalog), None for the default catalog
+    catalog_max_age = 3600 # The folders are scanned again if their last scan is older (in s) or if files were added or removed since, 0 to always scan them
+    data_list = glint_catalog.listFiles(file_path, ['.hdf5', 'n1n4'], db_path=catalog_path, max_age=catalog_max_age)
+    dark_list = glint_catalog.listFiles(root+'GLINTprocessed/'+darkfolder, ['.hdf5', 'dark'], db_path=catalog_path, max_age=catalog_max_age)
     calib_params_path = file_path#root+'GLINTprocessed/calibration_params/'
     zeta_coeff_path = calib_params_path + '20201209_zeta_coeff_raw.hdf5'
     
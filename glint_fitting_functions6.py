@@ -2,23 +2,67 @@
 # -*- coding: utf-8 -*-
 """
 Library of the ``glint_fitting_gpu6.py``.
+
+Cupy, matplotlib and scipy are imported on their first use, not with the library,
+and the CUDA kernels are built on their first call.
+The library is then imported quickly and on the nodes without GPU,
+e.g. by the workers loading the data with ``load_data_multi``.
 """
 
 import numpy as np
-import cupy as cp
-import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit, leastsq, least_squares
 from timeit import default_timer as time
 import h5py
 import os
-from cupyx.scipy.special.statistics import ndtr
-import scipy.special as sp
-from scipy.stats import norm
-from scipy.linalg import svd
+import glint_cache
+import hashlib
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+import tempfile
+from contextlib import ExitStack
 import warnings
-from scipy.optimize import OptimizeWarning, minimize
 
-interpolate_kernel = cp.ElementwiseKernel(
+class _LazyModule(object):
+    """
+    Module imported on the first access to one of its attributes.
+    
+    :Parameters:
+        **name**: str
+            Name of the module.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+cp = _LazyModule('cupy')
+
+class _LazyKernel(object):
+    """
+    Cupy ``ElementwiseKernel`` built on its first call.
+    The arguments are the ones of ``cp.ElementwiseKernel``.
+    """
+    def __init__(self, *args, **kwargs):
+        self._args = args
+        self._kwargs = kwargs
+        self._kernel = None
+        
+    def __call__(self, *args, **kwargs):
+        if self._kernel is None:
+            self._kernel = cp.ElementwiseKernel(*self._args, **self._kwargs)
+        return self._kernel(*args, **kwargs)
+
+def ndtr(x):
+    """
+    Cumulative distribution function of the normal distribution on GPU (``cupyx.scipy.special.ndtr``).
+    """
+    from cupyx.scipy.special.statistics import ndtr
+    return ndtr(x)
+
+interpolate_kernel = _LazyKernel(
     'float32 x_new, raw float32 xp, int32 xp_size, raw float32 yp', 
     'raw float32 y_new',
     
@@ -54,7 +98,7 @@ interpolate_kernel = cp.ElementwiseKernel(
     '''
     )
 
-computeCdfCuda = cp.ElementwiseKernel(
+computeCdfCuda = _LazyKernel(
     'float32 x_axis, raw float32 rv, float32 rv_sz',
     'raw float32 cdf',
     '''
@@ -251,9 +295,138 @@ def computeCdfCupy(rv, x_axis):
     
     return cdf
     
+def getFrameSelection(data_file, frame_range=None, time_window=None):
+    """
+    Gives the frames to read in an intermediate product.
+    
+    :Parameters:
+        
+        **data_file**: h5py file
+            Opened intermediate product or per-night store.
+        
+        **frame_range**: 2-tuple (optional)
+            First and last+1 rows of the store to read.
+        
+        **time_window**: 2-tuple (optional)
+            Lower and upper (excluded) bounds of the timestamps of the frames to read,
+            given by the data set ``frame_index`` of the store.
+
+    :Returns:
+        
+        **frames**: slice or array
+            Selection along the frame axis, a slice if the frames are contiguous.
+    """
+    frames = slice(None)
+    if frame_range is not None:
+        frames = slice(*frame_range)
+    if time_window is not None:
+        timestamps = data_file['frame_index'].fields('timestamp')[frames]
+        offset = range(data_file['frame_index'].shape[0])[frames].start
+        idx = np.where((timestamps >= time_window[0]) & (timestamps < time_window[1]))[0] + offset
+        if idx.size == 0 or idx[-1] - idx[0] + 1 == idx.size:
+            frames = slice(idx[0], idx[-1]+1) if idx.size > 0 else slice(0, 0)
+        else:
+            frames = idx
+    return frames
+    
+def _readColumns(dset, frames, cols):
+    """
+    Reads the frames ``frames`` and the spectral channels ``cols`` of a data set 
+    of an intermediate product. 1d data sets (e.g. errors per frame) have no spectral axis.
+    """
+    if dset.ndim == 1:
+        return dset[frames]
+    return dset[frames, cols]
+
+def _countFrames(path, beam, frame_range, time_window):
+    """
+    Gives the selection of frames of a file read by ``load_data_multi`` and their number.
+    """
+    with h5py.File(path, 'r') as data_file:
+        frames = getFrameSelection(data_file, frame_range, time_window)
+        nb_frames = len(np.arange(data_file['p%s'%(beam)].shape[0])[frames])
+    return frames, nb_frames
+
+def _fillArrays(arrays, path, frames, start, stop, null_idx, beams, cols, mask_read, nulls_to_invert):
+    """
+    Reads the frames of a file for ``load_data_multi`` and writes them in the frames ``start`` to ``stop`` of ``arrays``:
+    ``null``, ``Iminus`` and ``Iplus`` of each baseline (e.g. ``null_null1``) with the structure (wavelength, frame),
+    ``photo`` with the structure (beam, wavelength, frame) and ``photo_err`` with the structure (beam, frame, wavelength) or (beam, frame).
+    """
+    with h5py.File(path, 'r') as data_file:
+        for key, idx_null in null_idx.items():
+            Iminus = _readColumns(data_file['Iminus%s'%(idx_null)], frames, cols)[:,mask_read]
+            Iplus = _readColumns(data_file['Iplus%s'%(idx_null)], frames, cols)[:,mask_read]
+            if key in nulls_to_invert:
+                null = Iplus / Iminus
+            else:
+                null = Iminus / Iplus
+            arrays['null_'+key][:,start:stop] = null.T
+            arrays['Iminus_'+key][:,start:stop] = Iminus.T
+            arrays['Iplus_'+key][:,start:stop] = Iplus.T
+            
+        for k, beam in enumerate(beams):
+            arrays['photo'][k,:,start:stop] = _readColumns(data_file['p%s'%(beam)], frames, cols)[:,mask_read].T
+            photo_err = _readColumns(data_file['p%serr'%(beam)], frames, cols)
+            arrays['photo_err'][k,start:stop] = photo_err[:,mask_read] if photo_err.ndim == 2 else photo_err
+
+def _fillSharedArrays(shared_path, layout, *args):
+    """
+    Maps the arrays of ``layout`` (name:(offset, shape, dtype)) in the file ``shared_path``
+    and fills them with ``_fillArrays``, in a worker process.
+    """
+    arrays = {name:np.memmap(shared_path, dtype=dtype, mode='r+', offset=offset, shape=shape) for name, (offset, shape, dtype) in layout.items()}
+    _fillArrays(arrays, *args)
+    for arr in arrays.values():
+        arr.flush()
+
+def _readShared(shapes, read_args, nb_workers):
+    """
+    Reads the files of ``load_data_multi`` in ``nb_workers`` processes which write 
+    the frames in place in arrays memory-mapped on a temporary file.
+    
+    :Parameters:
+        
+        **shapes**: dictionary
+            Shape and type of each array.
+        
+        **read_args**: list
+            Arguments of ``_fillArrays`` after ``arrays``, one element per file.
+            
+        **nb_workers**: int
+            Number of processes.
+    
+    :Returns:
+        
+        Dictionary of the arrays, memory-mapped.
+    """
+    layout = {}
+    size = 0
+    for name, (shape, arr_dtype) in shapes.items():
+        layout[name] = (size, shape, np.dtype(arr_dtype))
+        size += -(-int(np.prod(shape)) * np.dtype(arr_dtype).itemsize // 64) * 64 # Aligned arrays
+    
+    fd, shared_path = tempfile.mkstemp(prefix='glint_load_', suffix='.dat')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.truncate(max(size, 1))
+        with ProcessPoolExecutor(max_workers=nb_workers) as executor:
+            futures = [executor.submit(_fillSharedArrays, shared_path, layout, *elt) for elt in read_args]
+            for future in futures:
+                future.result() # Errors of the processes are raised here
+        arrays = {name:np.memmap(shared_path, dtype=arr_dtype, mode='r+', offset=offset, shape=shape).view(np.ndarray) \
+                  for name, (offset, shape, arr_dtype) in layout.items()}
+    finally:
+        try:
+            os.remove(shared_path) # The arrays stay mapped
+        except OSError: # Still mapped on Windows
+            pass
+    return arrays
+
 def load_data(data, wl_edges, null_key, nulls_to_invert, *args, **kwargs):
     """
     Load data from data file to create the histograms of the null depths and do Monte-Carlo.
+    To load several baselines, use ``load_data_multi`` which reads the files only once.
     
     :Parameters:
         
@@ -273,66 +446,96 @@ def load_data(data, wl_edges, null_key, nulls_to_invert, *args, **kwargs):
             Use dark data to get the error on the null depth.
         
         **kwargs**: extra keyword arguments
-            Performs temporal binning of frames.
+            Performs temporal binning of frames (``frame_binning``).
+            When the files are per-night stores (see ``Null.save`` of glint_classes), 
+            ``frame_range`` (2-tuple of int) selects a range of rows of the stores and
+            ``time_window`` (2-tuple of float) selects the frames with a timestamp 
+            between the bounds (upper one excluded).
+            ``nb_workers`` (int, default 1) is the number of processes reading the files, 
+            each one reading whole files and writing their frames in place in the loaded arrays, 
+            which are then memory-mapped on a temporary file (deleted once the files are read, 
+            except on Windows). The HDF5 library runs the reads of the threads of a process one at a time, 
+            so the files are not read by threads.
+            With 1, the files are read in the calling process into arrays in memory:
+            more processes can only pay off with several cores and a file system faster than one reader.
+            ``cache_dir`` (str) is a folder where the loaded and binned data are kept: 
+            a new call with the same files (unmodified), bandwidth, baseline, 
+            nulls to invert, flags, binning and type reads them from it instead of the files.
+            The content of the folder can be deleted at any time.
+            ``dtype`` is the type of the loaded arrays, e.g. ``np.float32`` for the Monte-Carlo 
+            fit which works in float32. By default, the type of the data in the files.
 
     :Returns:
         
         **out**: dictionary
             Includes data to use for the fit: flux in (anti-)null and phtometric outputs, errors, wavelengths.
 
+    """
+    if len(args) > 0:
+        args = ({null_key:args[0]},) + args[1:]
+    return load_data_multi(data, wl_edges, [null_key], nulls_to_invert, *args, **kwargs)[null_key]
+
+def load_data_multi(data, wl_edges, null_keys, nulls_to_invert, *args, **kwargs):
+    """
+    Load the data of several baselines from data file in one pass over the files.
+    The photometries are read and stored once for all the baselines: 
+    the arrays ``photo`` and ``photo_err`` of the baselines are views of the same arrays
+    so they must not be modified in place.
+    The arrays of all the baselines are in memory at once, i.e. about
+    ``(3 x number of baselines + number of photometries) x nb_frames x nb_wl`` values:
+    call it once per baseline if they do not fit in memory.
+    
+    :Parameters:
+        
+        **data**: array
+            List of data files.
+        
+        **wl_edges**: 2-tuple
+            Lower and upper bounds of the spectrum to load.
+        
+        **null_keys**: list
+            Baselines to load.
+        
+        **nulls_to_invert**: list
+            List of nulls to invert because their null and antinull outputs are swapped.
+        
+        **args**: extra arguments
+            Use dark data to get the error on the null depth, 
+            as a dictionary of the dark data of each baseline.
+        
+        **kwargs**: extra keyword arguments
+            Same as ``load_data``.
+
+    :Returns:
+        
+        **outs**: dictionary
+            Output of ``load_data`` for each baseline of ``null_keys``.
+
     """
     # Null table for getting the null and associated photometries in the intermediate data
     # Structure = Chosen null:[number of null, photometry A and photometry B]
     null_table = {'null1':[1,1,2], 'null2':[2,2,3], 'null3':[3,1,4], \
                   'null4':[4,3,4], 'null5':[5,3,1], 'null6':[6,4,2]}
     
-    indexes = null_table[null_key]
-
-    null_data = []
-    Iminus_data = []
-    Iplus_data = []
-    photo_data = [[],[]]
-    photo_err_data = [[],[]]
-    wl_scale = []
+    frame_range = kwargs.get('frame_range')
+    time_window = kwargs.get('time_window')
+    nb_workers = kwargs.get('nb_workers', 1)
+    beams = sorted(set([beam for key in null_keys for beam in null_table[key][1:]])) # Photometries to load, once
     
-    for d in data:
-        with h5py.File(d, 'r') as data_file:
-            wl_scale.append(np.array(data_file['wl_scale']))
-            
-#            null_data.append(np.array(data_file['null%s'%(indexes[0])]))
-            Iminus_data.append(np.array(data_file['Iminus%s'%(indexes[0])]))
-            Iplus_data.append(np.array(data_file['Iplus%s'%(indexes[0])]))
-                
-            photo_data[0].append(np.array(data_file['p%s'%(indexes[1])])) # Fill with beam A intensity
-            photo_data[1].append(np.array(data_file['p%s'%(indexes[2])])) # Fill with beam B intensity
-            photo_err_data[0].append(np.array(data_file['p%serr'%(indexes[1])])) # Fill with beam A error
-            photo_err_data[1].append(np.array(data_file['p%serr'%(indexes[2])])) # Fill with beam B error
-            
-            if 'null%s'%(indexes[0]) in nulls_to_invert:
-                n = np.array(data_file['Iplus%s'%(indexes[0])]) / np.array(data_file['Iminus%s'%(indexes[0])])
-            else:
-                n = np.array(data_file['Iminus%s'%(indexes[0])]) / np.array(data_file['Iplus%s'%(indexes[0])])
-            null_data.append(n)
-
-
-    # Merge data along frame axis
-    null_data = [selt for elt in null_data for selt in elt]
-    Iminus_data = [selt for elt in Iminus_data for selt in elt]
-    Iplus_data = [selt for elt in Iplus_data for selt in elt]
+    if kwargs.get('cache_dir') is not None:
+        cache_paths = _getLoadCachePaths(data, wl_edges, null_keys, beams, nulls_to_invert, kwargs)
+        if all([os.path.exists(path) for path in cache_paths.values()]):
+            return _assembleOutputs(null_keys, beams, *_readLoadCache(cache_paths, null_keys, beams), *args)
+    
+    with glint_cache.pinnedPath(data[0]) as local, h5py.File(local, 'r') as data_file:
+        wl_scale = np.array(data_file['wl_scale']) #All the wl scale are supposed to be the same, just pick up the first of the list
+        dtype = data_file['Iminus%s'%(null_table[null_keys[0]][0])].dtype
+        err_dtype = data_file['p%serr'%(beams[0])].dtype
+        if kwargs.get('dtype') is not None:
+            dtype = err_dtype = np.dtype(kwargs['dtype'])
+        err_ndim = data_file['p%serr'%(beams[0])].ndim
         
-    for i in range(2):
-        photo_data[i] = [selt for elt in photo_data[i] for selt in elt]
-        photo_err_data[i] = [selt for elt in photo_err_data[i] for selt in elt]
-
-
-    null_data = np.array(null_data)
-    Iminus_data = np.array(Iminus_data)
-    Iplus_data = np.array(Iplus_data)
-    photo_data = np.array(photo_data)
-    photo_err_data = np.array(photo_err_data)
-    wl_scale = wl_scale[0] #All the wl scale are supposed to be the same, just pick up the first of the list
     mask = np.arange(wl_scale.size)
-    
     wl_min, wl_max = wl_edges
     mask = mask[(wl_scale>=wl_min)&(wl_scale <= wl_max)]
     
@@ -340,36 +543,141 @@ def load_data(data, wl_edges, null_key, nulls_to_invert, *args, **kwargs):
         flags = kwargs['flag']
         mask = mask[flags]
         
-    null_data = null_data[:,mask]
-    Iminus_data = Iminus_data[:,mask]
-    Iplus_data = Iplus_data[:,mask]
-    photo_data = photo_data[:,:,mask]
-    wl_scale = wl_scale[mask]
+    # Only the range of spectral channels in the bandwidth is read
+    cols = slice(mask.min(), mask.max()+1) if mask.size > 0 else slice(0, 0)
+    mask_read = mask - cols.start # Indexes of the spectral channels among the columns read
+    
+    # The copies of the cache are made in this process, which keeps the index of the cache,
+    # and are not evicted until all the files are read
+    pins = ExitStack()
+    paths = [pins.enter_context(glint_cache.pinnedPath(d)) for d in data]
+    null_idx = {key:null_table[key][0] for key in null_keys}
+    
+    # The frames of each file are located in the final arrays, in which the files are read
+    try:
+        selections = [_countFrames(path, beams[0], frame_range, time_window) for path in paths]
+        offsets = np.cumsum([0] + [elt[1] for elt in selections])
+        shapes = {}
+        for key in null_keys:
+            for name in ['null', 'Iminus', 'Iplus']:
+                shapes['%s_%s'%(name, key)] = ((mask.size, offsets[-1]), dtype)
+        shapes['photo'] = ((len(beams), mask.size, offsets[-1]), dtype)
+        shapes['photo_err'] = ((len(beams), offsets[-1], mask.size) if err_ndim == 2 else (len(beams), offsets[-1]), err_dtype)
+        read_args = [(path, selection[0], offsets[k], offsets[k+1], null_idx, beams, cols, mask_read, nulls_to_invert) \
+                     for k, (path, selection) in enumerate(zip(paths, selections))]
+        
+        if nb_workers > 1 and offsets[-1] > 0 and mask.size > 0:
+            arrays = _readShared(shapes, read_args, nb_workers)
+        else:
+            arrays = {name:np.empty(shape, dtype=arr_dtype) for name, (shape, arr_dtype) in shapes.items()}
+            for elt in read_args:
+                _fillArrays(arrays, *elt)
+    finally:
+        pins.close()
     
-    null_data = np.transpose(null_data)
-    photo_data = np.transpose(photo_data, axes=(0,2,1))
-    Iminus_data = np.transpose(Iminus_data)
-    Iplus_data = np.transpose(Iplus_data)
+    null_data = {key:arrays['null_'+key] for key in null_keys}
+    Iminus_data = {key:arrays['Iminus_'+key] for key in null_keys}
+    Iplus_data = {key:arrays['Iplus_'+key] for key in null_keys}
+    photo_data, photo_err_data = arrays['photo'], arrays['photo_err']
+        
+    wl_scale = wl_scale[mask]
     
     if 'frame_binning' in kwargs:
         if not kwargs['frame_binning'] is None:
             if kwargs['frame_binning'] > 1:
                 nb_frames_to_bin = int(kwargs['frame_binning'])
-                null_data, dummy = binning(null_data, nb_frames_to_bin, axis=1, avg=True)
                 photo_data, dummy = binning(photo_data, nb_frames_to_bin, axis=2, avg=True)
-                Iminus_data, dummy = binning(Iminus_data, nb_frames_to_bin, axis=1, avg=True)
-                Iplus_data, dummy = binning(Iplus_data, nb_frames_to_bin, axis=1, avg=True)
+                for key in null_keys:
+                    null_data[key], dummy = binning(null_data[key], nb_frames_to_bin, axis=1, avg=True)
+                    Iminus_data[key], dummy = binning(Iminus_data[key], nb_frames_to_bin, axis=1, avg=True)
+                    Iplus_data[key], dummy = binning(Iplus_data[key], nb_frames_to_bin, axis=1, avg=True)
     
-    out = {'null':null_data, 'photo':photo_data, 'wl_scale':wl_scale,\
-            'photo_err':photo_err_data, 'wl_idx':mask, 'Iminus':Iminus_data, 'Iplus':Iplus_data}
+    if kwargs.get('cache_dir') is not None:
+        _writeLoadCache(cache_paths, null_keys, beams, null_data, Iminus_data, Iplus_data, photo_data, photo_err_data, wl_scale, mask)
     
-    if len(args) > 0:
-        null_err_data = getErrorNull(out, args[0])
-    else:
-        null_err_data = np.zeros(null_data.shape)
-    out['null_err'] = null_err_data
+    return _assembleOutputs(null_keys, beams, null_data, Iminus_data, Iplus_data, photo_data, photo_err_data, wl_scale, mask, *args)
+
+def _assembleOutputs(null_keys, beams, null_data, Iminus_data, Iplus_data, photo_data, photo_err_data, wl_scale, mask, *args):
+    """
+    Gathers the loaded arrays into the dictionaries of each baseline returned by ``load_data_multi``.
+    """
+    null_table = {'null1':[1,1,2], 'null2':[2,2,3], 'null3':[3,1,4], \
+                  'null4':[4,3,4], 'null5':[5,3,1], 'null6':[6,4,2]}
+    outs = {}
+    for key in null_keys:
+        # View on the photometries A and B of the baseline
+        idx_A, idx_B = beams.index(null_table[key][1]), beams.index(null_table[key][2])
+        step = idx_B - idx_A
+        photo_slice = slice(idx_A, idx_B+step if idx_B+step >= 0 else None, step)
+        
+        out = {'null':null_data[key], 'photo':photo_data[photo_slice], 'wl_scale':wl_scale,\
+                'photo_err':photo_err_data[photo_slice], 'wl_idx':mask, 'Iminus':Iminus_data[key], 'Iplus':Iplus_data[key]}
+        
+        if len(args) > 0:
+            null_err_data = getErrorNull(out, args[0][key])
+        else:
+            null_err_data = np.zeros(null_data[key].shape, dtype=null_data[key].dtype)
+        out['null_err'] = null_err_data
+        outs[key] = out
+    
+    return outs
+
+def _getLoadCachePaths(data, wl_edges, null_keys, beams, nulls_to_invert, kwargs):
+    """
+    Gives the paths of the cached outputs of ``load_data_multi``: one file per baseline
+    and one file per photometry, so that the photometries are shared between baselines.
+    The names are hashes of the files (with their size and date of modification) and of the settings of the loading.
+    """
+    files = []
+    for d in data:
+        stat = os.stat(d)
+        files.append((os.path.abspath(d), stat.st_size, stat.st_mtime_ns))
+    flag = kwargs.get('flag')
+    dtype = kwargs.get('dtype')
+    settings = (files, tuple(wl_edges), None if flag is None else np.asarray(flag).tolist(), kwargs.get('frame_binning'),\
+                kwargs.get('frame_range'), kwargs.get('time_window'), None if dtype is None else np.dtype(dtype).str)
+    
+    def _path(*items):
+        return os.path.join(kwargs['cache_dir'], hashlib.sha1(repr(settings+items).encode()).hexdigest()+'.npz')
+    
+    paths = {key:_path(key, key in nulls_to_invert) for key in null_keys}
+    paths.update({beam:_path('p%s'%(beam)) for beam in beams})
+    return paths
+
+def _writeLoadCache(cache_paths, null_keys, beams, null_data, Iminus_data, Iplus_data, photo_data, photo_err_data, wl_scale, mask):
+    """
+    Writes the outputs of ``load_data_multi`` in its cache.
+    Files are written under a temporary name so that a partial file is never read.
+    """
+    folder = os.path.dirname(cache_paths[null_keys[0]])
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+        
+    to_save = [(cache_paths[key], {'null':null_data[key], 'Iminus':Iminus_data[key], 'Iplus':Iplus_data[key]}) for key in null_keys]
+    to_save += [(cache_paths[beam], {'photo':photo_data[i], 'photo_err':photo_err_data[i], 'wl_scale':wl_scale, 'wl_idx':mask})\
+                for i, beam in enumerate(beams)]
+    for path, arrays in to_save:
+        with open(path+'.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(path+'.tmp', path)
+
+def _readLoadCache(cache_paths, null_keys, beams):
+    """
+    Reads the outputs of ``load_data_multi`` from its cache.
+    """
+    null_data, Iminus_data, Iplus_data = {}, {}, {}
+    for key in null_keys:
+        with np.load(cache_paths[key]) as cached:
+            null_data[key], Iminus_data[key], Iplus_data[key] = cached['null'], cached['Iminus'], cached['Iplus']
+    
+    photo_data, photo_err_data = [], []
+    for beam in beams:
+        with np.load(cache_paths[beam]) as cached:
+            photo_data.append(cached['photo'])
+            photo_err_data.append(cached['photo_err'])
+            wl_scale, mask = cached['wl_scale'], cached['wl_idx']
     
-    return out
+    return null_data, Iminus_data, Iplus_data, np.array(photo_data), np.array(photo_err_data), wl_scale, mask
 
 def getErrorNull(data_dic, dark_dic):
     """
@@ -1083,7 +1391,7 @@ def get_zeta_coeff(path, wl_scale, plot=False, **kwargs):
     :Parameters:
         
         **path**: string
-            Path to the zeta coefficients' file.
+            Path to the zeta coefficients' file or to a calibration bundle (see :doc:`glint_calibration`).
 
         **wl_scale**: array
             List of wavelength for which we want the zeta coefficients
@@ -1100,7 +1408,8 @@ def get_zeta_coeff(path, wl_scale, plot=False, **kwargs):
             Dictionary of the interpolated zeta coefficients.
     """
     coeff_new = {}
-    with h5py.File(path, 'r') as coeff:
+    with glint_cache.pinnedPath(path) as local, h5py.File(local, 'r') as f:
+        coeff = f['zeta'] if 'zeta' in f else f # Zeta coefficients in a calibration bundle
         wl = np.array(coeff['wl_scale'])[::-1]
         if 'wl_bounds' in kwargs: # Average zeta coeff in the bandwidth
             wl_bounds = kwargs['wl_bounds']
@@ -1122,6 +1431,7 @@ def get_zeta_coeff(path, wl_scale, plot=False, **kwargs):
                 else:
                     coeff_new[key] = wl_scale
         if plot:
+            import matplotlib.pyplot as plt
             plt.figure()
             plt.plot(np.array(coeff['wl_scale']), np.array(coeff['b1null1']), 'o-')
             plt.plot(coeff_new['wl_scale'], coeff_new['b1null1'], '+-')
@@ -1272,6 +1582,7 @@ def getErrorWilson(cdf, data_size, confidence):
         **cdf_err**: array
             Error on the CDF.
     """
+    from scipy.stats import norm
     z = norm.ppf((1+confidence)/2)
     cdf_err = z / (1 + z**2/data_size) * np.sqrt(cdf*(1-cdf)/data_size + z**2/(4*data_size**2))# Wilson
     return cdf_err
@@ -1507,6 +1818,8 @@ def curvefit(func, xdata, ydata, p0=None, sigma=None, bounds=(None, None), diff_
     else:
         transform = None
 
+    from scipy.optimize import least_squares, OptimizeWarning
+    from scipy.linalg import svd
     cost_func = _wrap_func(func, xdata, ydata, transform)    
     jac = '3-point'
     res = least_squares(cost_func, p0, jac=jac, bounds=bounds, method='trf', diff_step=diff_step, x_scale=x_scale, loss='huber', 
@@ -1612,6 +1925,7 @@ def curvefit2(func, xdata, ydata, p0=None, sigma=None):
     else:
         transform = None
 
+    from scipy.optimize import minimize
     cost_func = _objective_func
     arguments = (func, xdata, ydata, transform)
     res = minimize(cost_func, p0, args=arguments, method='Powell', options={'disp': True, 'return_all': True},
@@ -1806,6 +2120,7 @@ def sortFrames(dic_data, binned_frames, quantile, factor_minus, factor_plus, whi
             new_dic[key] = np.take(new_dic[key], idx_good_frames, axis=-1)
 
     if plot:
+        import matplotlib.pyplot as plt
         str_null = which_null.capitalize()
         str_null = str_null[:-1]+' '+str_null[-1]
         plt.figure(figsize=(19.2, 10.8))
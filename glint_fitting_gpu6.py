@@ -60,7 +60,15 @@ The settings of the script are defined by:
         * **which_nulls**: list. List of baselines to process;
         * **map_na_sz**: int. Number of values of astrophysical null depth in the grid of the parameter space;
         * **map_mu_sz**: int. Number of values of :math:`\mu` in the grid of the parameter space;
-        * **map_sig_sz**: int. Number of values of :math:`\sig` in the grid of the parameter space.
+        * **map_sig_sz**: int. Number of values of :math:`\sig` in the grid of the parameter space;
+        * **cache_dir**: str. Local folder where the files of the network share are copied once and read afterwards. If ``None``, the files are read from the share (unless the environment variable ``GLINT_CACHE_DIR`` is set);
+        * **cache_size**: float. Maximum size of the local cache in bytes, the least recently used files are deleted first;
+        * **load_baselines_together**: bool. If ``True``, the data of all the baselines of **which_nulls** are loaded in one pass over the files before the fits. The peak memory of the loaded data is then about ``(3 x number of baselines + 4) x nb_frames x nb_wl`` values instead of ``5 x nb_frames x nb_wl`` when each baseline is loaded just before its fit, at the price of reading the files once per baseline. Set it to ``False`` when the data of all the baselines do not fit in memory;
+        * **nb_reader_processes**: int. Number of processes reading the data files (see ``nb_workers`` of ``gff.load_data``). With 1, the files are read by the script itself: more processes only pay off with several cores and a fast file system;
+        * **load_cache_dir**: str. Folder where the loaded and binned data are kept so that a rerun with the same data files and loading settings reads them from it. If ``None``, data are always loaded from the files;
+        * **frame_range**: 2-int tuple. If the data files are per-night stores, rows of the stores to load. ``None`` loads all of them;
+        * **time_window**: 2-float tuple. If the data files are per-night stores, bounds of the timestamps of the frames to load. ``None`` loads all of them;
+        * **precision**: dtype. Type of the loaded data. If ``None`` (default), the type of the data files is kept. ``np.float32``, like the Monte-Carlo simulation, is opt-in and halves the memory used: its tolerance against float64 is tested in ``tests/test_precision.py``.
 """
 
 import numpy as np
@@ -439,6 +447,16 @@ if __name__ == '__main__':
     map_na_sz = 10
     map_mu_sz = 200
     map_sig_sz = 10
+    cache_dir = None
+    cache_size = 100e9
+    load_baselines_together = True
+    nb_reader_processes = 1
+    load_cache_dir = None
+    frame_range = None
+    time_window = None
+    precision = None
+    if cache_dir is not None:
+        gff.glint_cache.setCache(cache_dir, cache_size)
     
     config = prepareConfig()
     nulls_to_invert = config['nulls_to_invert'] # If one null and antinull outputs are swapped in the data processing
@@ -509,6 +527,16 @@ if __name__ == '__main__':
             raise Exception('Check boundaries: the initial guesses (marked as True) are not between the boundaries (null:%s, mu:%s, sig:%s).'%(check_null, check_mu, check_sig))
         
     total_time_start = time()
+    
+    ''' Load data about the nulls to fit, the files are read once for all of them '''
+    load_kwargs = {'frame_binning':global_binning, 'nb_workers':nb_reader_processes, 'cache_dir':load_cache_dir, 'dtype':precision}
+    if load_baselines_together:
+        start_loading = time()
+        darks = gff.load_data_multi(dark_list, (wl_min, wl_max), which_nulls, nulls_to_invert, **load_kwargs)
+        datas = gff.load_data_multi(data_list, (wl_min, wl_max), which_nulls, nulls_to_invert, darks,\
+                                    frame_range=frame_range, time_window=time_window, **load_kwargs)
+        stop_loading = time()
+    
     for key in which_nulls: # Iterate over the null to fit
         # =============================================================================
         # Import data
@@ -517,7 +545,6 @@ if __name__ == '__main__':
         print('Processing %s \n'%key)
         
     #    plt.ioff()
-        start_loading = time()
         if key in nulls_to_invert_model:
             switch_invert_null = True
         else:
@@ -528,11 +555,17 @@ if __name__ == '__main__':
         idx_photo = null_table[key][1] # Select the indexes of the concerned photometries
         key_antinull = null_table[key][2] # Select the index of the antinull output to process
        
-        ''' Load data about the null to fit '''
-        dark = gff.load_data(dark_list, (wl_min, wl_max), key, nulls_to_invert, frame_binning=global_binning)
-        data = gff.load_data(data_list, (wl_min, wl_max), key, nulls_to_invert, dark, frame_binning=global_binning)
+        ''' Data about the null to fit '''
+        if not load_baselines_together: # Only the data of this baseline are loaded
+            darks = datas = dark = data = None # The data of the previous baseline are freed first
+            start_loading = time()
+            darks = gff.load_data_multi(dark_list, (wl_min, wl_max), [key], nulls_to_invert, **load_kwargs)
+            datas = gff.load_data_multi(data_list, (wl_min, wl_max), [key], nulls_to_invert, darks,\
+                                        frame_range=frame_range, time_window=time_window, **load_kwargs)
+            stop_loading = time()
+        dark = darks[key]
+        data = datas[key]
     #    data0 = gff.load_data(data_list, (wl_min, wl_max), key, nulls_to_invert, dark)
-        stop_loading = time()        
     
         if activate_frame_sorting or activate_preview_only:
             data, idx_good_frames = gff.sortFrames(data, nb_frames_sorting_binning, 0.1, factor_minus0[idx_null], factor_plus0[idx_null], key, plot=activate_preview_only, save_path=save_path)
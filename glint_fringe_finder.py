@@ -130,11 +130,10 @@ def processFullFrame(data_list, pos_seg2, maskbounds, swap_ref, which_null=None)
             if bin_frames:
                 img.data = img.binning(img.data, nb_frames_to_bin, axis=0, avg=True)
                 img.nbimg = img.data.shape[0]
-            img.cosmeticsFrames(np.zeros(dark.shape), no_noise)
             
-            ''' Insulating each track '''
+            ''' Remove the background and insulate each track '''
             print('Getting channels')
-            img.getChannels(channel_pos, sep, spatial_axis, dark=dark_per_channel)
+            img.preprocess(channel_pos, sep, spatial_axis, dark_per_channel, no_noise, outputs='Iminus%s'%(which_null))
             
             ''' Map the spectral channels between every chosen tracks before computing 
             the null depth'''
@@ -148,10 +147,10 @@ def processFullFrame(data_list, pos_seg2, maskbounds, swap_ref, which_null=None)
             if spectral_binning:
                 img.spectralBinning(wl_bin_min, wl_bin_max, bandwidth_binning, wl_to_px_coeff)    
                 
-            Iminus = np.array([img.Iminus1, img.Iminus2, img.Iminus3, img.Iminus4, img.Iminus5, img.Iminus6])
-            Iminus = Iminus / Iminus.mean(axis=1)[:,None,:]
+            Iminus = getattr(img, 'Iminus%s'%(which_null)) # Only the null output of the scanned baseline is extracted
+            Iminus = Iminus / Iminus.mean(axis=0)[None,:]
             print('Null', which_null)
-            selected_Iminus = Iminus[which_null-1].T
+            selected_Iminus = Iminus.T
             wl = img.wl_scale[0]
             wl0 = wl.copy()
             scans.append(selected_Iminus)
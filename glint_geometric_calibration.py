@@ -22,6 +22,12 @@ This script is used in 3 steps.
 First step: simply change the value of the variables in the **Settings** section:
     * **save**: boolean, ``True`` for saving products and monitoring data, ``False`` otherwise
     * **monitoring**: boolean, ``True`` for displaying the results of the model fitting and the residuals for both location and width for all outputs
+    * **nb_reader_threads**: int, number of threads loading the next datacubes in the background while the current one is processed
+    * **prefetch_size**: int, maximum number of datacubes loaded in advance
+    * **cache_dir**: str, local folder where the files of the network share are copied once and read afterwards. If ``None``, the files are read from the share (unless the environment variable ``GLINT_CACHE_DIR`` is set)
+    * **cache_size**: float, maximum size of the local cache in bytes, the least recently used files are deleted first
+    * **catalog_path**: str, path to the local catalog of files (see :doc:`glint_catalog`) in which the data files are selected. If ``None``, the default catalog is used
+    * **catalog_max_age**: float, the data folder is scanned again only if its last scan is older than this value in seconds or if files were added to or removed from it since. Set to 0 to always look for new files, ``None`` to never scan again a folder already in the catalog
     
 Second step: change the value of the variables in the **Inputs** and **Outputs** sections:
     * **datafolder**: folder containing the datacube to use.
@@ -38,6 +44,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 import glint_classes
+import glint_cache
+import glint_catalog
 from scipy.optimize import curve_fit
 #import skimage.measure as sk
 
@@ -68,6 +76,14 @@ if __name__ == '__main__':
     # =============================================================================
     ''' Settings '''
     save = True
+    nb_reader_threads = 1
+    prefetch_size = 2
+    cache_dir = None
+    cache_size = 100e9
+    catalog_path = None
+    catalog_max_age = 3600
+    if cache_dir is not None:
+        glint_cache.setCache(cache_dir, cache_size)
     
     print("Getting the shape (position and width) of all tracks")
     ''' Inputs '''
@@ -77,17 +93,17 @@ if __name__ == '__main__':
 #    data_path = '/mnt/96980F95980F72D3/glint_data/'+datafolder
     data_path = '//tintagel.physics.usyd.edu.au/snert/GLINTData/'+datafolder
     output_path = root+'GLINTprocessed/'+datafolder
-    data_list = [data_path+f for f in os.listdir(data_path) if not 'dark' in f][:1000]
+    data_list = glint_catalog.listFiles(data_path, excludes='dark', db_path=catalog_path, max_age=catalog_max_age)[:1000]
     spectral_calibration_path = output_path
-    wl_to_px_coeff = np.load(spectral_calibration_path+'20200601_wl_to_px.npy')
-    px_to_wl_coeff = np.load(spectral_calibration_path+'20200601_px_to_wl.npy')    
+    wl_to_px_coeff = glint_cache.loadNpy(spectral_calibration_path+'20200601_wl_to_px.npy')
+    px_to_wl_coeff = glint_cache.loadNpy(spectral_calibration_path+'20200601_px_to_wl.npy')    
     
     if len(data_list) == 0:
         raise IndexError('Data list is empty')
     
     ''' Remove dark from the frames and average them to increase SNR '''
-    dark = np.load(output_path+'superdark.npy')
-    dark_per_channel = np.load(output_path+'superdarkchannel.npy')
+    dark = glint_cache.loadNpy(output_path+'superdark.npy')
+    dark_per_channel = glint_cache.loadNpy(output_path+'superdarkchannel.npy')
     super_img = np.zeros(dark.shape)
     superNbImg = 0.
      
@@ -102,10 +118,8 @@ if __name__ == '__main__':
     channel_pos = np.around(np.arange(y_ends[0], y_ends[1]+sep, sep))
     
     print('Averaging frames')
-    for f in data_list[:]:
-        img = glint_classes.Null(f)
-        img.cosmeticsFrames(np.zeros(dark.shape))
-        img.getChannels(channel_pos, sep, spatial_axis, dark=dark_per_channel)
+    for f, img in glint_classes.Prefetcher(data_list, nb_threads=nb_reader_threads, queue_size=prefetch_size):
+        img.preprocess(channel_pos, sep, spatial_axis, dark_per_channel)
         super_img = super_img + img.data.sum(axis=0)
         slices = slices + np.sum(img.slices, axis=0)
         superNbImg = superNbImg + img.nbimg
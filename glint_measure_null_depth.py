@@ -48,6 +48,8 @@ First step: simply change the value of the variables in the **Settings** section
         * ``model`` proceeds like ``amplitude`` but the integral of the flux is returned
         * ``windowed`` returns a weighted mean as flux of the spectral channel. The weights is the same pattern as the other modes above
         * ``raw`` returns the mean of the flux along the spatial axis over the whole width of the output        
+    * **catalog_path**: str, path to the local catalog of files (see :doc:`glint_catalog`) in which the data files are selected. If ``None``, the default catalog is used
+    * **catalog_max_age**: float, the data folder is scanned again only if its last scan is older than this value in seconds or if files were added to or removed from it since. Set to 0 to always look for new files, ``None`` to never scan again a folder already in the catalog
     
 Second step: change the value of the variables in the **Inputs** and **Outputs** sections:
     * **datafolder**: folder containing the datacube to use.
@@ -63,6 +65,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 import glint_classes
+import glint_catalog
 import warnings
 from timeit import default_timer as time
 import h5py
@@ -102,6 +105,8 @@ if __name__ == '__main__':
     wl_bin_min, wl_bin_max = 1525, 1575# In nm
     bandwidth_binning = 50 # In nm
     mode_flux = 'amplitude'
+    catalog_path = None
+    catalog_max_age = 3600
     
     ''' Inputs '''
     datafolder = '20200312_fringetracking_injection_variation_spectrum/'
@@ -111,7 +116,7 @@ if __name__ == '__main__':
     geometric_calibration_path = root+'reduction/'+'calibration_params_simu/'
 #    data_path = '//silo.physics.usyd.edu.au/silo4/snert/GLINTData/'+datafolder
     data_path = '/mnt/96980F95980F72D3/glint_data/'+datafolder
-    data_list = sorted([data_path+f for f in os.listdir(data_path) if 'simu' in f])
+    data_list = glint_catalog.listFiles(data_path, 'simu', db_path=catalog_path, max_age=catalog_max_age)
     if len(data_list) == 0:
         raise IndexError('Data list is empty')
     data_list = data_list[nb_files[0]:nb_files[1]]
@@ -17,6 +17,9 @@ It contains:
     * 1d-array for the intensity in the null outputs, named **IminusX** (with X=1..6).
     * 1d-array for the intensity in the anti-null outputs, named **IplusX** (with X=1..6).
     * 1d-array containing the common spectral channels for all the outputs (as each output is slightly shifted from the others)
+
+When the flux is fitted (``mode_flux`` other than ``raw``), a summary of the quality of the fits of all the datacubes is saved too:
+the mean chi2, the maximum residual and the number of singular fits per output and spectral channel (see ``FitSummary`` in :doc:`glint_classes`).
     
 Some monitoring data can be created (but not saved):
     * Histograms of intensities of the photometries
@@ -45,7 +48,8 @@ First step: simply change the value of the variables in the **Settings** section
     * **nb_img**: 2-tuple of int, set the bounds between which the frame are selected, into a data file.
     * **nulls_to_invert**: list of null outputs to invert. Fill with ``nullX`` (X=1..6) or leave empty if no null is to invert (deprecated)
     * **bin_frames**: boolean, set True to bin frames
-    * **nb_frames_to_bin**: number of frames to bin (average) together. If ``None``, the whole stack is average into one frame. If the total number of frames is not a multiple of the binning value, the remaining frames are lost.
+    * **nb_frames_to_bin**: number of frames to bin (average) together. If ``None``, the whole stack of each file is average into one frame. Otherwise, frames are binned across the files so the remaining frames of one file are binned with the first ones of the next file and no frame is lost.
+    * **nb_frames_per_batch**: number of binned frames processed at once when frames are binned. Batches are built across file boundaries and one product is saved per batch. The frames are read by chunks of about this number of raw frames and binned right away, so the memory used is about two batches of frames whatever the binning.
     * **spectral_binning**: bool, set to ``True`` to spectrally bins the outputs
     * **wl_bin_min**: scalar, lower bounds (in nm) of the bandwidth to bin, possibly in several chunks
     * **wl_bin_max**: scalar, upper bounds (in nm) of the bandwidth to bin, possibly in several chunks
@@ -55,10 +59,35 @@ First step: simply change the value of the variables in the **Settings** section
         * ``model`` proceeds like ``amplitude`` but the integral of the flux is returned
         * ``windowed`` returns a weighted mean as flux of the spectral channel. The weights is the same pattern as the other modes above
         * ``raw`` returns the mean of the flux along the spatial axis over the whole width of the output        
+    * **flux_engine**: string, method of the least squares of the modes other than ``raw``: ``numba`` (default) solves them frame by frame, ``parallel`` does the same on several cores with identical results, ``projector`` applies projectors computed once per calibration to all the frames at once: it is faster but its fluxes differ from the ones of ``numba`` by rounding errors (about 1e-14 relative)
+    * **compile_kernels**: bool, set to ``True`` to compile the numba kernels (or load them from the cache on disk) before the first datacube, see ``glint_classes.compileKernels``
+    * **nb_flux_threads**: int, number of threads of the ``parallel`` engine. If ``None``, one per core
+    * **keep_residuals**: bool, set to ``True`` to keep the cube of residuals of the fits of the flux (attribute ``residuals_reg``), 20 times larger than the flux
     * **activate_estimate_spectrum**, boolean, if ``True``, the spectrum of the source in the photometric output is created.
     * **nb_files_spectrum**: tuple, range of files to read to get the spectra.
     * **wavelength_bounds**: tuple, bounds of the bandwidth one wants to keep after the extraction. Used in the method ``getIntensities``. It works independantly of **wl_bin_min** and **wl_bin_max**.
     * **suffix**: str, suffix to distinguish plots respect to data present in the datafolder (e.g. dark, baselines, stars...)
+    * **nb_reader_threads**: int, number of threads loading the next datacubes in the background while the current one is processed
+    * **prefetch_size**: int, maximum number of datacubes loaded in advance
+    * **cache_dir**: str, local folder where the files of the network share are copied once and read afterwards. If ``None``, the files are read from the share (unless the environment variable ``GLINT_CACHE_DIR`` is set)
+    * **cache_size**: float, maximum size of the local cache in bytes, the least recently used files are deleted first
+    * **catalog_path**: str, path to the local catalog of files (see :doc:`glint_catalog`) in which the data files are selected. If ``None``, the default catalog is used
+    * **catalog_max_age**: float, the data folder is scanned again only if its last scan is older than this value in seconds or if files were added to or removed from it since. Set to 0 to always look for new files, ``None`` to never scan again a folder already in the catalog
+    * **calibration_bundle**: str, path to the calibration bundle (see :doc:`glint_calibration`) from which the darks, the geometric and the spectral calibrations are loaded at once. If ``None``, they are loaded from their own files
+    * **save_dtype**: dtype, type of the intensities saved in the products, ``np.float32`` halves their volume (opt-in, the default ``np.float64`` keeps the products unchanged)
+    * **save_compression**: str, lossless HDF5 filter applied to the products: ``None``, ``'lzf'`` (fast) or ``'gzip'`` (smaller, slower)
+    * **save_shuffle**: bool, set to ``True`` to apply the shuffle filter before the compression
+    * **save_chunk_frames**: int, number of frames per HDF5 chunk of the products. If ``None``, h5py chooses it when a filter is used
+    * **save_in_store**: bool, set to ``True`` to append the products of all the datacubes to one store (in the folder ``store`` of the output path) instead of saving one file per datacube. The store is rebuilt at each run and has a frame index giving the source datacube, the frame number and the timestamp of each frame
+    * **fps**: float, frame rate of the acquisition used to timestamp the frames in the store. If ``None``, timestamps are NaN
+    * **async_save**: bool, set to ``True`` to write the products in a background thread while the next datacube is processed
+    * **save_queue_size**: int, maximum number of products waiting to be written when **async_save** is ``True``
+    * **keep_slices0**: bool, set to ``True`` to keep a copy of the outputs before the removal of the dark (attribute ``slices0``)
+    * **precision**: dtype, precision of the reduction: the frames, the outputs and the fluxes are kept in this type. ``np.float32`` halves the memory and the bandwidth used. If ``None`` (default), the type of the datacubes is kept and the fluxes are in float64. ``np.float32`` is opt-in: its tolerance against float64 is tested in ``tests/test_precision.py``
+    * **check_precision**: bool, set to ``True`` to reduce the first datacube in float64 too and stop if the intensities differ by more than ``precision_rtol`` (see :doc:`glint_classes`) from the ones in **precision**. It doubles the processing of the first datacube
+    * **outputs**: list of baselines (``nullX``, X=1..6) and outputs (``pX``, ``IminusX``, ``IplusX``) to extract and save, e.g. ``['null4']`` for the tracks of the null, antinull and photometric outputs of this baseline. If ``None``, the 16 outputs are extracted. The intensities and null depths of the other outputs are NaN
+    * **use_buffer_pool**: bool, set to ``True`` to load and process the datacubes in a fixed set of reused arrays instead of allocating new ones for every file. It is ignored in debug mode as the monitoring keeps the arrays of every file.
+    * **crop_rows**: bool, set to ``True`` to load only the rows of the detector covered by the 16 outputs. The background noise is then estimated on these rows only, which changes the estimated errors of the products.
 
 Second step: change the value of the variables in the **Inputs** and **Outputs** sections:
     * **datafolder**: folder containing the datacube to use.
@@ -74,6 +103,9 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 import glint_classes
+import glint_cache
+import glint_catalog
+import glint_calibration
 import warnings
 from timeit import default_timer as time
 import h5py
@@ -109,6 +141,7 @@ if __name__ == '__main__':
     nb_files = (2000, None)
     bin_frames = False
     nb_frames_to_bin = 50
+    nb_frames_per_batch = 1000
     spectral_binning = True
     wl_bin_min, wl_bin_max = 1525, 1575# In nm
     bandwidth_binning = 50 # In nm
@@ -117,6 +150,33 @@ if __name__ == '__main__':
     nb_files_spectrum = (5000,10000)
     wavelength_bounds = (1400, 1700)
     suffix = 'n5n6'
+    crop_rows = False
+    nb_reader_threads = 1
+    prefetch_size = 2
+    use_buffer_pool = True
+    keep_slices0 = False
+    precision = None
+    check_precision = False
+    outputs = None
+    flux_engine = 'numba'
+    compile_kernels = True
+    nb_flux_threads = None
+    keep_residuals = False
+    async_save = True
+    save_queue_size = 2
+    save_dtype = np.float64
+    save_compression = 'lzf'
+    save_shuffle = True
+    save_chunk_frames = 1000
+    save_in_store = False
+    fps = None
+    cache_dir = None
+    cache_size = 100e9
+    catalog_path = None
+    catalog_max_age = 3600
+    calibration_bundle = None
+    if cache_dir is not None:
+        glint_cache.setCache(cache_dir, cache_size)
 #    ron = 0
     
     mode_flux_list = ['raw', 'fit']
@@ -134,18 +194,24 @@ if __name__ == '__main__':
     data_path = '//tintagel.physics.usyd.edu.au/snert/GLINTData/'+datafolder
     # data_path = 'C:/Users/marc-antoine/glint//GLINTData/'+datafolder
     # data_path = '/mnt/96980F95980F72D3/glint_data/'+datafolder
-    data_list = sorted([data_path+f for f in os.listdir(data_path) if suffix in f])
+    data_list = glint_catalog.listFiles(data_path, suffix, db_path=catalog_path, max_age=catalog_max_age)
     plot_name = datafolder.split('/')[-2]
     if len(data_list) == 0:
         raise IndexError('Data list is empty')
 
     
+    if calibration_bundle is not None:
+        calibration = glint_calibration.loadBundle(calibration_bundle)
+    
     if no_noise:
         dark = np.zeros((344,96))
         dark_per_channel = np.zeros((96,16,20))
+    elif calibration_bundle is not None:
+        dark = calibration['superdark']
+        dark_per_channel = calibration['superdarkchannel']
     else:
-        dark = np.load(output_path+'superdark.npy')
-        dark_per_channel = np.load(output_path+'superdarkchannel.npy')
+        dark = glint_cache.loadNpy(output_path+'superdark.npy')
+        dark_per_channel = glint_cache.loadNpy(output_path+'superdarkchannel.npy')
     
     ''' Set processing configuration and load instrumental calibration data '''
     nb_tracks = 16 # Number of tracks
@@ -153,11 +219,16 @@ if __name__ == '__main__':
     # coeff_width = np.load(geometric_calibration_path+'coeff_width_poly.npy')
     # position_poly = [np.poly1d(coeff_pos[i]) for i in range(nb_tracks)]
     # width_poly = [np.poly1d(coeff_width[i]) for i in range(nb_tracks)]
-    pattern_coeff = np.load(geometric_calibration_path+'pattern_coeff.npy')
+    if calibration_bundle is not None:
+        pattern_coeff = calibration['pattern_coeff']
+        wl_to_px_coeff = calibration['wl_to_px']
+        px_to_wl_coeff = calibration['px_to_wl']
+    else:
+        pattern_coeff = glint_cache.loadNpy(geometric_calibration_path+'pattern_coeff.npy')
+        wl_to_px_coeff = glint_cache.loadNpy(spectral_calibration_path+'20200601_wl_to_px.npy')
+        px_to_wl_coeff = glint_cache.loadNpy(spectral_calibration_path+'20200601_px_to_wl.npy')
     position_outputs = pattern_coeff[:,:,1].T
     width_outputs = pattern_coeff[:,:,2].T
-    wl_to_px_coeff = np.load(spectral_calibration_path+'20200601_wl_to_px.npy')
-    px_to_wl_coeff = np.load(spectral_calibration_path+'20200601_px_to_wl.npy')
     
     
     spatial_axis = np.arange(dark.shape[0])
@@ -167,26 +238,36 @@ if __name__ == '__main__':
     y_ends = [33, 329] # row of top and bottom-most Track
     sep =  (y_ends[1] - y_ends[0])/(nb_tracks-1)
     channel_pos = np.around(np.arange(y_ends[0], y_ends[1]+sep, sep))
+    if crop_rows:
+        rows = glint_classes.getTracksRows(channel_pos, sep)
+    else:
+        rows = None
     
+    ''' Compile the numba kernels out of the processing '''
+    if compile_kernels:
+        kernel_dtypes = [np.float64] if precision is None or np.dtype(precision) == np.float64 else [precision, np.float64]
+        # The frames keep the type of the datacubes (e.g. integers) unless they are converted to the precision or binned
+        with glint_cache.pinnedPath(data_list[0]) as local, h5py.File(local, 'r') as dataFile:
+            data_dtypes = kernel_dtypes + [dataFile['imagedata'].dtype]
+        glint_classes.compileKernels(kernel_dtypes, data_dtypes, engines=[flux_engine])
+
     ''' Get the spectrum of photometric channels '''
     nb_frames = 0
     slices_spectrum = np.zeros_like(dark_per_channel)
 
     if not 'dark' in data_list[0] and not os.path.exists(output_path+'spectra.npy') and activate_estimate_spectrum:
         print('Determining spectrum\n')
-        for f in data_list[nb_files_spectrum[0]:nb_files_spectrum[1]]:
+        for f, img_spectrum in glint_classes.Prefetcher(data_list[nb_files_spectrum[0]:nb_files_spectrum[1]], nb_threads=nb_reader_threads, 
+                                                        queue_size=prefetch_size, nbimg=nb_img, rows=rows, dtype=precision):
             start = time()
             print("Process of : %s (%d / %d)" %(f, data_list.index(f)+1, len(data_list[nb_files_spectrum[0]:nb_files_spectrum[1]])))
-            img_spectrum = glint_classes.Null(f, nbimg=nb_img)
             
             ''' Process frames '''
-            img_spectrum.cosmeticsFrames(np.zeros(dark.shape), no_noise)
-            
-            ''' Insulating each track '''
-            img_spectrum.getChannels(channel_pos, sep, spatial_axis, dark=dark_per_channel)
+            ''' Remove the background and insulate each track '''
+            img_spectrum.preprocess(channel_pos, sep, spatial_axis, dark_per_channel, no_noise)
     
             img_spectrum.matchSpectralChannels(wl_to_px_coeff, px_to_wl_coeff)
-            img_spectrum.getSpectralFlux(spectral_axis, position_outputs, width_outputs, mode_flux)
+            img_spectrum.getSpectralFlux(spectral_axis, position_outputs, width_outputs, mode_flux, engine=flux_engine, nb_threads=nb_flux_threads)
             
             img_spectrum.getIntensities(mode=mode_flux, wl_bounds=wavelength_bounds)
             
@@ -204,11 +285,8 @@ if __name__ == '__main__':
         spectrum.getSpectralFlux(spectral_axis, position_outputs, width_outputs, mode_flux)
         
         spectrum.getIntensities(mode=mode_flux, wl_bounds=wavelength_bounds)
-        spectrum.p1 = spectrum.p1[0] / spectrum.p1[0].sum()
-        spectrum.p2 = spectrum.p2[0] / spectrum.p2[0].sum()
-        spectrum.p3 = spectrum.p3[0] / spectrum.p3[0].sum()
-        spectrum.p4 = spectrum.p4[0] / spectrum.p4[0].sum()
-        spectra = np.array([spectrum.p1, spectrum.p2, spectrum.p3, spectrum.p4])
+        photometry = np.array([getattr(spectrum, name)[0] for name in glint_classes.output_roles['photometric']]) # Copy of p1..p4
+        spectra = photometry / photometry.sum(axis=-1, keepdims=True)
         del spectrum, img_spectrum
         np.save(output_path+'spectra', spectra)
         # plt.figure()
@@ -243,24 +321,42 @@ if __name__ == '__main__':
     p4 = []
     
     if os.path.exists(output_path+'spectra.npy') and activate_estimate_spectrum:
-        spectra = np.load(output_path+'spectra.npy')
+        spectra = glint_cache.loadNpy(output_path+'spectra.npy')
     
     ''' Start the data processing '''
     nb_frames = 0
-    for f in data_list[nb_files[0]:nb_files[1]]:
+    files_to_process = data_list[nb_files[0]:nb_files[1]]
+    pool = glint_classes.BufferPool() if use_buffer_pool and not debug else None
+    writer = glint_classes.AsyncWriter(save_queue_size if async_save and save else 0)
+    fit_summary = glint_classes.FitSummary()
+    if save and save_in_store:
+        store_path = output_path+'store/'+plot_name+'_'+suffix+'.hdf5'
+        if not os.path.exists(output_path+'store/'):
+            os.makedirs(output_path+'store/')
+        if os.path.exists(store_path):
+            os.remove(store_path) # The store is rebuilt like the files of products are overwritten
+    if bin_frames and nb_frames_to_bin is not None:
+        # Batches of binned frames, built across the files
+        frames_source = ((glint_classes.Null(frames, rows=rows, pool=pool, dtype=precision), sources, first_frames) for frames, sources, first_frames in \
+                         glint_classes.streamFrames(files_to_process, nb_frames_per_batch, nb_frames_to_bin, nb_img, rows, dtype=precision))
+    else:
+        # Next datacubes are loaded while the current one is processed
+        frames_source = ((img, [f], None) for f, img in \
+                         glint_classes.Prefetcher(files_to_process, nb_threads=nb_reader_threads, queue_size=prefetch_size, nbimg=nb_img, rows=rows, pool=pool, dtype=precision))
+        
+    for img, sources, first_frames in frames_source:
+        f = sources[0] # Datacube of the first frame
         start = time()
-        print("Process of : %s (%d / %d)" %(f, data_list.index(f)+1, len(data_list[nb_files[0]:nb_files[1]])))
-        img = glint_classes.Null(f, nbimg=nb_img)
+        print("Process of : %s (%d / %d)" %(f, files_to_process.index(f)+1, len(files_to_process)))
         
         ''' Process frames '''
-        if bin_frames:
+        if bin_frames and nb_frames_to_bin is None:
             img.data = img.binning(img.data, nb_frames_to_bin, axis=0, avg=True)
             img.nbimg = img.data.shape[0]
-        img.cosmeticsFrames(np.zeros(dark.shape), no_noise)
         
-        ''' Insulating each track '''
+        ''' Remove the background and insulate each track '''
         print('Getting channels')
-        img.getChannels(channel_pos, sep, spatial_axis, dark=dark_per_channel)
+        img.preprocess(channel_pos, sep, spatial_axis, dark_per_channel, no_noise, keep_slices0, outputs)
 #        img.slices = img.slices + np.random.normal(0, ron, img.slices.shape)
         
         ''' Map the spectral channels between every chosen tracks before computing 
@@ -268,11 +364,24 @@ if __name__ == '__main__':
         img.matchSpectralChannels(wl_to_px_coeff, px_to_wl_coeff)
         
         ''' Measurement of flux per frame, per spectral channel, per track '''
-        img.getSpectralFlux(spectral_axis, position_outputs, width_outputs, mode_flux, debug=debug)
+        img.getSpectralFlux(spectral_axis, position_outputs, width_outputs, mode_flux, debug=debug, engine=flux_engine, nb_threads=nb_flux_threads, keep_residuals=keep_residuals)
+        if img.fit_summary is not None:
+            fit_summary.update(img.fit_summary)
         
         ''' Reconstruct flux in photometric channels '''
         img.getIntensities(mode=mode_flux, wl_bounds=wavelength_bounds)
         
+        ''' Check the precision of the reduction against float64 on the first datacube '''
+        if check_precision and precision is not None and np.dtype(precision) != np.float64 and not debug:
+            print('Checking the precision')
+            reference = glint_classes.Null(img.data.astype(np.float64), rows=rows)
+            reference.preprocess(channel_pos, sep, spatial_axis, dark_per_channel, no_noise, False, outputs)
+            reference.matchSpectralChannels(wl_to_px_coeff, px_to_wl_coeff)
+            reference.getSpectralFlux(spectral_axis, position_outputs, width_outputs, mode_flux, engine=flux_engine, nb_threads=nb_flux_threads)
+            reference.getIntensities(mode=mode_flux, wl_bounds=wavelength_bounds)
+            print('Largest relative difference with float64: %.3g'%(img.checkPrecision(reference)))
+            check_precision = False
+        
         if activate_estimate_spectrum:
             integ = np.array([np.sum(img.p1, axis=1), np.sum(img.p2, axis=1), np.sum(img.p3, axis=1), np.sum(img.p4, axis=1)])
             new_photo = integ[:,:,None] * spectra[:,None,:]
@@ -312,9 +421,18 @@ if __name__ == '__main__':
         null_depths_err = np.array([img.null1_err, img.null2_err, img.null3_err, img.null4_err, img.null5_err, img.null6_err])
         
         ''' Output file'''
-        if save:
-            img.save(output_path+os.path.basename(f)[:-4]+'.hdf5', '2019-04-30')
-            print('Saved')
+        if save and save_in_store:
+            # Frames are numbered from the first frame of their datacube, binned frames by their first raw frame
+            if first_frames is None:
+                sources, first_frames = f, (nb_img[0] or 0) + np.arange(img.p1.shape[0])
+            writer.submit(img.save, store_path, '2019-04-30', save_dtype, save_compression, save_shuffle, save_chunk_frames,
+                          append=True, source=sources, frames=first_frames, fps=fps)
+        elif save:
+            if first_frames is None:
+                save_name = os.path.basename(f)[:-4]
+            else:
+                save_name = os.path.basename(f)[:-4]+'_%s'%(first_frames[0])
+            writer.submit(img.save, output_path+save_name+'.hdf5', '2019-04-30', save_dtype, save_compression, save_shuffle, save_chunk_frames)
     
         null.append(np.transpose(null_depths, axes=(1,0,2)))
         null_err.append(np.transpose(null_depths_err, axes=(1,0,2)))
@@ -340,8 +458,14 @@ if __name__ == '__main__':
         img.getTotalFlux()
         fluxes = np.vstack((fluxes, img.fluxes.T))
         nb_frames += img.nbimg
+        writer.submit(img.release) # Arrays reused by the next datacube once the products are written
         stop = time()
         print('Last: %.3f'%(stop-start))
+    
+    writer.close()
+    if save and fit_summary.nb_frames > 0:
+        fit_summary.save(output_path+'fit_summary_'+plot_name+'_'+suffix+'.hdf5')
+    if save: print('Saved')
         
     '''
     Store quantities for monitoring purpose
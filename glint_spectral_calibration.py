@@ -24,6 +24,12 @@ This script is used in 3 steps.
 
 First step: simply change the value of the variables in the section **Settings**:
     * **save**: boolean, ``True`` for saving products and monitoring data, ``False`` otherwise
+    * **nb_reader_threads**: int, number of threads loading the next datacubes in the background while the current one is processed
+    * **prefetch_size**: int, maximum number of datacubes loaded in advance
+    * **cache_dir**: str, local folder where the files of the network share are copied once and read afterwards. If ``None``, the files are read from the share (unless the environment variable ``GLINT_CACHE_DIR`` is set)
+    * **cache_size**: float, maximum size of the local cache in bytes, the least recently used files are deleted first
+    * **catalog_path**: str, path to the local catalog of files (see :doc:`glint_catalog`) in which the data files are selected. If ``None``, the default catalog is used
+    * **catalog_max_age**: float, the data folder is scanned again only if its last scan is older than this value in seconds or if files were added to or removed from it since. Set to 0 to always look for new files, ``None`` to never scan again a folder already in the catalog
     
 Second step: change the value of the variables in the sections **Inputs**, **Outputs** and **Iterate on wavelength**:
     * **datafolder**: folder containing the datacube to use.
@@ -39,6 +45,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 import glint_classes
+import glint_cache
+import glint_catalog
 from scipy.optimize import curve_fit
 #import skimage.measure as sk
 
@@ -65,6 +73,14 @@ def gaussian(x, A, x0, sig, offset):
 if __name__ == '__main__':
     ''' Settings '''
     save = False
+    nb_reader_threads = 1
+    prefetch_size = 2
+    cache_dir = None
+    cache_size = 100e9
+    catalog_path = None
+    catalog_max_age = 3600
+    if cache_dir is not None:
+        glint_cache.setCache(cache_dir, cache_size)
     
     ''' Inputs '''
     print("-----------------------------\nSpectral calibration")
@@ -78,15 +94,14 @@ if __name__ == '__main__':
     
     ''' Iterate on wavelength '''
     wavelength = [1400, 1450, 1500, 1550, 1600][:]
-    data_list0 = [[data_path+f for f in os.listdir(data_path) if '1400_' in f],
-                 [data_path+f for f in os.listdir(data_path) if '1450_' in f],
-                 [data_path+f for f in os.listdir(data_path) if '1500_' in f],
-                 [data_path+f for f in os.listdir(data_path) if '1550_' in f],
-                 [data_path+f for f in os.listdir(data_path) if '1600_' in f]][:]
+    catalog = glint_catalog.Catalog(catalog_path)
+    catalog.update(data_path, catalog_max_age) # The folder is scanned once for all the wavelengths
+    data_list0 = [catalog.query(data_path, '%s_'%(wl)) for wl in wavelength]
+    catalog.close()
     
     ''' Remove dark from the frames and average them to increase SNR '''
-    dark = np.load(output_path+'superdark.npy')
-    dark_per_channel = np.load(output_path+'superdarkchannel.npy')
+    dark = glint_cache.loadNpy(output_path+'superdark.npy')
+    dark_per_channel = glint_cache.loadNpy(output_path+'superdarkchannel.npy')
     super_img = np.zeros(dark.shape)
     superNbImg = 0.
     
@@ -105,10 +120,8 @@ if __name__ == '__main__':
     for data_list in data_list0:
         print('Processing wavelength %s'%(wavelength[data_list0.index(data_list)]))
         print('Averaging frames')
-        for f in data_list[:]:
-            img = glint_classes.Null(f)
-            img.cosmeticsFrames(np.zeros(dark.shape))
-            img.getChannels(channel_pos, sep, spatial_axis, dark=dark_per_channel)
+        for f, img in glint_classes.Prefetcher(data_list, nb_threads=nb_reader_threads, queue_size=prefetch_size):
+            img.preprocess(channel_pos, sep, spatial_axis, dark_per_channel)
             super_img = super_img + img.data.sum(axis=0)
             slices = slices + np.sum(img.slices, axis=0)
             superNbImg = superNbImg + img.nbimg
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Transcoder of the raw datacubes into the archive layout of the pipeline.
+
+The raw datacubes store the frames in the dataset ``imagedata`` with the structure (frame, spectral, spatial).
+The pipeline works on (frame, spatial, spectral) so every read is followed by a transposition
+and a hyperslab of rows is scattered in the file.
+
+The transcoded datacubes store ``imagedata`` with the structure (frame, spatial, spectral),
+chunked by frames and compressed with a lossless filter.
+The dataset has the attribute ``layout`` set to ``transposed_layout``:
+:doc:`glint_classes` detects it and reads the frames directly in the arrays of the pipeline, without any copy.
+The other datasets and the attributes of the raw datacubes are copied unchanged.
+
+The settings are in the ``Settings`` section:
+    * **chunk_frames**: int, number of frames per HDF5 chunk
+    * **compression**: str, lossless HDF5 filter: ``None``, ``'lzf'`` (fast) or ``'gzip'`` (smaller, slower)
+    * **shuffle**: bool, set to ``True`` to apply the shuffle filter before the compression
+    * **nb_frames_per_batch**: int, number of frames read and written at once
+    * **catalog_path**: str, path to the local catalog of files (see :doc:`glint_catalog`) in which the datacubes are selected. If ``None``, the default catalog is used
+    * **catalog_max_age**: float, the data folder is scanned again only if its last scan is older than this value in seconds or if files were added to or removed from it since. Set to 0 to always look for new files, ``None`` to never scan again a folder already in the catalog
+
+The inputs and outputs are in the ``Inputs`` and ``Outputs`` sections:
+    * **data_path**: folder of the raw datacubes
+    * **output_path**: folder of the transcoded datacubes, they keep the name of the raw ones
+"""
+
+import numpy as np
+import os
+import h5py
+import glint_catalog
+
+transposed_layout = 'frame,spatial,spectral'
+
+def isTransposed(dset):
+    """
+    Tells if a dataset ``imagedata`` is in the layout of the transcoded datacubes.
+
+    :Parameters:
+        **dset**: h5py dataset
+            Dataset of a datacube.
+
+    :Returns:
+        ``True`` if the dataset is stored as (frame, spatial, spectral).
+    """
+    return dset.attrs.get('layout') == transposed_layout
+
+def transcodeFile(path, new_path, chunk_frames=100, compression='lzf', shuffle=True, nb_frames_per_batch=1000):
+    """
+    Rewrites a raw datacube in the archive layout.
+
+    :Parameters:
+        **path**: str
+            Path of the raw datacube.
+        **new_path**: str
+            Path of the transcoded datacube.
+        **chunk_frames**: int (optional)
+            Number of frames per chunk.
+        **compression**: str (optional)
+            Lossless HDF5 filter.
+        **shuffle**: bool (optional)
+            If ``True``, applies the shuffle filter.
+        **nb_frames_per_batch**: int (optional)
+            Number of frames read and written at once.
+    """
+    tmp = new_path + '.tmp'
+    with h5py.File(path, 'r') as f, h5py.File(tmp, 'w') as g:
+        for key, value in f.attrs.items():
+            g.attrs[key] = value
+        for key in f.keys():
+            if key != 'imagedata':
+                f.copy(key, g)
+
+        dset = f['imagedata']
+        if isTransposed(dset):
+            shape = dset.shape
+        else:
+            shape = (dset.shape[0], dset.shape[2], dset.shape[1])
+        chunks = (max(min(chunk_frames, shape[0]), 1),) + shape[1:] # Whole frames in a chunk
+        new_dset = g.create_dataset('imagedata', shape, dset.dtype, chunks=chunks, maxshape=(None,)+shape[1:],
+                                    compression=compression, shuffle=shuffle)
+        for key, value in dset.attrs.items():
+            new_dset.attrs[key] = value
+        new_dset.attrs['layout'] = transposed_layout
+
+        for start in range(0, shape[0], nb_frames_per_batch):
+            frames = dset[start:start+nb_frames_per_batch]
+            if not isTransposed(dset):
+                frames = np.swapaxes(frames, 1, 2)
+            new_dset[start:start+frames.shape[0]] = frames
+    os.replace(tmp, new_path) # A partly transcoded datacube is never read
+
+
+if __name__ == '__main__':
+    ''' Settings '''
+    chunk_frames = 100
+    compression = 'lzf'
+    shuffle = True
+    nb_frames_per_batch = 1000
+    catalog_path = None
+    catalog_max_age = 3600
+
+    ''' Inputs '''
+    datafolder = 'data202009/20200906/'
+    data_path = '/mnt/96980F95980F72D3/glint_data/'+datafolder
+    data_list = glint_catalog.listFiles(data_path, db_path=catalog_path, max_age=catalog_max_age, file_type='raw')
+
+    ''' Outputs '''
+    output_path = '/mnt/96980F95980F72D3/glint_data/transcoded/'+datafolder
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    for f in data_list:
+        print("Transcoding of : %s (%d / %d)" %(f, data_list.index(f)+1, len(data_list)))
+        transcodeFile(f, output_path+os.path.basename(f), chunk_frames, compression, shuffle, nb_frames_per_batch)
@@ -24,6 +24,13 @@ The settings are in the ``Settings`` section:
     * **nb_img**: tuple, bounds between frames are selected. Leave ``None`` to start from the first frame or to finish to the last one (included).
     * **debug**: bool, set to ``True`` to check if the method ``getSpectralFlux`` correctly behaves (e.g. good geometric calibration). It is strongly adviced to change **nb_img** to only process one frame.
     * **save**: bool, set to ``True`` to save the zeta coefficient.
+    * **nb_reader_threads**: int, number of threads loading the next datacubes in the background while the current one is processed
+    * **prefetch_size**: int, maximum number of datacubes loaded in advance
+    * **cache_dir**: str, local folder where the files of the network share are copied once and read afterwards. If ``None``, the files are read from the share (unless the environment variable ``GLINT_CACHE_DIR`` is set)
+    * **cache_size**: float, maximum size of the local cache in bytes, the least recently used files are deleted first
+    * **catalog_path**: str, path to the local catalog of files (see :doc:`glint_catalog`) in which the data files are selected. If ``None``, the default catalog is used
+    * **catalog_max_age**: float, the data folder is scanned again only if its last scan is older than this value in seconds or if files were added to or removed from it since. Set to 0 to always look for new files, ``None`` to never scan again a folder already in the catalog
+    * **calibration_bundle**: str, path to the calibration bundle (see :doc:`glint_calibration`) from which the darks, the geometric and the spectral calibrations are loaded at once. If ``None``, they are loaded from their own files
     
 The outputs are:
     * Some plots for characterization and monitoring purpose, they are not automatically saved.
@@ -34,6 +41,9 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 import glint_classes
+import glint_cache
+import glint_catalog
+import glint_calibration
 import warnings
 
 def gaussian(x, A, loc, sig):
@@ -64,11 +74,20 @@ if __name__ == '__main__':
     nb_img = (None, None)
     debug = False
     save = True
+    nb_reader_threads = 1
+    prefetch_size = 2
+    cache_dir = None
+    cache_size = 100e9
+    catalog_path = None
+    catalog_max_age = 3600
+    calibration_bundle = None
     mode_flux = 'raw'
     suffix = ''
     spectral_binning = False
     wl_bin_min, wl_bin_max = 1525, 1575# In nm
     bandwidth_binning = 50 # In nm
+    if cache_dir is not None:
+        glint_cache.setCache(cache_dir, cache_size)
 
     ''' Inputs '''
     datafolder = 'data202012/20201209/zeta/'
@@ -79,54 +98,62 @@ if __name__ == '__main__':
     geometric_calibration_path = output_path
     data_path = '/mnt/96980F95980F72D3/glint_data/'+datafolder
     # data_path = '//tintagel.physics.usyd.edu.au/snert/GLINTData/'+datafolder
-    dark = np.load(output_path+'superdark.npy')
+    
+    ''' Output '''
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    
+    ''' Set processing configuration and load instrumental calibration data, once for all the beams '''
+    nb_tracks = 16 # Number of tracks
+    which_tracks = np.arange(16) # Tracks to process
+    # coeff_pos = np.load(geometric_calibration_path+'20200130_coeff_position_poly.npy')
+    # coeff_width = np.load(geometric_calibration_path+'20200130_coeff_width_poly.npy')
+    # position_poly = [np.poly1d(coeff_pos[i]) for i in range(nb_tracks)]
+    # width_poly = [np.poly1d(coeff_width[i]) for i in range(nb_tracks)]
+    if calibration_bundle is not None:
+        calibration = glint_calibration.loadBundle(calibration_bundle)
+        dark = calibration['superdark']
+        dark_per_channel = calibration['superdarkchannel']
+        pattern_coeff = calibration['pattern_coeff']
+        wl_to_px_coeff = calibration['wl_to_px']
+        px_to_wl_coeff = calibration['px_to_wl']
+    else:
+        dark = glint_cache.loadNpy(output_path+'superdark.npy')
+        dark_per_channel = glint_cache.loadNpy(output_path+'superdarkchannel.npy')
+        pattern_coeff = glint_cache.loadNpy(geometric_calibration_path+'pattern_coeff.npy')
+        wl_to_px_coeff = glint_cache.loadNpy(spectral_calibration_path+'20200906_wl_to_px.npy')
+        px_to_wl_coeff = glint_cache.loadNpy(spectral_calibration_path+'20200906_px_to_wl.npy')
+    if no_noise:
+        dark_per_channel = np.zeros(dark_per_channel.shape)
+    position_outputs = pattern_coeff[:,:,1].T
+    width_outputs = pattern_coeff[:,:,2].T
+    
+    spatial_axis = np.arange(dark.shape[0])
+    spectral_axis = np.arange(dark.shape[1])
+    
+    ''' Define bounds of each track '''
+    y_ends = [33, 329] # row of top and bottom-most Track
+    sep = (y_ends[1] - y_ends[0])/(nb_tracks-1)
+    channel_pos = np.around(np.arange(y_ends[0], y_ends[1]+sep, sep))
     
     Iminus = []
     Iplus = []
     P1, P2, P3, P4 = 0, 0, 0, 0
     zeta_coeff = {}
     
+    catalog = glint_catalog.Catalog(catalog_path)
+    catalog.update(data_path, catalog_max_age) # The folder is scanned once for all the beams
+    data_lists = {beam:catalog.query(data_path, 'p'+str(beam)) for beam in range(1,5)}
+    catalog.close()
+    
     for beam in range(1,5):
-        data_list = [data_path+f for f in os.listdir(data_path) if 'p'+str(beam) in f]
-        
-        ''' Output '''
-        output_path = root+'GLINTprocessed/'+datafolder
-        if not os.path.exists(output_path):
-            os.makedirs(output_path)
+        data_list = data_lists[beam]
         
-        dark = np.load(output_path+'superdark.npy')
-        dark_per_channel = np.load(output_path+'superdarkchannel.npy')
-        if no_noise:
-            dark_per_channel[:] = 0.
-        
-        ''' Set processing configuration and load instrumental calibration data '''
-        nb_tracks = 16 # Number of tracks
-        which_tracks = np.arange(16) # Tracks to process
-        # coeff_pos = np.load(geometric_calibration_path+'20200130_coeff_position_poly.npy')
-        # coeff_width = np.load(geometric_calibration_path+'20200130_coeff_width_poly.npy')
-        # position_poly = [np.poly1d(coeff_pos[i]) for i in range(nb_tracks)]
-        # width_poly = [np.poly1d(coeff_width[i]) for i in range(nb_tracks)]
-        pattern_coeff = np.load(geometric_calibration_path+'pattern_coeff.npy')
-        position_outputs = pattern_coeff[:,:,1].T
-        width_outputs = pattern_coeff[:,:,2].T
-        wl_to_px_coeff = np.load(spectral_calibration_path+'20200906_wl_to_px.npy')
-        px_to_wl_coeff = np.load(spectral_calibration_path+'20200906_px_to_wl.npy')
-        
-        
-        spatial_axis = np.arange(dark.shape[0])
-        spectral_axis = np.arange(dark.shape[1])
-        
-        ''' Define bounds of each track '''
-        y_ends = [33, 329] # row of top and bottom-most Track
-        sep = (y_ends[1] - y_ends[0])/(nb_tracks-1)
-        channel_pos = np.around(np.arange(y_ends[0], y_ends[1]+sep, sep))
-                
         ''' Start the data processing '''
         superData = np.zeros((344,96))
         superNbImg = 0
-        for f in data_list:
+        for f, img in glint_classes.Prefetcher(data_list, glint_classes.ChipProperties, nb_reader_threads, prefetch_size, nbimg=nb_img):
             print("Process of : %s (%d / %d)" %(f, data_list.index(f)+1, len(data_list)))
-            img = glint_classes.ChipProperties(f, nbimg=nb_img)
             print(img.data[:,:,10].mean())
     
             superData = superData + img.data.sum(axis=0)
@@ -142,11 +169,9 @@ if __name__ == '__main__':
         img2 = glint_classes.ChipProperties(nbimg=(0,1))
         img2.data = np.reshape(superData, (1,superData.shape[0], superData.shape[1]))
         
-        img2.cosmeticsFrames(np.zeros(dark.shape), no_noise)
-        
-        ''' Insulating each track '''
+        ''' Remove the background and insulate each track '''
         print('Getting channels')
-        img2.getChannels(channel_pos, sep, spatial_axis, dark=dark_per_channel)
+        img2.preprocess(channel_pos, sep, spatial_axis, dark_per_channel, no_noise)
         
         ''' Map the spectral channels between every chosen tracks before computing 
         the null depth'''
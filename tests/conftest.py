@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+Configuration of the tests: the modules of the pipeline are imported from the root of the repository.
+"""
+
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not root in sys.path:
+    sys.path.insert(0, root)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Copies of the files of the share kept by ``DiskCache`` of :doc:`glint_cache`: 
+eviction of the least recently used copies, pins of the copies in use and copies deleted by hand.
+"""
+
+import os
+import pytest
+import glint_cache
+
+file_size = 100 # bytes
+
+@pytest.fixture
+def share(tmp_path):
+    """
+    Files of ``file_size`` bytes on a fake share.
+    """
+    folder = tmp_path / 'share'
+    folder.mkdir()
+    paths = {}
+    for name in ['a', 'b', 'c']:
+        paths[name] = str(folder / (name+'.mat'))
+        with open(paths[name], 'wb') as f:
+            f.write(name.encode() * file_size)
+    return paths
+
+def test_lru_eviction(share, tmp_path):
+    cache = glint_cache.DiskCache(str(tmp_path / 'cache'), max_size=2.5*file_size)
+    local_a, local_b = cache.getPath(share['a']), cache.getPath(share['b'])
+    assert cache.getPath(share['a']) == local_a # a is now more recently used than b
+    local_c = cache.getPath(share['c'])
+    assert not os.path.exists(local_b)
+    assert os.path.exists(local_a) and os.path.exists(local_c)
+    assert cache._size == 2 * file_size
+    with open(local_a, 'rb') as f:
+        assert f.read() == b'a' * file_size
+
+def test_pin(share, tmp_path):
+    cache = glint_cache.DiskCache(str(tmp_path / 'cache'), max_size=1.5*file_size)
+    local_a = cache.getPath(share['a'], pin=True)
+    local_b = cache.getPath(share['b'])
+    assert os.path.exists(local_a) # Pinned, the cache is over its size meanwhile
+    assert cache._size == 2 * file_size
+    cache.release(local_a)
+    cache.getPath(share['c'])
+    assert not os.path.exists(local_a) and not os.path.exists(local_b)
+    assert cache._size == file_size
+
+def test_pinned_path(share, tmp_path, monkeypatch):
+    monkeypatch.setattr(glint_cache, '_cache', glint_cache.DiskCache(str(tmp_path / 'cache'), max_size=file_size))
+    with glint_cache.pinnedPath(share['a']) as local_a:
+        assert glint_cache._cache._pins == {local_a:1}
+        glint_cache.cachedPath(share['b'])
+        assert os.path.exists(local_a)
+    assert glint_cache._cache._pins == {}
+
+def test_deleted_copy(share, tmp_path):
+    cache = glint_cache.DiskCache(str(tmp_path / 'cache'), max_size=2.5*file_size)
+    local_a = cache.getPath(share['a'])
+    cache.getPath(share['b'])
+    os.remove(local_a) # Deleted out of the cache
+    assert cache.getPath(share['a']) == local_a # Copied again
+    assert os.path.exists(local_a)
+    assert cache._size == 2 * file_size
+    assert list(cache._entries)[-1] == local_a
+
+def test_modified_file(share, tmp_path):
+    cache = glint_cache.DiskCache(str(tmp_path / 'cache'), max_size=2.5*file_size)
+    local = cache.getPath(share['a'])
+    with open(share['a'], 'wb') as f:
+        f.write(b'd' * (file_size + 1))
+    assert cache.getPath(share['a']) != local
+    assert glint_cache.DiskCache(str(tmp_path / 'other'), max_size=file_size).getPath(share['a']) == share['a'] # Larger than the cache
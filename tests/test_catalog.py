@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental update of the catalog of :doc:`glint_catalog` and selection of its files.
+"""
+
+import os
+import numpy as np
+import h5py
+import pytest
+import glint_catalog
+
+def _writeDatacube(path, nb_frames):
+    with h5py.File(path, 'w') as f:
+        f.create_dataset('imagedata', data=np.zeros((nb_frames, 4, 6), dtype=np.uint16))
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = glint_catalog.Catalog(str(tmp_path / 'catalog.sqlite'))
+    yield catalog
+    catalog.close()
+
+def test_update(catalog, tmp_path):
+    folder = tmp_path / 'Capella'
+    folder.mkdir()
+    _writeDatacube(str(folder / 'a.mat'), 3)
+    _writeDatacube(str(folder / 'b.mat'), 5)
+    np.save(str(folder / 'c.npy'), np.zeros(2))
+    assert catalog.update(str(folder), 0) == 3
+    assert catalog.query(str(folder), file_type='raw', target='Capella') == [str(folder / 'a.mat'), str(folder / 'b.mat')]
+    assert catalog.query(str(folder), file_type='npy') == [str(folder / 'c.npy')]
+    assert catalog.update(str(folder), 0) == 0 # Unchanged files are not opened again
+
+    _writeDatacube(str(folder / 'a.mat'), 7)
+    os.utime(str(folder / 'a.mat'), (0, 1e9)) # Modified file
+    os.remove(str(folder / 'b.mat'))
+    assert catalog.update(str(folder), 0) == 1
+    assert catalog.query(str(folder), file_type='raw') == [str(folder / 'a.mat')]
+    assert catalog.getFrames([str(folder / 'a.mat'), str(folder / 'b.mat')]) == [7, None]
+    assert catalog.query(str(folder), min_frames=8) == []
+
+def test_update_max_age(catalog, tmp_path):
+    folder = tmp_path / 'dark'
+    folder.mkdir()
+    _writeDatacube(str(folder / 'a.mat'), 3)
+    assert catalog.update(str(folder), 3600) == 1
+    _writeDatacube(str(folder / 'b.mat'), 3)
+    os.utime(str(folder), None)
+    assert catalog.update(str(folder), None) == 0 # The catalog is only queried
+    assert catalog.update(str(folder), 3600) == 1 # The folder changed since its last scan
+    assert len(catalog.query(str(folder))) == 2
+
+def test_query_escaping(catalog, tmp_path):
+    names = ['dark_1550_a.mat', 'dark_15501a.mat', 'rate_50%.npy', 'rate_501.npy']
+    for name in names:
+        (tmp_path / name).touch()
+    catalog.update(str(tmp_path), 0)
+    assert catalog.query(str(tmp_path), contains='%s_'%(1550)) == [str(tmp_path / 'dark_1550_a.mat')]
+    assert catalog.query(str(tmp_path), contains='50%') == [str(tmp_path / 'rate_50%.npy')]
+    assert catalog.query(str(tmp_path), contains='dark', excludes='1550_') == [str(tmp_path / 'dark_15501a.mat')]
+    assert catalog.query(str(tmp_path), pattern='dark%') == sorted([str(tmp_path / name) for name in names[:2]])
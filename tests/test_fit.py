@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Fit of the flux of one output in one spectral channel by ``_fitChannel`` of :doc:`glint_classes`,
+by the normal equations or by least squares when the normal matrix is ill-conditioned.
+"""
+
+import numpy as np
+import pytest
+import glint_classes
+
+nbimg, nb_wl, width = 5, 21, 20
+channel = nb_wl - 1 # Channels below 20 are not fitted
+std = 0.05
+
+def _fit(widths, use_lstsq):
+    """
+    Fits a Gaussian track of the given widths on a linear background in the last spectral channel.
+    """
+    rng = np.random.default_rng(2)
+    slices_axes = np.arange(width, dtype=np.float64)[None,:] + 30
+    positions = np.full((1, nb_wl), 40.)
+    profile = np.exp(-(slices_axes[0]-positions[0,channel])**2/(2*2.**2))
+    slices = 10 + 0.1 * slices_axes[0] + 500 * rng.random((nbimg, nb_wl, 1, 1)) * profile + rng.normal(0, 1, (nbimg, nb_wl, 1, width))
+    amplitude, error = np.zeros((nbimg, 1, nb_wl)), np.zeros((nbimg, 1, nb_wl))
+    residuals_reg = np.zeros((nbimg, 1, nb_wl, width))
+    chi2_sum, residual_max = np.zeros((1, nb_wl)), np.zeros((1, nb_wl))
+    nb_failed = np.zeros((1, nb_wl), dtype=np.int64)
+    glint_classes._fitChannel(0, channel, nbimg, slices_axes, slices, positions, widths, std, use_lstsq, amplitude, residuals_reg, error,
+                              True, chi2_sum, residual_max, nb_failed)
+    return {'amplitude':amplitude[:,0,channel], 'error':error[:,0,channel], 'residuals':residuals_reg[:,0,channel],
+            'chi2_sum':chi2_sum[0,channel], 'nb_failed':nb_failed[0,channel], 'slices':slices[:,channel,0], 'axis':slices_axes[0]}
+
+def _lstsq(fit, widths):
+    """
+    Amplitudes of the weighted least squares solved by numpy.
+    """
+    gaus = np.exp(-(fit['axis']-40.)**2/(2*widths[0,channel]**2))
+    gaus /= gaus.sum()
+    Aw = np.vstack((gaus, np.ones_like(gaus), fit['axis'])) * (gaus + std)
+    return np.array([np.linalg.lstsq(Aw.T, data * (gaus + std), rcond=None)[0][0] for data in fit['slices']])
+
+@pytest.mark.parametrize('track_width, degenerate', [(2., False), (1e8, True)])
+def test_fit_channel(track_width, degenerate):
+    widths = np.full((1, nb_wl), track_width)
+    fit = _fit(widths, False)
+    reference = _fit(widths, True)
+    # The fallback is taken for all the frames of a degenerate channel, only there
+    assert fit['nb_failed'] == (nbimg if degenerate else 0)
+    assert reference['nb_failed'] == 0
+    if degenerate:
+        for key in ['amplitude', 'error', 'residuals', 'chi2_sum']:
+            np.testing.assert_array_equal(fit[key], reference[key])
+    else:
+        np.testing.assert_allclose(fit['amplitude'], reference['amplitude'], rtol=1e-9)
+    np.testing.assert_allclose(fit['amplitude'], _lstsq(fit, widths), rtol=1e-9)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Import of the libraries of the pipeline without the optional dependencies:
+:doc:`glint_classes` and :doc:`glint_fitting_functions` must not import matplotlib, scipy or cupy
+before they are used, and must import within **import_budget** seconds.
+
+numba imports the base package of scipy by itself, so the modules are compared
+to those loaded once numba is imported.
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+import_budget = 2. # s
+
+script = """
+import sys, json
+from timeit import default_timer as time
+sys.modules['cupy'] = None # As if cupy was not installed
+import numpy, h5py, numba
+before = set(sys.modules)
+start = time()
+import glint_classes, glint_fitting_functions6
+duration = time() - start
+new = [name for name in set(sys.modules) - before if name.split('.')[0] in ('matplotlib', 'scipy', 'cupy')]
+print(json.dumps({'duration':duration, 'new':sorted(new), 'cupy':sys.modules['cupy'] is None}))
+"""
+
+def test_import_without_optional_dependencies():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', script], cwd=root, capture_output=True, text=True, check=True)
+    result = json.loads(result.stdout.splitlines()[-1])
+    assert result['new'] == []
+    assert result['cupy']
+    assert result['duration'] < import_budget
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Loading of the intermediate products for the fit by ``load_data_multi`` of :doc:`glint_fitting_functions`.
+"""
+
+import os
+import numpy as np
+import h5py
+import pytest
+import glint_fitting_functions6 as gff
+
+wl_edges = (1510, 1560)
+null_keys = ['null1', 'null4', 'null5', 'null6']
+nulls_to_invert = ['null4']
+
+def _writeProduct(path, nb_frames, rng):
+    with h5py.File(path, 'w') as f:
+        f['wl_scale'] = 1500 + np.arange(60) * 1.5
+        for key in ['p%s'%(beam) for beam in range(1, 5)] + ['I%s%s'%(sign, idx) for sign in ['minus', 'plus'] for idx in range(1, 7)]:
+            f[key] = rng.random((nb_frames, 60)) + 0.5
+        for beam in range(1, 5):
+            f['p%serr'%(beam)] = rng.random(nb_frames)
+
+@pytest.fixture(scope='module')
+def products(tmp_path_factory):
+    """
+    Small intermediate products of different lengths.
+    """
+    rng = np.random.default_rng(1)
+    folder = tmp_path_factory.mktemp('products')
+    paths = []
+    for k, nb_frames in enumerate([30, 1, 45]):
+        path = str(folder / ('product%s.hdf5'%(k)))
+        _writeProduct(path, nb_frames, rng)
+        paths.append(path)
+    return paths
+
+def _assertEqual(outs, reference):
+    for key in reference:
+        for name in reference[key]:
+            np.testing.assert_array_equal(outs[key][name], reference[key][name])
+            assert outs[key][name].dtype == reference[key][name].dtype
+
+@pytest.mark.parametrize('kwargs', [{}, {'dtype':np.float32}, {'frame_range':(5, 20)}])
+def test_load_workers(products, kwargs):
+    reference = gff.load_data_multi(products, wl_edges, null_keys, nulls_to_invert, **kwargs)
+    outs = gff.load_data_multi(products, wl_edges, null_keys, nulls_to_invert, nb_workers=2, **kwargs)
+    _assertEqual(outs, reference)
+
+@pytest.mark.parametrize('kwargs', [{}, {'frame_binning':4}])
+def test_load_baselines(products, kwargs):
+    all_keys = ['null%s'%(k) for k in range(1, 7)]
+    darks = gff.load_data_multi(products[:1], wl_edges, all_keys, [])
+    outs = gff.load_data_multi(products, wl_edges, all_keys, nulls_to_invert, darks, **kwargs)
+    for key in all_keys:
+        reference = gff.load_data(products, wl_edges, key, nulls_to_invert, darks[key], **kwargs)
+        assert sorted(outs[key]) == sorted(reference)
+        _assertEqual({key:outs[key]}, {key:reference})
+    # The photometries of the baselines are views, in the order of the beams of the baseline (3 then 1 for null5)
+    assert np.shares_memory(outs['null5']['photo'], outs['null1']['photo'])
+    with h5py.File(products[0], 'r') as f:
+        wl_idx = outs['null5']['wl_idx']
+        nb_frames = f['p3'].shape[0] // kwargs.get('frame_binning', 1)
+        for k, beam in enumerate([3, 1]):
+            expected = f['p%s'%(beam)][:nb_frames * kwargs.get('frame_binning', 1), wl_idx]
+            expected = expected.reshape((nb_frames, -1, wl_idx.size)).mean(axis=1).T
+            np.testing.assert_allclose(outs['null5']['photo'][k][:,:nb_frames], expected, rtol=1e-12)
+
+def test_load_cache(tmp_path, monkeypatch):
+    rng = np.random.default_rng(3)
+    paths = [str(tmp_path / ('product%s.hdf5'%(k))) for k in range(2)]
+    for path in paths:
+        _writeProduct(path, 12, rng)
+    read = [] # Files read by the last loading
+    fillArrays = gff._fillArrays
+    
+    def _fillArraysSpy(arrays, path, *args):
+        read.append(path)
+        fillArrays(arrays, path, *args)
+    
+    monkeypatch.setattr(gff, '_fillArrays', _fillArraysSpy)
+    
+    def load(**kwargs):
+        del read[:]
+        kwargs = dict({'wl_edges':wl_edges, 'frame_binning':2, 'cache_dir':str(tmp_path / 'cache')}, **kwargs)
+        return gff.load_data_multi(paths, kwargs.pop('wl_edges'), null_keys, nulls_to_invert, **kwargs)
+    
+    reference = load()
+    assert read == paths
+    _assertEqual(load(), reference) # Read from the cache
+    assert read == []
+    
+    for kwargs in [{'frame_binning':3}, {'frame_binning':None}, {'wl_edges':(1510, 1540)}, {'dtype':np.float32}, {'frame_range':(0, 5)}]:
+        load(**kwargs)
+        assert read == paths, kwargs
+    
+    # A modified source is read again
+    _writeProduct(paths[1], 12, rng)
+    stat = os.stat(paths[1])
+    os.utime(paths[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    outs = load()
+    assert read == paths
+    assert not np.array_equal(outs['null1']['Iminus'], reference['null1']['Iminus'])
+    _assertEqual(outs, load(cache_dir=None))
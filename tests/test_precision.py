@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Tolerance of the float32 precision mode against the float64 path,
+for the reduction (:doc:`glint_classes`) and the loading of the products (``load_data``).
+
+The tolerances are:
+    * **glint_classes.precision_rtol** (1e-4): largest difference of the intensities of an output, 
+      relative to its largest absolute intensity;
+    * **load_rtol** (1e-6): relative difference of the arrays loaded by ``load_data``, 
+      i.e. the rounding of float64 values to float32.
+"""
+
+import numpy as np
+import h5py
+import pytest
+import glint_classes
+import glint_fitting_functions6 as gff
+
+load_rtol = 1e-6
+
+nb_tracks = 16
+y_ends = [33, 329]
+sep = (y_ends[1] - y_ends[0])/(nb_tracks-1)
+channel_pos = np.around(np.arange(y_ends[0], y_ends[1]+sep, sep))
+spatial_axis = np.arange(344)
+spectral_axis = np.arange(96)
+wl = 1500 + spectral_axis * 1.5
+wl_to_px = np.array([np.polyfit(wl, spectral_axis, 1)]*nb_tracks)
+px_to_wl = np.array([np.polyfit(spectral_axis, wl, 1)]*nb_tracks)
+
+@pytest.fixture(scope='module')
+def datacube(tmp_path_factory):
+    """
+    Synthetic datacube of Gaussian tracks on a noisy background, stored like the raw datacubes.
+    """
+    rng = np.random.default_rng(0)
+    nb_frames = 20
+    positions = channel_pos[:,None] + rng.normal(0, 0.3, (nb_tracks, spectral_axis.size))
+    widths = 1.5 + 0.2 * rng.random((nb_tracks, spectral_axis.size))
+    flux = 1000 * (1 + rng.random((nb_frames, nb_tracks, 1))) * np.exp(-(wl-1570)**2/(2*60**2))
+    profiles = np.exp(-(spatial_axis[None,None,:]-positions[:,:,None])**2/(2*widths[:,:,None]**2))
+    frames = 100 + np.einsum('ftw,tws->fws', flux, profiles) + rng.normal(0, 2, (nb_frames, spectral_axis.size, spatial_axis.size))
+    path = str(tmp_path_factory.mktemp('data') / 'datacube.mat')
+    with h5py.File(path, 'w') as f:
+        f.create_dataset('imagedata', data=frames.astype(np.float32))
+    dark = 100 + rng.normal(0, 0.1, (spectral_axis.size, nb_tracks, 20))
+    return path, dark, positions, widths
+
+def _reduce(datacube, dtype):
+    path, dark, positions, widths = datacube
+    img = glint_classes.Null(path, dtype=dtype)
+    img.preprocess(channel_pos, sep, spatial_axis, dark)
+    img.matchSpectralChannels(wl_to_px, px_to_wl)
+    img.getSpectralFlux(spectral_axis, positions, widths, 'fit', engine='projector')
+    img.getIntensities('fit')
+    return img
+
+def test_reduction_float32(datacube):
+    reference = _reduce(datacube, np.float64)
+    img = _reduce(datacube, np.float32)
+    assert img.slices.dtype == np.float32
+    assert img.intensities.dtype == np.float32
+    assert img.checkPrecision(reference) <= glint_classes.precision_rtol
+    scale = np.max(np.abs(reference.intensities), axis=(0,2), keepdims=True)
+    assert np.max(np.abs(img.intensities - reference.intensities) / scale) <= glint_classes.precision_rtol
+
+def test_check_precision_raises(datacube):
+    reference = _reduce(datacube, np.float64)
+    img = _reduce(datacube, np.float32)
+    img.p1 = img.p1 * (1 + 10 * glint_classes.precision_rtol)
+    with pytest.raises(ValueError):
+        img.checkPrecision(reference)
+
+def test_load_data_float32(datacube, tmp_path):
+    path = str(tmp_path / 'product.hdf5')
+    _reduce(datacube, np.float64).save(path, '2020-09-06')
+    reference = gff.load_data([path], (1540, 1620), 'null1', [])
+    loaded = gff.load_data([path], (1540, 1620), 'null1', [], dtype=np.float32)
+    for key in ['null', 'Iminus', 'Iplus', 'photo', 'photo_err']:
+        assert reference[key].dtype == np.float64
+        assert loaded[key].dtype == np.float32
+        np.testing.assert_allclose(loaded[key], reference[key], rtol=load_rtol)
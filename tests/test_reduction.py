@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Extraction of the intensities by ``Null`` of :doc:`glint_classes` with the engines of ``getSpectralFlux``
+and for a selection of the outputs.
+
+The ``parallel`` engine gives the same results as the serial ``numba`` engine, 
+the ``projector`` engine differs by rounding errors within **projector_rtol**, 
+relative to the largest absolute value of each output.
+"""
+
+import numpy as np
+import pytest
+import glint_classes
+from test_precision import datacube, channel_pos, sep, spatial_axis, spectral_axis, wl_to_px, px_to_wl
+
+projector_rtol = 1e-12
+
+def _extract(datacube, engine, outputs=None, nb_threads=None):
+    path, dark, positions, widths = datacube
+    img = glint_classes.Null(path)
+    img.preprocess(channel_pos, sep, spatial_axis, dark, outputs=outputs)
+    img.matchSpectralChannels(wl_to_px, px_to_wl)
+    img.getSpectralFlux(spectral_axis, positions, widths, 'fit', engine=engine, nb_threads=nb_threads)
+    img.getIntensities('fit')
+    return img
+
+@pytest.mark.parametrize('engine', ['numba', 'projector'])
+def test_selected_outputs(datacube, engine):
+    full = _extract(datacube, engine)
+    img = _extract(datacube, engine, ['null4'])
+    selected = [glint_classes.output_names.index(name) for name in glint_classes.baseline_outputs['null4']]
+    others = [k for k in range(len(glint_classes.output_names)) if k not in selected]
+    np.testing.assert_array_equal(img.intensities[:,selected], full.intensities[:,selected])
+    assert np.all(np.isnan(img.intensities[:,others]))
+
+def _assertClose(values, reference, rtol):
+    scale = np.max(np.abs(reference), axis=(0,2), keepdims=True)
+    assert np.max(np.abs(values - reference) / scale) <= rtol
+
+@pytest.mark.parametrize('engine, nb_threads', [('parallel', None), ('parallel', 1), ('projector', None)])
+def test_engines(datacube, engine, nb_threads):
+    serial = _extract(datacube, 'numba')
+    img = _extract(datacube, engine, nb_threads=nb_threads)
+    for name in ['amplitude', 'amplitude_error', 'intensities']:
+        values, reference = getattr(img, name), getattr(serial, name)
+        assert values.shape == reference.shape
+        if engine == 'parallel':
+            np.testing.assert_array_equal(values, reference)
+        else:
+            _assertClose(values, reference, projector_rtol)
+    if engine == 'parallel':
+        np.testing.assert_array_equal(img.fit_summary.nb_failed, serial.fit_summary.nb_failed)
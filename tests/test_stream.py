@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Batches of ``streamFrames`` across the files and their frame index in the stores written by ``Null.save``.
+"""
+
+import os
+import numpy as np
+import h5py
+import pytest
+import glint_classes
+
+nb_frames = [7, 13, 5, 1, 9]
+
+@pytest.fixture(scope='module')
+def datacubes(tmp_path_factory):
+    """
+    Small integer datacubes of different lengths, with their frames (frame, spatial, spectral).
+    """
+    rng = np.random.default_rng(0)
+    folder = tmp_path_factory.mktemp('data')
+    paths, cubes = [], []
+    for k, nb in enumerate(nb_frames):
+        cube = rng.integers(0, 1000, (nb, 6, 4)).astype(np.uint16)
+        path = str(folder / ('datacube%s.mat'%(k)))
+        with h5py.File(path, 'w') as f:
+            f.create_dataset('imagedata', data=cube)
+        paths.append(path)
+        cubes.append(np.swapaxes(cube, 1, 2)) # Raw datacubes are stored as (frame, spectral, spatial)
+    return paths, cubes
+
+@pytest.mark.parametrize('batch_size, binning', [(1, 1), (3, 2), (4, 3), (2, 50), (100, 4)])
+def test_stream_frames(datacubes, batch_size, binning):
+    paths, cubes = datacubes
+    frames = np.concatenate(cubes).astype(np.float64)
+    origins = [(path, k) for path, cube in zip(paths, cubes) for k in range(cube.shape[0])]
+    batches = list(glint_classes.streamFrames(paths, batch_size, binning))
+
+    binned = np.concatenate([batch for batch, sources, first_frames in batches])
+    expected = np.array([frames[k:k+binning].mean(axis=0) for k in range(0, frames.shape[0], binning)])
+    assert all([batch.shape[0] == batch_size for batch, sources, first_frames in batches[:-1]])
+    np.testing.assert_allclose(binned, expected, rtol=1e-12)
+
+    index = [(source, first_frame) for batch, sources, first_frames in batches for source, first_frame in zip(sources, first_frames)]
+    assert index == origins[::binning]
+
+def test_frame_index(datacubes, tmp_path):
+    paths, cubes = datacubes
+    batch, sources, first_frames = next(glint_classes.streamFrames(paths, 6, 2)) # Frames of the first two files
+    assert set(sources) == set(paths[:2])
+
+    img = glint_classes.Null(batch)
+    img.which_tracks = np.arange(len(glint_classes.output_names))
+    img.intensities = np.zeros((batch.shape[0], len(glint_classes.output_names), batch.shape[2]))
+    img.wl_scale = np.zeros((len(glint_classes.output_names), batch.shape[2]))
+    for name in glint_classes.output_roles['photometric']:
+        setattr(img, name+'_err', np.zeros((batch.shape[0], batch.shape[2])))
+    path = str(tmp_path / 'store.hdf5')
+    img.save(path, '2020-09-06', append=True, source=sources, frames=first_frames, fps=100.)
+
+    with h5py.File(path, 'r') as f:
+        index = f['frame_index'][()]
+    assert [elt.decode() for elt in index['source']] == [os.path.basename(source) for source in sources]
+    np.testing.assert_array_equal(index['frame'], first_frames)
+    np.testing.assert_allclose(index['timestamp'], [os.path.getmtime(source) + frame / 100. for source, frame in zip(sources, first_frames)])
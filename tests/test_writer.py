@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Errors of the writes done in the background by ``AsyncWriter`` of :doc:`glint_classes`: 
+they are raised again by the next ``submit`` or by ``close``, never left to the exit of the interpreter.
+"""
+
+import threading
+import time
+import pytest
+import glint_classes
+
+timeout = 10. # s
+
+class _Atexit(object):
+    """
+    Functions registered at the exit of the interpreter.
+    """
+    def __init__(self):
+        self.functions = []
+    def register(self, func):
+        self.functions.append(func)
+    def unregister(self, func):
+        self.functions = [elt for elt in self.functions if elt != func]
+
+@pytest.fixture
+def registered(monkeypatch):
+    atexit = _Atexit()
+    monkeypatch.setattr(glint_classes, 'atexit', atexit)
+    return atexit
+
+def _fail(gate=None):
+    if gate is not None:
+        gate.wait(timeout)
+    raise ValueError('Write failed')
+
+def _waitError(writer):
+    start = time.time()
+    while writer.error is None and time.time() - start < timeout:
+        time.sleep(0.01)
+
+def test_error_on_submit(registered):
+    writer = glint_classes.AsyncWriter()
+    assert registered.functions == [writer.close]
+    written = []
+    writer.submit(_fail)
+    _waitError(writer)
+    with pytest.raises(ValueError):
+        writer.submit(written.append, 1)
+    writer.submit(written.append, 2) # The error is raised once
+    writer.close()
+    assert written == [2]
+    assert registered.functions == []
+
+def test_error_on_close(registered):
+    writer = glint_classes.AsyncWriter()
+    written = []
+    gate = threading.Event()
+    writer.submit(_fail, gate)
+    writer.submit(written.append, 1) # Queued before the error, skipped
+    gate.set()
+    with pytest.raises(ValueError):
+        writer.close()
+    assert written == []
+    assert registered.functions == [] # Nothing left for the exit of the interpreter
+    writer.close() # Already raised
+
+def test_error_in_with(registered):
+    with pytest.raises(ValueError):
+        with glint_classes.AsyncWriter() as writer:
+            writer.submit(_fail)
+    assert registered.functions == []
+    # The error of the processing is not hidden by the one of the writer
+    with pytest.raises(KeyError):
+        with glint_classes.AsyncWriter() as writer:
+            writer.submit(_fail)
+            raise KeyError('Processing failed')
+
+def test_error_without_queue():
+    writer = glint_classes.AsyncWriter(queue_size=0)
+    with pytest.raises(ValueError):
+        writer.submit(_fail)
+    writer.close()